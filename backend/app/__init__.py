@@ -7,9 +7,16 @@ import os
 import time
 from .config import config_by_name
 
+try:
+    from flask_sock import Sock
+except ImportError:
+    # The binary live stream endpoint needs flask-sock; the HTTP endpoints work without it
+    Sock = None
+
 db = SQLAlchemy()
 migrate = Migrate()
 jwt = JWTManager()
+sock = Sock() if Sock is not None else None
 
 def create_app(config_name='dev'):
     app = Flask(__name__)
@@ -26,6 +33,8 @@ def create_app(config_name='dev'):
     db.init_app(app)
     migrate.init_app(app, db)
     jwt.init_app(app)
+    if sock is not None:
+        sock.init_app(app)
     
     # Configure CORS - allowing specific origins from config
     allowed_origins = app.config.get('ALLOWED_ORIGINS', 'http://localhost:8080')
@@ -107,6 +116,8 @@ def create_app(config_name='dev'):
             face_service = FaceService()
             if not face_service.initialize():
                 app.logger.warning("Face service initialization failed, but app will continue running with limited functionality")
+            elif app.config.get('FACE_WARMUP', True):
+                face_service.start_warm_up(app)
         except Exception as e:
             app.logger.error(f"Exception during face service initialization: {str(e)}")
             app.logger.warning("Continuing without face recognition functionality")
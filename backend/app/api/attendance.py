@@ -1,26 +1,100 @@
 import base64
+import json
+import uuid
 import numpy as np
 import cv2
 from flask import Blueprint, request, jsonify, current_app
 from datetime import datetime, date
 from app.services.face_service import FaceService
 from app.services.attendance_service import AttendanceService
-from app.utils.auth import require_admin, admin_required
+from app.utils.auth import require_admin, admin_required, is_admin_request, is_admin_token
 from app.models.group import Group
 from app.models.attendance import Attendance
 from app.models.student import Student
-from app import db
+from app import db, sock
 import pytz
 
 attendance_bp = Blueprint('attendance', __name__)
 face_service = FaceService()
 
+def get_requested_group_ids(data=None):
+    """Read the optional group_id/group_ids recognition scope from the request.
+    
+    Values may come from the query string, form fields or the JSON body, as a
+    single ID, a list, or a comma-separated string. Returns None when no scope
+    was requested, so all students are matched. Raises ValueError for invalid
+    or unknown groups.
+    """
+    values = []
+    for source in (request.args, request.form):
+        for key in ('group_id', 'group_ids'):
+            for value in source.getlist(key):
+                values.extend(value.split(','))
+    if data:
+        for key in ('group_id', 'group_ids'):
+            value = data.get(key)
+            if isinstance(value, list):
+                values.extend(value)
+            elif isinstance(value, str):
+                values.extend(value.split(','))
+            elif value is not None:
+                values.append(value)
+    
+    values = [value.strip() if isinstance(value, str) else value for value in values]
+    values = [value for value in values if value != '']
+    if not values:
+        return None
+    
+    try:
+        group_ids = list(dict.fromkeys(int(value) for value in values))
+    except (TypeError, ValueError):
+        raise ValueError("group_id must be an integer or a list of integers")
+    
+    found = {group.id for group in Group.query.filter(Group.id.in_(group_ids)).all()}
+    missing = [group_id for group_id in group_ids if group_id not in found]
+    if missing:
+        raise ValueError(f"Group(s) not found: {', '.join(str(group_id) for group_id in missing)}")
+    return group_ids
+
+def get_camera_session_id(data=None):
+    """Read the optional live camera session ID used to track faces across frames"""
+    session_id = request.headers.get('X-Camera-Session') or request.values.get('session_id')
+    if not session_id and data:
+        session_id = data.get('session_id')
+    if session_id is None:
+        return None
+    return str(session_id)[:64] or None
+
+def record_live_attendance(result):
+    """Record attendance for the faces recognized in a live frame and add each one's action.
+    
+    A skipped frame (see FaceService.process_image_for_attendance) repeats the
+    faces of the last processed frame, whose attendance was already recorded:
+    its recognized entries are stale, carry no action, and the result is marked
+    attendance_recorded false.
+    """
+    result['attendance_recorded'] = not result.get('skipped', False)
+    recognized = result['recognized'] if result['attendance_recorded'] else []
+    for i, person in enumerate(recognized):
+        action = AttendanceService.process_attendance(person['student_id'])
+        result['recognized'][i]['action'] = action
+        # If already checked in (debounced), show goodbye message
+        if action == "debounced":
+            # Get student name
+            student = Student.query.get(person['student_id'])
+            if student:
+                result['recognized'][i]['goodbye_message'] = f"Goodbye, {student.name}!"
+            else:
+                result['recognized'][i]['goodbye_message'] = "Goodbye!"
+    return result
+
 @attendance_bp.route('/live', methods=['POST'])
 @admin_required()
 def process_live_attendance():
-    """Process a single frame for attendance"""
+    """Process a single frame for attendance, optionally limited to the given group(s)"""
     
     # Get image data (either form data or base64 JSON)
+    data = None
     if request.content_type and request.content_type.startswith('multipart/form-data'):
         if 'image' not in request.files:
             return jsonify({"success": False, "message": "No image file provided"}), 400
@@ -43,36 +117,89 @@ def process_live_attendance():
         except Exception as e:
             return jsonify({"success": False, "message": f"Invalid base64 image: {str(e)}"}), 400
     
+    try:
+        group_ids = get_requested_group_ids(data)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    
     # Process the image
-    result = face_service.process_image_for_attendance(image_data)
+    result = face_service.process_image_for_attendance(
+        image_data, group_ids=group_ids, profile='live', session_id=get_camera_session_id(data)
+    )
     
-    # Process attendance for recognized faces
-    for i, person in enumerate(result['recognized']):
-        action = AttendanceService.process_attendance(person['student_id'])
-        result['recognized'][i]['action'] = action
-        # If already checked in (debounced), show goodbye message
-        if action == "debounced":
-            # Get student name
-            student = Student.query.get(person['student_id'])
-            if student:
-                result['recognized'][i]['goodbye_message'] = f"Goodbye, {student.name}!"
-            else:
-                result['recognized'][i]['goodbye_message'] = "Goodbye!"
+    return jsonify(record_live_attendance(result)), 200
+
+def live_stream(ws):
+    """Live attendance over one WebSocket per kiosk.
     
-    return jsonify(result), 200
+    The client first sends a JSON text message with its settings:
+    {"token": ..., "group_ids": [...], "session_id": ...}. The token may be
+    left out when the handshake already carried an admin JWT or X-ADMIN-TOKEN;
+    group_ids and session_id are optional. The server answers
+    {"type": "ready", "session_id": ...}. Every binary message after that is
+    one JPEG frame (WebSocket messages carry their own length), answered in
+    order by a {"type": "result", "frame": n, ...} message holding the same
+    result as POST /live. Clients should send a frame after the previous
+    result arrives, and may end the session with a "close" text message. Authentication and settings are handled once per
+    connection; frames need neither base64 nor JSON parsing.
+    """
+    try:
+        settings = json.loads(ws.receive(timeout=30) or '{}')
+        if not isinstance(settings, dict):
+            raise ValueError("Settings must be a JSON object")
+    except (TypeError, ValueError) as e:
+        ws.send(json.dumps({"type": "error", "message": f"Invalid settings message: {str(e)}"}))
+        return
+    if not (is_admin_request() or is_admin_token(settings.get('token'))):
+        ws.send(json.dumps({"type": "error", "message": "Unauthorized"}))
+        return
+    try:
+        group_ids = get_requested_group_ids(settings)
+    except ValueError as e:
+        ws.send(json.dumps({"type": "error", "message": str(e)}))
+        return
+    
+    # Frames of one connection always share a tracker and change detector
+    session_id = get_camera_session_id(settings) or uuid.uuid4().hex
+    ws.send(json.dumps({"type": "ready", "session_id": session_id}))
+    
+    frame = 0
+    while True:
+        message = ws.receive()
+        if message is None:
+            break
+        if isinstance(message, str):
+            if message.strip() == 'close':
+                break
+            ws.send(json.dumps({"type": "error", "message": "Frames must be sent as binary messages"}))
+            continue
+        frame += 1
+        result = face_service.process_image_for_attendance(
+            message, group_ids=group_ids, profile='live', session_id=session_id
+        )
+        ws.send(json.dumps(dict(record_live_attendance(result), type="result", frame=frame)))
+        db.session.remove()
+
+if sock is not None:
+    sock.route('/live/stream', bp=attendance_bp)(live_stream)
 
 @attendance_bp.route('/upload', methods=['POST'])
 @admin_required()
 def process_group_photo():
-    """Process a group photo for attendance"""
+    """Process a group photo for attendance, optionally limited to the given group(s)"""
     if 'image' not in request.files:
         return jsonify({"success": False, "message": "No image file provided"}), 400
     
     file = request.files['image']
     image_data = file.read()
     
+    try:
+        group_ids = get_requested_group_ids()
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    
     # Process the image
-    result = face_service.process_image_for_attendance(image_data)
+    result = face_service.process_image_for_attendance(image_data, group_ids=group_ids, profile='group')
     
     # Process attendance for recognized faces
     for i, person in enumerate(result['recognized']):
@@ -224,6 +351,23 @@ def get_group_attendance_logs_by_date(group_id):
     except ValueError as e:
         return jsonify({"success": False, "message": str(e)}), 400
 
+@attendance_bp.route('/gallery', methods=['GET'])
+@admin_required()
+def get_gallery_status():
+    """Get the state of the in-memory face gallery used for matching"""
+    return jsonify(face_service.gallery.stats()), 200
+
+@attendance_bp.route('/gallery/rebuild', methods=['POST'])
+@admin_required()
+def rebuild_gallery():
+    """Reload the in-memory face gallery from the database"""
+    size = face_service.rebuild_gallery()
+    return jsonify({
+        "success": True,
+        "message": f"Face gallery rebuilt with {size} embeddings",
+        "gallery": face_service.gallery.stats()
+    }), 200
+
 @attendance_bp.route('/debug/embeddings/<student_id>', methods=['GET'])
 @admin_required()
 def debug_student_embedding(student_id):
@@ -245,7 +389,8 @@ def debug_student_embedding(student_id):
         "student_id": student_id,
         "exists": True,
         "shape": embedding.shape,
-        "dtype": str(embedding.dtype)
+        "dtype": str(embedding.dtype),
+        "format": Student.embedding_format(student.embedding)
     }), 200
 
 @attendance_bp.route('/debug/group/<int:group_id>', methods=['GET'])
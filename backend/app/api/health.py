@@ -2,6 +2,7 @@ from flask import Blueprint, jsonify, current_app, request
 from app.services.face_service import FaceService
 from app.models.student import Student
 from app.utils.auth import admin_required, verify_admin_token
+from app.utils.metrics import metrics
 import time
 import sys
 import os
@@ -38,6 +39,29 @@ def health_check():
         "system_info": system_info
     }), 200
 
+@health_bp.route('/metrics', methods=['GET'])
+@admin_required()
+def get_metrics():
+    """Counters and histograms of this worker process, such as live frames skipped and recognition batch sizes, and its result cache"""
+    snapshot = metrics.snapshot()
+    if face_service.result_cache is not None:
+        snapshot["result_cache"] = face_service.result_cache.stats()
+    if face_service.remote:
+        try:
+            snapshot["inference_server"] = face_service.model.metrics()
+        except Exception as e:
+            snapshot["inference_server"] = {"error": str(e)}
+    return jsonify(snapshot), 200
+
+@health_bp.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 503 until the face models are loaded and warmed up"""
+    ready = face_service.is_ready()
+    return jsonify({
+        "ready": ready,
+        "warmup": face_service.warmup
+    }), 200 if ready else 503
+
 def check_face_service():
     """Check if face recognition service is running properly"""
     start_time = time.time()
@@ -54,7 +78,11 @@ def check_face_service():
             return {
                 "status": "ok",
                 "message": "Face recognition model loaded successfully",
-                "latency": latency
+                "latency": latency,
+                "modules": face_service.active_modules(),
+                "runtime": face_service.runtime,
+                "warmup": face_service.warmup,
+                "gallery": face_service.gallery.stats()
             }
         else:
             return {
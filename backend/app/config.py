@@ -16,9 +16,73 @@ class Config:
     
     # Face recognition settings
     FACE_MATCH_THRESHOLD = float(os.getenv('MATCH_THRESHOLD', 0.60))
+    FACE_MATCH_MARGIN = float(os.getenv('MATCH_MARGIN', 0.0))  # Minimum lead of the best match over the runner-up, 0 = off
+    FACE_ASSIGNMENT = os.getenv('FACE_ASSIGNMENT', 'auto')  # One student per face in a frame: 'auto', 'hungarian', 'greedy' or 'none'
+    FACE_ASSIGNMENT_CANDIDATES = int(os.getenv('FACE_ASSIGNMENT_CANDIDATES', 5))  # Students considered per face when assigning
+    FACE_ASSIGNMENT_HUNGARIAN_MAX_FACES = int(os.getenv('FACE_ASSIGNMENT_HUNGARIAN_MAX_FACES', 50))  # Larger frames use greedy assignment
+    FACE_INDEX_BACKEND = os.getenv('FACE_INDEX_BACKEND', 'flat')  # 'flat' (exact), 'ivf' or 'int8' (approximate)
+    FACE_IVF_NLIST = int(os.getenv('FACE_IVF_NLIST', 0))  # Number of IVF cells, 0 = sqrt(gallery size)
+    FACE_IVF_NPROBE = int(os.getenv('FACE_IVF_NPROBE', 8))  # Cells visited per query
+    FACE_IVF_MIN_TRAIN_SIZE = int(os.getenv('FACE_IVF_MIN_TRAIN_SIZE', 5000))  # Smaller galleries use exact search
+    FACE_RERANK_K = int(os.getenv('FACE_RERANK_K', 10))  # int8 candidates re-scored in float32 per face
+    FACE_GALLERY_SPILL_DIR = os.getenv('FACE_GALLERY_SPILL_DIR', '')  # Where int8 galleries keep their float32 rows, '' = the system temp directory
     FACE_DETECTOR_BACKEND = os.getenv('FACE_DETECTOR_BACKEND', 'retinaface')
+    FACE_ALLOWED_MODULES = os.getenv('FACE_ALLOWED_MODULES', 'detection,recognition')  # InsightFace models to run per face, 'all' adds landmarks and gender/age
     FACE_MODEL_PATH = os.getenv('INSIGHTFACE_MODEL_ROOT', 'models')
+    FACE_MODEL_PRECISION = os.getenv('FACE_MODEL_PRECISION', 'float32')  # 'int8' loads the quantized models written by scripts/quantize_models.py
+    # Detector input size for live webcam frames, group photo uploads and enrollment photos.
+    # Group photos larger than MAX_IMAGE_SIZE are detected at native resolution (up to
+    # max_image_size) in overlapping tiles of tile_size pixels; tile_size 0 disables tiling.
+    FACE_DETECTION_PROFILES = {
+        'live': {'det_size': int(os.getenv('FACE_DET_SIZE_LIVE', 320))},
+        'group': {
+            'det_size': int(os.getenv('FACE_DET_SIZE_GROUP', 640)),
+            'tile_size': int(os.getenv('FACE_GROUP_TILE_SIZE', 640)),
+            'tile_overlap': int(os.getenv('FACE_GROUP_TILE_OVERLAP', 96)),
+            'tile_workers': int(os.getenv('FACE_GROUP_TILE_WORKERS', 0)),  # 0 = min(4, thread budget); tiles share FACE_ORT_TILE_INTRA_OP_THREADS
+            'max_image_size': int(os.getenv('FACE_GROUP_MAX_IMAGE_SIZE', 6000)),
+        },
+        'enroll': {'det_size': int(os.getenv('FACE_DET_SIZE_ENROLL', 640))},
+    }
+    FACE_INFERENCE_SOCKET = os.getenv('FACE_INFERENCE_SOCKET')  # Unix socket of the inference server, unset = load the models in every worker
+    FACE_INFERENCE_TIMEOUT = float(os.getenv('FACE_INFERENCE_TIMEOUT', 30.0))  # Seconds to wait for one inference server request
+    FACE_WORKER_COUNT = int(os.getenv('WEB_CONCURRENCY', 1))  # Gunicorn workers sharing this host's cores
+    FACE_CPU_THREADS = int(os.getenv('FACE_CPU_THREADS', 0))  # Threads per worker for inference and BLAS, 0 = cores / workers
+    FACE_ORT_INTRA_OP_THREADS = int(os.getenv('FACE_ORT_INTRA_OP_THREADS', 0))  # 0 = the per-worker thread budget
+    FACE_ORT_TILE_INTRA_OP_THREADS = int(os.getenv('FACE_ORT_TILE_INTRA_OP_THREADS', 0))  # Per tile of a tiled detection, 0 = thread budget / min(4, thread budget)
+    FACE_ORT_INTER_OP_THREADS = int(os.getenv('FACE_ORT_INTER_OP_THREADS', 1))  # Only used by the parallel execution mode
+    FACE_ORT_GRAPH_OPTIMIZATION = os.getenv('FACE_ORT_GRAPH_OPTIMIZATION', 'all')  # disable, basic, extended or all
+    FACE_ORT_EXECUTION_MODE = os.getenv('FACE_ORT_EXECUTION_MODE', 'sequential')  # sequential or parallel
+    FACE_ORT_CPU_MEM_ARENA = os.getenv('FACE_ORT_CPU_MEM_ARENA', 'true').lower() == 'true'  # Keep freed tensors for reuse
+    FACE_ORT_MEM_PATTERN = os.getenv('FACE_ORT_MEM_PATTERN', 'true').lower() == 'true'  # Preallocate from the memory pattern of earlier runs
+    FACE_ORT_ALLOW_SPINNING = os.getenv('FACE_ORT_ALLOW_SPINNING', 'true').lower() == 'true'  # Busy-wait idle threads; disable on shared hosts
+    FACE_RECOGNITION_BATCH_SIZE = int(os.getenv('FACE_RECOGNITION_BATCH_SIZE', 32))  # Most face crops per recognition inference
+    FACE_MICROBATCH = os.getenv('FACE_MICROBATCH', 'true').lower() == 'true'  # Merge face crops of concurrent requests into one recognition batch
+    FACE_MICROBATCH_WAIT_MS = float(os.getenv('FACE_MICROBATCH_WAIT_MS', 2.0))  # Longest a crop waits for others to join its batch
+    FACE_WARMUP = os.getenv('FACE_WARMUP', 'true').lower() == 'true'  # Run synthetic inferences before reporting ready
+    FACE_WARMUP_BATCH_SIZES = [int(size) for size in os.getenv('FACE_WARMUP_BATCH_SIZES', '1,8,32').split(',') if size.strip()]  # Recognition batch sizes to warm up
     MAX_IMAGE_SIZE = int(os.getenv('MAX_IMAGE_SIZE', 1024))  # Increased from 800 to 1024
+    FACE_QUALITY = os.getenv('FACE_QUALITY', 'true').lower() == 'true'  # Skip recognition of faces that cannot be matched reliably
+    FACE_QUALITY_MIN_FACE_SIZE = int(os.getenv('FACE_QUALITY_MIN_FACE_SIZE', 20))  # Pixels, shorter side of the face box
+    FACE_QUALITY_MIN_EYE_DISTANCE = float(os.getenv('FACE_QUALITY_MIN_EYE_DISTANCE', 10))  # Pixels between the eye landmarks
+    FACE_QUALITY_MAX_YAW = float(os.getenv('FACE_QUALITY_MAX_YAW', 55))  # Degrees a face may be turned sideways
+    FACE_QUALITY_MAX_PITCH = float(os.getenv('FACE_QUALITY_MAX_PITCH', 45))  # Degrees a face may be tilted up or down
+    FACE_QUALITY_MIN_BLUR = float(os.getenv('FACE_QUALITY_MIN_BLUR', 10))  # Laplacian variance of the face, lower is blurrier
+    FACE_MAX_FACES = int(os.getenv('FACE_MAX_FACES', 64))  # Largest faces recognized per frame, 0 = all
+    FACE_RESULT_CACHE_MB = float(os.getenv('FACE_RESULT_CACHE_MB', 32))  # Memory for faces and embeddings of recently submitted images, 0 = off
+    FACE_TRACKING = os.getenv('FACE_TRACKING', 'true').lower() == 'true'  # Reuse identities of faces tracked across live frames
+    FACE_TRACK_IOU = float(os.getenv('FACE_TRACK_IOU', 0.3))  # Minimum box overlap to continue a track
+    FACE_TRACK_VERIFY_EVERY = int(os.getenv('FACE_TRACK_VERIFY_EVERY', 10))  # Re-run recognition on a track every N frames
+    FACE_TRACK_VERIFY_UNKNOWN_EVERY = int(os.getenv('FACE_TRACK_VERIFY_UNKNOWN_EVERY', 1))  # Same for tracks not recognized as a student
+    FACE_TRACK_MAX_MISSED = int(os.getenv('FACE_TRACK_MAX_MISSED', 3))  # Frames a face may go undetected before its track ends
+    FACE_TRACK_SESSION_TTL = int(os.getenv('FACE_TRACK_SESSION_TTL', 120))  # Seconds before an idle camera session is forgotten
+    FACE_MOTION_GATING = os.getenv('FACE_MOTION_GATING', 'true').lower() == 'true'  # Skip inference for unchanged live frames
+    FACE_MOTION_PIXEL_THRESHOLD = int(os.getenv('FACE_MOTION_PIXEL_THRESHOLD', 25))  # Gray level change that counts a thumbnail pixel as changed
+    FACE_MOTION_MIN_CHANGED = float(os.getenv('FACE_MOTION_MIN_CHANGED', 0.005))  # Fraction of changed pixels that means the scene changed
+    FACE_MOTION_MAX_AGE = float(os.getenv('FACE_MOTION_MAX_AGE', 5.0))  # Seconds a cached live result may be reused
+    GALLERY_REFRESH_SECONDS = int(os.getenv('GALLERY_REFRESH_SECONDS', 30))  # How often to check the gallery for new enrollments
+    FACE_GALLERY_STORE_PATH = os.getenv('FACE_GALLERY_STORE_PATH')  # Gallery file shared by all workers on a host, unset = per-worker gallery
+    FACE_GALLERY_PUBLISH_DELAY = float(os.getenv('FACE_GALLERY_PUBLISH_DELAY', 2.0))  # Seconds to batch enrollments before republishing
     
     # Attendance settings
     DEBOUNCE_SECONDS = int(os.getenv('DEBOUNCE_SECONDS', 30))
@@ -29,6 +93,8 @@ class Config:
     # Upload settings
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
     MAX_CONTENT_LENGTH = 32 * 1024 * 1024  # Increased from 16MB to 32MB max upload
+    # WebSocket live stream: ping idle kiosks and cap the size of one frame
+    SOCK_SERVER_OPTIONS = {'ping_interval': 25, 'max_message_size': int(os.getenv('LIVE_STREAM_MAX_FRAME_BYTES', 4 * 1024 * 1024))}
     
     # CORS settings
     ALLOWED_ORIGINS = os.getenv('ALLOWED_ORIGINS', 'http://localhost:8080,http://127.0.0.1:8080,http://localhost:3000,http://127.0.0.1:3000,http://localhost:5173,http://127.0.0.1:5173,https://face-log-book.vercel.app')
@@ -61,6 +127,10 @@ class TestingConfig(Config):
     )
     # Use a predictable admin token for tests
     ADMIN_TOKEN = 'test_token'
+    # Always pick up enrollments made between test requests
+    GALLERY_REFRESH_SECONDS = 0
+    # Tests call warm_up themselves
+    FACE_WARMUP = False
 
 class ProductionConfig(Config):
     """Production configuration."""
@@ -1,10 +1,35 @@
 from datetime import datetime
 from app import db
+from sqlalchemy.dialects import mysql
 import json
 import numpy as np
+import io
 import pickle
+import struct
 import os
 
+# Stored embedding layout: 8-byte header (magic, format version, dimension)
+# followed by the vector as raw little-endian float32
+EMBEDDING_MAGIC = b'FEMB'
+EMBEDDING_FORMAT_VERSION = 1
+EMBEDDING_HEADER = struct.Struct('<4sHH')
+
+
+class LegacyEmbeddingUnpickler(pickle.Unpickler):
+    """Unpickler for embeddings stored by older versions that only rebuilds numpy arrays"""
+    
+    ALLOWED = {
+        ('numpy', 'ndarray'),
+        ('numpy', 'dtype'),
+        ('numpy.core.multiarray', '_reconstruct'),
+        ('numpy._core.multiarray', '_reconstruct'),
+    }
+    
+    def find_class(self, module, name):
+        if (module, name) not in self.ALLOWED:
+            raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from a stored embedding")
+        return super().find_class(module, name)
+
 class Student(db.Model):
     __tablename__ = 'students'
     
@@ -14,6 +39,10 @@ class Student(db.Model):
     embedding = db.Column(db.LargeBinary, nullable=True)  # Changed to nullable=True
     group_id = db.Column(db.Integer, db.ForeignKey('groups.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped on every write so workers notice re-enrollments and group moves;
+    # microseconds on MySQL so writes within one second still differ
+    updated_at = db.Column(db.DateTime().with_variant(mysql.DATETIME(fsp=6), 'mysql'),
+                           default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     # Relationships
     group = db.relationship('Group', back_populates='students')
@@ -65,17 +94,46 @@ class Student(db.Model):
             }
     
     def set_embedding(self, embedding_array):
-        """Convert numpy array to binary for storage using pickle"""
+        """Normalize a numpy array and store it as raw float32 bytes"""
         if isinstance(embedding_array, np.ndarray):
             # Normalize the vector for cosine similarity
             embedding_array = embedding_array / np.linalg.norm(embedding_array)
-            # Serialize using pickle
-            self.embedding = pickle.dumps(embedding_array.astype('float32'))
+            self.embedding = Student.encode_embedding(embedding_array)
         else:
             raise TypeError("Embedding must be a numpy array")
     
     def get_embedding(self):
         """Convert stored binary back to numpy array"""
-        if self.embedding:
-            return pickle.loads(self.embedding)
-        return None
\ No newline at end of file
+        return Student.decode_embedding(self.embedding)
+    
+    @staticmethod
+    def encode_embedding(embedding_array):
+        """Serialize a vector as a header plus little-endian float32 values"""
+        vector = np.ascontiguousarray(np.ravel(embedding_array), dtype='<f4')
+        return EMBEDDING_HEADER.pack(EMBEDDING_MAGIC, EMBEDDING_FORMAT_VERSION, vector.size) + vector.tobytes()
+    
+    @staticmethod
+    def embedding_format(data):
+        """Name of the format a stored embedding uses ('float32-v1' or 'pickle')"""
+        if not data:
+            return None
+        if data[:4] == EMBEDDING_MAGIC:
+            return f"float32-v{EMBEDDING_HEADER.unpack_from(data)[1]}"
+        return 'pickle'
+    
+    @staticmethod
+    def decode_embedding(data):
+        """Convert a stored embedding column value back to a numpy array.
+        
+        Raw float32 values are returned as a read-only view of the bytes, without
+        copying. Rows still pickled by older versions are unpickled until the
+        embedding migration has converted them.
+        """
+        if not data:
+            return None
+        if data[:4] == EMBEDDING_MAGIC:
+            _, version, dim = EMBEDDING_HEADER.unpack_from(data)
+            if version != EMBEDDING_FORMAT_VERSION:
+                raise ValueError(f"Unsupported embedding format version {version}")
+            return np.frombuffer(data, dtype='<f4', count=dim, offset=EMBEDDING_HEADER.size)
+        return LegacyEmbeddingUnpickler(io.BytesIO(data)).load()
@@ -0,0 +1,58 @@
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    # scipy ships with insightface, but greedy assignment works without it
+    linear_sum_assignment = None
+
+
+def assign_faces(scores, method='auto', hungarian_max_faces=50):
+    """Assign each student (column) to at most one face (row) of a frame.
+
+    scores is an (F x C) matrix of similarities with -inf where a face may not be
+    matched to a student (for example, below the match threshold). Returns an
+    array holding the assigned column for every face, or -1.
+
+    'greedy' repeatedly takes the highest remaining score whose face and student
+    are both still free. 'hungarian' maximizes the total score of the matched
+    pairs and is used by 'auto' for frames of up to hungarian_max_faces faces
+    when scipy is available.
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    faces, students = scores.shape
+    assignment = np.full(faces, -1, dtype=np.intp)
+    valid = np.isfinite(scores)
+    if not valid.any():
+        return assignment
+
+    if method == 'auto':
+        use_hungarian = linear_sum_assignment is not None and faces <= hungarian_max_faces
+        method = 'hungarian' if use_hungarian else 'greedy'
+
+    if method == 'hungarian':
+        if linear_sum_assignment is None:
+            raise RuntimeError("Hungarian assignment requires scipy")
+        # Forbidden pairs cost more than every allowed pairing combined
+        penalty = -(np.abs(scores[valid]).sum() + 1.0) * faces
+        rows, cols = linear_sum_assignment(np.where(valid, scores, penalty), maximize=True)
+        keep = valid[rows, cols]
+        assignment[rows[keep]] = cols[keep]
+        return assignment
+
+    if method != 'greedy':
+        raise ValueError(f"Unknown face assignment method '{method}'")
+
+    face_taken = np.zeros(faces, dtype=bool)
+    student_taken = np.zeros(students, dtype=bool)
+    candidates = np.flatnonzero(valid)
+    order = candidates[np.argsort(-scores.ravel()[candidates], kind='stable')]
+    for face, student in zip(*np.unravel_index(order, scores.shape)):
+        if face_taken[face] or student_taken[student]:
+            continue
+        assignment[face] = student
+        face_taken[face] = True
+        student_taken[student] = True
+        if face_taken.all() or student_taken.all():
+            break
+    return assignment
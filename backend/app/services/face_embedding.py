@@ -0,0 +1,31 @@
+import numpy as np
+from insightface.utils import face_align
+
+
+def recognizer_batch_limit(recognizer, max_batch):
+    """Largest batch the recognizer accepts: max_batch, or 1 for models exported with a fixed batch dimension"""
+    batch_dim = recognizer.input_shape[0]
+    if isinstance(batch_dim, int) and batch_dim > 0:
+        return min(max_batch, batch_dim)
+    return max(max_batch, 1)
+
+
+def embed_faces(recognizer, img, faces, max_batch=32):
+    """Set the embedding of every face with one recognizer inference per batch.
+
+    Equivalent to calling recognizer.get(img, face) for each face, but the
+    aligned crops are stacked into batches of up to max_batch, so a frame with
+    many faces costs a few ONNX Runtime calls instead of one per face. Faces
+    without landmarks cannot be aligned and keep no embedding.
+    """
+    faces = [face for face in faces if face.kps is not None]
+    if not faces:
+        return
+    max_batch = recognizer_batch_limit(recognizer, max_batch)
+    image_size = recognizer.input_size[0]
+    for start in range(0, len(faces), max_batch):
+        chunk = faces[start:start + max_batch]
+        crops = [face_align.norm_crop(img, landmark=face.kps, image_size=image_size) for face in chunk]
+        embeddings = np.asarray(recognizer.get_feat(crops))
+        for face, embedding in zip(chunk, embeddings):
+            face.embedding = embedding.flatten()
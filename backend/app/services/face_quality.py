@@ -0,0 +1,95 @@
+import cv2
+import numpy as np
+
+# Side of the grayscale crop the blur score is measured on, so it does not depend on face size
+BLUR_CROP_SIZE = 64
+
+
+def estimate_pose(kps):
+    """Rough (yaw, pitch) in degrees from the five RetinaFace landmarks.
+
+    Yaw compares the nose's horizontal distance to each eye; pitch compares
+    where the nose sits between the eye line and the mouth line, which is
+    about halfway on a frontal face.
+    """
+    left_eye, right_eye, nose, left_mouth, right_mouth = np.asarray(kps, dtype=np.float32)[:5]
+    to_left = abs(nose[0] - left_eye[0])
+    to_right = abs(right_eye[0] - nose[0])
+    yaw = np.degrees(np.arcsin(np.clip((to_left - to_right) / max(to_left + to_right, 1e-6), -1, 1)))
+    eye_y = (left_eye[1] + right_eye[1]) / 2
+    mouth_y = (left_mouth[1] + right_mouth[1]) / 2
+    position = (nose[1] - eye_y) / max(mouth_y - eye_y, 1e-6)
+    pitch = np.degrees(np.arcsin(np.clip((position - 0.5) * 2, -1, 1)))
+    return float(yaw), float(pitch)
+
+
+def blur_score(img, bbox):
+    """Variance of the Laplacian over the face, measured on a fixed-size grayscale crop; low means blurred"""
+    h, w = img.shape[:2]
+    x1, y1 = max(int(bbox[0]), 0), max(int(bbox[1]), 0)
+    x2, y2 = min(int(bbox[2]), w), min(int(bbox[3]), h)
+    if x2 - x1 < 2 or y2 - y1 < 2:
+        return 0.0
+    crop = img[y1:y2, x1:x2]
+    gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY) if crop.ndim == 3 else crop
+    gray = cv2.resize(gray, (BLUR_CROP_SIZE, BLUR_CROP_SIZE), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+class QualityGate:
+    """Rejects detected faces that are too small, blurred or turned away to be recognized.
+
+    Checks run from cheapest to most expensive and stop at the first failure:
+    the number of faces (the largest max_faces are kept), the face box's
+    shorter side, the distance between the eyes, the landmark pose estimate
+    and the blur score. A limit of 0 turns its check off. Faces without
+    landmarks skip the eye distance and pose checks.
+    """
+
+    def __init__(self, min_face_size=20, min_eye_distance=10, max_yaw=55, max_pitch=45, min_blur=10, max_faces=64):
+        self.min_face_size = min_face_size
+        self.min_eye_distance = min_eye_distance
+        self.max_yaw = max_yaw
+        self.max_pitch = max_pitch
+        self.min_blur = min_blur
+        self.max_faces = max_faces
+
+    def assess(self, img, face):
+        """Return (reason, measures) for one face; reason is None when it may be recognized"""
+        x1, y1, x2, y2 = face.bbox[:4]
+        measures = {"face_size": round(float(min(x2 - x1, y2 - y1)), 1)}
+        if self.min_face_size and measures["face_size"] < self.min_face_size:
+            return "too_small", measures
+
+        if face.kps is not None:
+            measures["eye_distance"] = round(float(np.linalg.norm(face.kps[1] - face.kps[0])), 1)
+            if self.min_eye_distance and measures["eye_distance"] < self.min_eye_distance:
+                return "eyes_too_close", measures
+            yaw, pitch = estimate_pose(face.kps)
+            measures["yaw"], measures["pitch"] = round(yaw, 1), round(pitch, 1)
+            if (self.max_yaw and abs(yaw) > self.max_yaw) or (self.max_pitch and abs(pitch) > self.max_pitch):
+                return "pose", measures
+
+        if self.min_blur:
+            measures["blur"] = round(blur_score(img, face.bbox), 1)
+            if measures["blur"] < self.min_blur:
+                return "blurred", measures
+        return None, measures
+
+    def filter(self, img, faces):
+        """Split faces into (accepted indices, rejected) where rejected maps index to (reason, measures)"""
+        rejected = {}
+        candidates = list(range(len(faces)))
+        if self.max_faces and len(candidates) > self.max_faces:
+            by_area = sorted(candidates, key=lambda i: -(faces[i].bbox[2] - faces[i].bbox[0]) * (faces[i].bbox[3] - faces[i].bbox[1]))
+            for i in by_area[self.max_faces:]:
+                rejected[i] = ("max_faces", {})
+            candidates = sorted(by_area[:self.max_faces])
+        accepted = []
+        for i in candidates:
+            reason, measures = self.assess(img, faces[i])
+            if reason is None:
+                accepted.append(i)
+            else:
+                rejected[i] = (reason, measures)
+        return accepted, rejected
@@ -1,13 +1,39 @@
-import os
-import cv2
 import numpy as np
 import insightface
-from insightface.app import FaceAnalysis
+from insightface.app.common import Face
+from contextlib import nullcontext
 from datetime import datetime
+import threading
 import time
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, object_session
 from app import db
 from app.models.student import Student
-from flask import current_app
+from app.services.gallery_index import GalleryIndex
+from app.services.ivf_index import IVFIndex
+from app.services.quantized_index import QuantizedIndex
+from app.services.face_assignment import assign_faces
+from app.services.tiled_detection import detect_tiled
+from app.services.face_embedding import embed_faces, recognizer_batch_limit
+from app.services.micro_batcher import BatchedRecognizer
+from app.services.face_quality import QualityGate
+from app.services.result_cache import ResultCache, content_key
+from app.services.inference_runtime import (
+    TunedFaceAnalysis, detector_session, limit_library_threads, model_pack, parse_allowed_modules, runtime_settings,
+    session_options
+)
+from app.services.face_tracker import SessionRegistry
+from app.services.motion_gate import MotionGate
+from app.utils.metrics import metrics
+from app.utils.image_io import ImageDecodeError, image_dimensions, load_image
+from app.services.gallery_store import GalleryStore
+from app.services.inference_client import RemoteFaceAnalysis
+from app.services.inference_protocol import InferenceError
+from flask import current_app, has_app_context
+
+# Estimated bytes a result cache entry and each of its faces take besides their arrays
+CACHE_ENTRY_OVERHEAD = 512
+CACHE_FACE_OVERHEAD = 640
 
 class FaceService:
     _instance = None
@@ -17,6 +43,24 @@ class FaceService:
             cls._instance = super(FaceService, cls).__new__(cls)
             cls._instance.initialized = False
             cls._instance.model = None
+            cls._instance._tile_session = None
+            cls._instance.runtime = {}
+            cls._instance.warmup = {"ready": False}
+            cls._instance._batched_recognizer = None
+            cls._instance._batcher_lock = threading.Lock()
+            cls._instance.gallery = GalleryIndex()
+            cls._instance._gallery_signature = None
+            cls._instance._gallery_checked_at = 0.0
+            cls._instance._local_writes = {}
+            cls._instance._local_count_delta = 0
+            cls._instance._local_written_at = None
+            cls._instance._store = None
+            cls._instance._store_lock = threading.RLock()
+            cls._instance._unpublished = {}
+            cls._instance._publish_timer = None
+            cls._instance._trackers = SessionRegistry()
+            cls._instance._motion_gates = SessionRegistry(factory=MotionGate)
+            cls._instance.result_cache = None
         return cls._instance
     
     def __init__(self):
@@ -32,13 +76,44 @@ class FaceService:
             # Initialize InsightFace model
             model_path = current_app.config.get('FACE_MODEL_PATH')
             detector_backend = current_app.config.get('FACE_DETECTOR_BACKEND')
+            allowed_modules = self._allowed_modules()
+            
+            # Leave the models to the inference server when one is configured
+            socket_path = current_app.config.get('FACE_INFERENCE_SOCKET')
+            if socket_path:
+                return self._connect_inference_server(socket_path)
             
             try:
+                # Keep this worker's ONNX Runtime, BLAS and OpenCV threads within its share of the cores
+                runtime = runtime_settings(current_app.config)
+                runtime["blas_limit"] = limit_library_threads(runtime["thread_budget"])
+                
+                # The INT8 models are a quantized copy of the pack, when one has been made
+                precision = current_app.config.get('FACE_MODEL_PRECISION', 'float32')
+                runtime["model_pack"], runtime["model_precision"] = model_pack(model_path, detector_backend, precision)
+                if runtime["model_precision"] != precision:
+                    current_app.logger.warning(f"No {precision} models found for '{detector_backend}', "
+                                               f"run scripts/quantize_models.py; using the float models")
+                
                 # Try to initialize the face model
-                self.model = FaceAnalysis(name=detector_backend, root=model_path, providers=['CPUExecutionProvider'])
-                self.model.prepare(ctx_id=0, det_size=(640, 640))
+                self.model = TunedFaceAnalysis(name=runtime["model_pack"], root=model_path, allowed_modules=allowed_modules,
+                                               providers=['CPUExecutionProvider'], sess_options=session_options(runtime))
+                self.runtime = runtime
+                self.model.prepare(ctx_id=0, det_size=self._detection_size('group'))
+                # Tiles run side by side, each on a detector session with a share of the thread budget
+                self._tile_session = None
+                if self._tiling_profiles() and runtime['tile_intra_op_threads'] != runtime['intra_op_threads']:
+                    self._tile_session = detector_session(
+                        self.model.det_model, ['CPUExecutionProvider'],
+                        session_options({**runtime, 'intra_op_threads': runtime['tile_intra_op_threads']})
+                    )
                 self.initialized = True
-                current_app.logger.info("Face recognition model successfully initialized")
+                current_app.logger.info(f"Face recognition model successfully initialized with modules: {', '.join(self.active_modules())}")
+                current_app.logger.info(f"ONNX Runtime uses {runtime['intra_op_threads']} intra-op threads "
+                                        f"({runtime['workers']} workers on {runtime['cores']} cores), "
+                                        f"{runtime['tile_intra_op_threads']} per tile on {runtime['tile_workers']} tile workers")
+                if 'recognition' not in self.model.models:
+                    current_app.logger.warning("Recognition module is not loaded; faces will be detected but not matched")
                 return True
             except ModuleNotFoundError as e:
                 current_app.logger.error(f"Module error during face model initialization: {str(e)}")
@@ -53,7 +128,292 @@ class FaceService:
             current_app.logger.error(f"Failed to initialize face model: {str(e)}")
             return False
     
-    def detect_and_embed_face(self, image_data):
+    def _connect_inference_server(self, socket_path):
+        """Use the models of the inference server (see inference_server) instead of loading them"""
+        try:
+            self.model = RemoteFaceAnalysis(socket_path, current_app.config.get('FACE_INFERENCE_TIMEOUT', 30.0))
+        except InferenceError as e:
+            current_app.logger.error(f"Could not connect to the face inference server: {str(e)}")
+            return False
+        self.runtime = {"inference_socket": socket_path, "inference_processes": self.model.processes}
+        # The server warms up every process before it accepts requests
+        self.warmup = {"ready": True, "remote": True}
+        self.initialized = True
+        current_app.logger.info(f"Using face inference server at {socket_path} with modules: {', '.join(self.active_modules())}")
+        return True
+    
+    @property
+    def remote(self):
+        """Whether inference runs in the inference server rather than in this process"""
+        return isinstance(self.model, RemoteFaceAnalysis)
+    
+    @staticmethod
+    def _allowed_modules():
+        """InsightFace modules to load from FACE_ALLOWED_MODULES, or None for all of them"""
+        return parse_allowed_modules(current_app.config.get('FACE_ALLOWED_MODULES', 'detection,recognition'))
+    
+    def active_modules(self):
+        """Names of the InsightFace modules that are loaded and run on every face"""
+        if self.model is None:
+            return []
+        return sorted(self.model.models)
+    
+    def start_warm_up(self, app):
+        """Run warm_up on a background thread so the worker can answer readiness checks meanwhile"""
+        thread = threading.Thread(target=self._warm_up_in_context, args=(app,), name='face-warm-up', daemon=True)
+        thread.start()
+        return thread
+    
+    def _warm_up_in_context(self, app):
+        with app.app_context():
+            self.warm_up()
+    
+    def warm_up(self):
+        """Run synthetic inferences so real requests do not pay ONNX Runtime's one-off costs.
+        
+        The detector runs once at the input size of every detection profile (the
+        tile session too for profiles that tile) and the recognizer once per
+        FACE_WARMUP_BATCH_SIZES batch size, which makes ONNX Runtime allocate its
+        buffers and pick kernels for those shapes and RetinaFace cache their
+        anchors. The worker is ready afterwards, also
+        when a warm-up inference fails.
+        """
+        if not self.initialized:
+            return False
+        if self.remote:
+            return True
+        start_time = time.time()
+        warmup = {"ready": True, "profiles": {}, "batch_sizes": {}}
+        try:
+            for profile in current_app.config.get('FACE_DETECTION_PROFILES', {}):
+                det_size = self._detection_size(profile)
+                profile_start = time.time()
+                self.model.det_model.detect(np.zeros((det_size[1], det_size[0], 3), dtype=np.uint8),
+                                            input_size=det_size, max_num=0)
+                warmup["profiles"][profile] = int((time.time() - profile_start) * 1000)
+            for profile in self._tiling_profiles():
+                if self._tile_detector() is not self.model.det_model:
+                    det_size = self._detection_size(profile)
+                    self._tile_detector().detect(np.zeros((det_size[1], det_size[0], 3), dtype=np.uint8),
+                                                 input_size=det_size, max_num=0)
+            
+            recognizer = self.model.models.get('recognition')
+            if recognizer is not None:
+                limit = recognizer_batch_limit(recognizer, current_app.config.get('FACE_RECOGNITION_BATCH_SIZE', 32))
+                width, height = recognizer.input_size
+                crop = np.zeros((height, width, 3), dtype=np.uint8)
+                for size in sorted({min(size, limit) for size in current_app.config.get('FACE_WARMUP_BATCH_SIZES', [1])}):
+                    batch_start = time.time()
+                    recognizer.get_feat([crop] * size)
+                    warmup["batch_sizes"][str(size)] = int((time.time() - batch_start) * 1000)
+        except Exception as e:
+            current_app.logger.error(f"Face model warm-up failed: {str(e)}")
+            warmup["error"] = str(e)
+        warmup["duration_ms"] = int((time.time() - start_time) * 1000)
+        self.warmup = warmup
+        current_app.logger.info(f"Face models warmed up in {warmup['duration_ms']} ms "
+                                f"(profiles: {warmup['profiles']}, batch sizes: {warmup['batch_sizes']})")
+        return True
+    
+    def is_ready(self):
+        """Whether this worker should receive traffic: models loaded and, unless disabled, warmed up"""
+        if not self.initialized:
+            return False
+        return self.warmup["ready"] or not current_app.config.get('FACE_WARMUP', True)
+    
+    @staticmethod
+    def _detection_size(profile):
+        """Detector input (width, height) for a profile in FACE_DETECTION_PROFILES"""
+        settings = current_app.config.get('FACE_DETECTION_PROFILES', {}).get(profile)
+        if settings is None:
+            current_app.logger.warning(f"Unknown face detection profile '{profile}', using 640x640")
+            return (640, 640)
+        size = settings.get('det_size', 640)
+        width, height = (size, size) if isinstance(size, int) else size
+        # RetinaFace strides need multiples of 32
+        return (-(-width // 32) * 32, -(-height // 32) * 32)
+    
+    @staticmethod
+    def _max_image_size(profile, h, w):
+        """Longest side an image is reduced to before detection.
+        
+        Profiles with a tile_size keep images larger than MAX_IMAGE_SIZE at native
+        resolution (up to the profile's max_image_size) and detect them in tiles.
+        """
+        max_size = current_app.config.get('MAX_IMAGE_SIZE', 800)
+        settings = current_app.config.get('FACE_DETECTION_PROFILES', {}).get(profile) or {}
+        if settings.get('tile_size') and max(h, w) > max_size:
+            return settings.get('max_image_size', 6000)
+        return max_size
+    
+    @staticmethod
+    def _tiling_profiles():
+        """Names of the detection profiles that detect large images in tiles"""
+        profiles = current_app.config.get('FACE_DETECTION_PROFILES', {})
+        return [profile for profile, settings in profiles.items() if (settings or {}).get('tile_size')]
+    
+    def _tile_detector(self):
+        """Detector for tiles: a session with tile_intra_op_threads threads, or the shared detector"""
+        if self._tile_session is not None and not self.remote:
+            return self._tile_session
+        return self.model.det_model
+    
+    def _tile_workers(self):
+        """Tiles to detect concurrently when FACE_GROUP_TILE_WORKERS is not set.
+        
+        Locally tiles run on tile_workers threads, each calling a detector
+        session with tile_intra_op_threads ONNX Runtime threads, so together they
+        stay within the thread budget. Each inference server process runs one
+        tile at a time.
+        """
+        if 'inference_processes' in self.runtime:
+            return min(4, self.runtime['inference_processes'])
+        return self.runtime.get('tile_workers') or 1
+    
+    def _detect_faces(self, img_rgb, profile, analyze=True):
+        """Detect faces with the profile's detector input size, then run the other loaded modules on each.
+        
+        The detector model takes any input shape, so every profile shares one ONNX
+        session; RetinaFace caches the anchor grid of each shape it has seen.
+        Images larger than MAX_IMAGE_SIZE are detected in tiles when the profile
+        has a tile_size; embeddings are then taken from the full-resolution image.
+        With analyze=False only detection runs (see _analyze_faces).
+        """
+        det_size = self._detection_size(profile)
+        settings = current_app.config.get('FACE_DETECTION_PROFILES', {}).get(profile) or {}
+        tile_size = settings.get('tile_size', 0)
+        if tile_size and max(img_rgb.shape[:2]) > current_app.config.get('MAX_IMAGE_SIZE', 800):
+            start_time = time.time()
+            bboxes, kpss, tiles = detect_tiled(
+                self._tile_detector(), img_rgb, det_size, tile_size,
+                settings.get('tile_overlap', 96),
+                settings.get('tile_workers') or self._tile_workers()
+            )
+            current_app.logger.debug(f"Tiled detection found {bboxes.shape[0]} faces in {tiles} tiles "
+                                     f"({img_rgb.shape[1]}x{img_rgb.shape[0]}) in {int((time.time() - start_time) * 1000)} ms")
+        else:
+            bboxes, kpss = self.model.det_model.detect(img_rgb, input_size=det_size, max_num=0)
+        faces = [
+            Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+            for i in range(bboxes.shape[0])
+        ]
+        if analyze:
+            self._analyze_faces(img_rgb, faces)
+        return faces
+    
+    def _recognizer(self):
+        """The recognition model, behind a micro-batcher shared by concurrent requests when FACE_MICROBATCH is on"""
+        recognizer = self.model.models.get('recognition') if self.model is not None else None
+        if recognizer is None or not current_app.config.get('FACE_MICROBATCH', True):
+            return recognizer
+        with self._batcher_lock:
+            if self._batched_recognizer is None or self._batched_recognizer.recognizer is not recognizer:
+                self._batched_recognizer = BatchedRecognizer(
+                    recognizer,
+                    recognizer_batch_limit(recognizer, current_app.config.get('FACE_RECOGNITION_BATCH_SIZE', 32)),
+                    current_app.config.get('FACE_MICROBATCH_WAIT_MS', 2.0)
+                )
+            return self._batched_recognizer
+    
+    def _analyze_faces(self, img_rgb, faces):
+        """Run the loaded modules other than detection on detected faces.
+        
+        Recognition runs batched over all faces of the frame (see embed_faces);
+        any other module runs once per face.
+        """
+        recognizer = self._recognizer()
+        if recognizer is not None:
+            embed_faces(recognizer, img_rgb, faces, current_app.config.get('FACE_RECOGNITION_BATCH_SIZE', 32))
+        for face in faces:
+            for taskname, model in self.model.models.items():
+                if taskname not in ('detection', 'recognition'):
+                    model.get(img_rgb, face)
+    
+    def _quality_gate(self):
+        """Face quality checks run before recognition, or None when FACE_QUALITY is off"""
+        if not current_app.config.get('FACE_QUALITY', True):
+            return None
+        return QualityGate(
+            min_face_size=current_app.config.get('FACE_QUALITY_MIN_FACE_SIZE', 20),
+            min_eye_distance=current_app.config.get('FACE_QUALITY_MIN_EYE_DISTANCE', 10),
+            max_yaw=current_app.config.get('FACE_QUALITY_MAX_YAW', 55),
+            max_pitch=current_app.config.get('FACE_QUALITY_MAX_PITCH', 45),
+            min_blur=current_app.config.get('FACE_QUALITY_MIN_BLUR', 10),
+            max_faces=current_app.config.get('FACE_MAX_FACES', 64)
+        )
+    
+    def _cached_results(self):
+        """Detection and embedding results of recent images by content, or None when FACE_RESULT_CACHE_MB is 0"""
+        max_bytes = int(current_app.config.get('FACE_RESULT_CACHE_MB', 32) * 1024 * 1024)
+        if max_bytes <= 0:
+            return None
+        if self.result_cache is None or self.result_cache.max_bytes != max_bytes:
+            self.result_cache = ResultCache(max_bytes)
+        return self.result_cache
+    
+    def _result_cache_key(self, image_data, profile):
+        """Result cache key of an encoded image: its bytes and every setting its cached faces depend on.
+        
+        The decode size, the profile's detection and tiling settings, the loaded
+        models and the quality checks all shape the faces and rejections that are
+        cached, so an image submitted after one of them changed is processed again.
+        """
+        settings = current_app.config.get('FACE_DETECTION_PROFILES', {}).get(profile) or {}
+        quality_gate = self._quality_gate()
+        return content_key(
+            image_data, profile, sorted(settings.items()), current_app.config.get('MAX_IMAGE_SIZE', 800),
+            self.runtime.get('model_pack'), self.active_modules(),
+            sorted(vars(quality_gate).items()) if quality_gate is not None else None
+        )
+    
+    @staticmethod
+    def _cache_entry(faces, rejected, thumbnail=None):
+        """Read-only copy of an image's faces (with their embeddings), quality rejections and motion
+        thumbnail, and its size in bytes"""
+        entry = []
+        nbytes = CACHE_ENTRY_OVERHEAD + (thumbnail.nbytes if thumbnail is not None else 0)
+        for face in faces:
+            arrays = [np.array(face.bbox), None if face.kps is None else np.array(face.kps),
+                      None if face.embedding is None else np.array(face.embedding)]
+            for array in arrays:
+                if array is not None:
+                    array.setflags(write=False)
+                    nbytes += array.nbytes
+            entry.append((*arrays, float(face.det_score)))
+            nbytes += CACHE_FACE_OVERHEAD
+        return (entry, dict(rejected), thumbnail), nbytes
+    
+    @staticmethod
+    def _faces_from_cache(entry):
+        """Faces, quality rejections and motion thumbnail of a result cache entry"""
+        faces, rejected, thumbnail = entry
+        return [Face(bbox=bbox, kps=kps, embedding=embedding, det_score=det_score)
+                for bbox, kps, embedding, det_score in faces], rejected, thumbnail
+    
+    def _session_tracker(self, session_id):
+        """Face tracker of a live camera session, or None when tracking is off"""
+        if not session_id or not current_app.config.get('FACE_TRACKING', True):
+            return None
+        self._trackers.ttl = current_app.config.get('FACE_TRACK_SESSION_TTL', 120)
+        return self._trackers.get(
+            session_id,
+            iou_threshold=current_app.config.get('FACE_TRACK_IOU', 0.3),
+            verify_every=current_app.config.get('FACE_TRACK_VERIFY_EVERY', 10),
+            verify_unknown_every=current_app.config.get('FACE_TRACK_VERIFY_UNKNOWN_EVERY', 1),
+            max_missed=current_app.config.get('FACE_TRACK_MAX_MISSED', 3)
+        )
+    
+    def _load_image(self, image_data, profile):
+        """RGB image of encoded bytes or a BGR array, reduced to the profile's largest size (see load_image)"""
+        if isinstance(image_data, np.ndarray):
+            dimensions = None
+            h, w = image_data.shape[:2]
+        else:
+            dimensions = image_dimensions(image_data)
+            w, h = dimensions or (0, 0)
+        return load_image(image_data, self._max_image_size(profile, h, w), dimensions)
+    
+    def detect_and_embed_face(self, image_data, profile='enroll'):
         """Detect face in an image and return the embedding"""
         if not self.initialized or self.model is None:
             if not self.initialize():
@@ -61,26 +421,12 @@ class FaceService:
                 return None, None
         
         try:
-            # Convert bytes to image if needed
-            if isinstance(image_data, bytes):
-                np_arr = np.frombuffer(image_data, np.uint8)
-                img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-            else:
-                img = image_data
-            
-            # Resize image if too large
-            max_size = current_app.config.get('MAX_IMAGE_SIZE', 800)
-            h, w = img.shape[:2]
-            if max(h, w) > max_size:
-                scale = max_size / max(h, w)
-                img = cv2.resize(img, (int(w * scale), int(h * scale)))
-            
-            # BGR to RGB for insightface
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            # Decode and shrink the image to the profile's size
+            img_rgb = self._load_image(image_data, profile)
             
             # Detect faces
             try:
-                faces = self.model.get(img_rgb)
+                faces = self._detect_faces(img_rgb, profile)
             except AttributeError as e:
                 current_app.logger.error(f"Face detection failed with attribute error: {str(e)}")
                 return None, None
@@ -105,37 +451,377 @@ class FaceService:
             current_app.logger.error(f"Error in face detection and embedding: {str(e)}")
             return None, None
     
-    def match_face(self, embedding, threshold=None):
-        """Match a face embedding against all students in the database"""
-        if threshold is None:
-            threshold = current_app.config.get('FACE_MATCH_THRESHOLD', 0.60)
+    def _gallery_db_signature(self):
+        """Cheap summary of the enrolled embeddings used to detect gallery changes.
+        
+        Inserts and deletes change the count; inserts and updates (such as a
+        re-enrollment or a group move) advance the latest updated_at.
+        """
+        count, latest = db.session.query(
+            func.count(Student.student_id),
+            func.max(Student.updated_at)
+        ).filter(Student.embedding.isnot(None)).one()
+        return [count, latest.isoformat() if latest else None]
+    
+    def _configure_gallery(self):
+        """Give the gallery its search backend, and keep int8 galleries' float32 rows in a spill file"""
+        self.gallery.backend = self._create_search_backend()
+        if isinstance(self.gallery.backend, QuantizedIndex):
+            self.gallery.spill_dir = current_app.config.get('FACE_GALLERY_SPILL_DIR', '')
+        else:
+            self.gallery.spill_dir = None
+    
+    def _create_search_backend(self):
+        """Create the gallery search backend selected by FACE_INDEX_BACKEND"""
+        backend = current_app.config.get('FACE_INDEX_BACKEND', 'flat')
+        if backend == 'ivf':
+            return IVFIndex(
+                nlist=current_app.config.get('FACE_IVF_NLIST', 0),
+                nprobe=current_app.config.get('FACE_IVF_NPROBE', 8),
+                min_train_size=current_app.config.get('FACE_IVF_MIN_TRAIN_SIZE', 5000)
+            )
+        if backend in QuantizedIndex.PRECISIONS:
+            return QuantizedIndex(backend, rerank_k=current_app.config.get('FACE_RERANK_K', 10))
+        if backend != 'flat':
+            current_app.logger.warning(f"Unknown FACE_INDEX_BACKEND '{backend}', using exact search")
+        return None
+    
+    def _gallery_store(self):
+        """Shared gallery file set by FACE_GALLERY_STORE_PATH, or None if not configured"""
+        path = current_app.config.get('FACE_GALLERY_STORE_PATH')
+        if not path:
+            return None
+        if self._store is None or self._store.path != path:
+            self._store = GalleryStore(path)
+        return self._store
+    
+    def rebuild_gallery(self):
+        """Reload the gallery from the students table and share it with other workers"""
+        store = self._gallery_store()
+        if store is None:
+            return self._rebuild_gallery(None)
+        with store.lock():
+            return self._rebuild_gallery(store)
+    
+    def _rebuild_gallery(self, store):
+        """Build the gallery from the database; call with the store lock held"""
+        self._configure_gallery()
+        rows = db.session.query(
+            Student.student_id, Student.name, Student.group_id, Student.embedding
+        ).filter(Student.embedding.isnot(None)).yield_per(1000)
         
-        # Get all student embeddings
-        students = Student.query.all()
-        if not students:
-            return None, 0.0
+        with self._store_lock:
+            size = self.gallery.build(
+                (student_id, name, group_id, Student.decode_embedding(embedding))
+                for student_id, name, group_id, embedding in rows
+            )
+            # Everything committed so far is in the database build
+            self._unpublished = {}
+        self._gallery_signature = self._gallery_db_signature()
+        self._gallery_checked_at = time.time()
+        self._forget_local_writes()
+        current_app.logger.info(f"Face gallery built with {size} embeddings in {self.gallery.build_time_ms} ms")
         
-        best_match = None
-        best_score = 0.0
+        recall = self.gallery.measure_recall()
+        if recall is not None:
+            current_app.logger.info(f"Face gallery {self.gallery.backend.name} index recall@1 vs exact search: {recall:.3f}")
         
-        # Normalize query embedding for cosine similarity
-        query_embedding = embedding / np.linalg.norm(embedding)
+        if store is not None:
+            generation = store.publish(self.gallery, self._gallery_signature)
+            current_app.logger.info(f"Published face gallery generation {generation} to {store.path}")
+            self._load_shared_gallery(store)
+        return size
+    
+    def _load_shared_gallery(self, store, signature=None):
+        """Map the shared gallery file, re-applying this process's unpublished writes.
         
-        for student in students:
-            stored_embedding = student.get_embedding()
-            if stored_embedding is not None:
-                # Calculate cosine similarity
-                similarity = np.dot(query_embedding, stored_embedding)
-                if similarity > best_score:
-                    best_score = similarity
-                    best_match = student
+        Returns False if there is no valid file, or its database signature differs
+        from signature when one is given.
+        """
+        try:
+            data = store.load(self.gallery.dim)
+        except (OSError, ValueError) as e:
+            current_app.logger.warning(f"Could not load shared face gallery from {store.path}: {str(e)}")
+            return False
+        if data is None or (signature is not None and data.signature != signature):
+            return False
         
-        if best_score >= threshold:
-            return best_match, best_score
-        return None, best_score
+        with self._store_lock:
+            self._configure_gallery()
+            # Adopts the publisher's trained index rather than training it again
+            self.gallery.load(data.matrix, data.student_ids, data.names, data.group_ids, data.backend)
+            # The file's signature covers everything but the writes not published yet
+            self._local_count_delta = self._apply_to_gallery(self._unpublished)
+            self._local_writes = {student_id: student_id in self.gallery for student_id in self._unpublished}
+            if not self._unpublished:
+                self._local_written_at = None
+        self._gallery_signature = data.signature
+        self._gallery_checked_at = time.time()
+        current_app.logger.info(f"Mapped face gallery generation {data.generation} ({self.gallery.size} embeddings) from {store.path}")
+        return True
+    
+    def _load_or_rebuild_gallery(self, store, signature):
+        """Use the shared gallery if it matches the database, otherwise rebuild it"""
+        if store is None:
+            return self._rebuild_gallery(None)
+        with store.lock():
+            # Another worker may have rebuilt it while we waited for the lock
+            if self._load_shared_gallery(store, signature):
+                return self.gallery.size
+            return self._rebuild_gallery(store)
     
-    def process_image_for_attendance(self, image_data):
-        """Process an image for attendance checking"""
+    def refresh_gallery(self, force=False):
+        """Build the gallery if needed, or rebuild it when enrollments have changed.
+        
+        Writes made through this process are applied to the gallery as they are
+        committed (see apply_gallery_changes). With a shared gallery file, newer
+        versions published by other workers are mapped as soon as they appear. The
+        periodic signature check catches enrollments made by other processes.
+        """
+        if force:
+            return self.rebuild_gallery()
+        
+        store = self._gallery_store()
+        if not self.gallery.is_built:
+            signature = self._gallery_db_signature() if store is not None else None
+            return self._load_or_rebuild_gallery(store, signature)
+        
+        if store is not None and store.has_changed():
+            self._load_shared_gallery(store)
+        
+        interval = current_app.config.get('GALLERY_REFRESH_SECONDS', 30)
+        now = time.time()
+        if now - self._gallery_checked_at < interval:
+            return self.gallery.size
+        
+        self._gallery_checked_at = now
+        signature = self._gallery_db_signature()
+        if self._local_writes and self._only_local_writes(signature):
+            # Our own committed writes are already in the gallery
+            self._gallery_signature = signature
+            self._forget_local_writes()
+        elif signature != self._gallery_signature:
+            return self._load_or_rebuild_gallery(store, signature)
+        return self.gallery.size
+    
+    def _forget_local_writes(self):
+        self._local_writes = {}
+        self._local_count_delta = 0
+        self._local_written_at = None
+    
+    def _only_local_writes(self, signature):
+        """Whether the database differs from the gallery's signature by this process's writes alone.
+        
+        The enrolled count must have moved by exactly our inserts and deletes, the
+        rows written since the old signature must be exactly our students still
+        enrolled, and the latest write must be ours. Anything else means another
+        process wrote students as well.
+        """
+        if self._gallery_signature is None:
+            return False
+        count, latest = signature
+        old_count, old_latest = self._gallery_signature
+        if count != old_count + self._local_count_delta:
+            return False
+        enrolled = sum(self._local_writes.values())
+        if enrolled and (self._local_written_at is None or latest != self._local_written_at.isoformat()):
+            return False
+        query = db.session.query(func.count(Student.student_id)).filter(Student.embedding.isnot(None))
+        if old_latest is not None:
+            query = query.filter(Student.updated_at > datetime.fromisoformat(old_latest))
+        return query.scalar() == enrolled
+    
+    def _apply_to_gallery(self, changes):
+        """Apply student writes to the gallery; returns the change in its number of students"""
+        delta = 0
+        for student_id, change in changes.items():
+            present = student_id in self.gallery
+            if change is None:
+                self.gallery.remove(student_id)
+            else:
+                name, group_id, embedding = change
+                self.gallery.upsert(student_id, name, group_id, Student.decode_embedding(embedding))
+            delta += (student_id in self.gallery) - present
+        return delta
+    
+    def apply_gallery_changes(self, changes, written_at=None):
+        """Apply committed student writes to the gallery without reloading it.
+        
+        changes maps student_id to (name, group_id, stored embedding), or to None
+        for a deleted student; written_at is the latest updated_at they set. With
+        a shared gallery file the changes are also published to other workers
+        shortly afterwards.
+        """
+        if not self.gallery.is_built:
+            return
+        
+        store = self._gallery_store() if has_app_context() else None
+        with self._store_lock:
+            self._local_count_delta += self._apply_to_gallery(changes)
+            self._local_writes.update({student_id: student_id in self.gallery for student_id in changes})
+            if written_at is not None and (self._local_written_at is None or written_at > self._local_written_at):
+                self._local_written_at = written_at
+            if store is not None:
+                self._unpublished.update(changes)
+        
+        if store is not None and self._publish_timer is None:
+            delay = current_app.config.get('FACE_GALLERY_PUBLISH_DELAY', 2.0)
+            self._publish_timer = threading.Timer(
+                delay, self._publish_changes, args=(current_app._get_current_object(), store)
+            )
+            self._publish_timer.daemon = True
+            self._publish_timer.start()
+    
+    def _publish_changes(self, app, store):
+        """Publish locally applied writes to the shared gallery file (runs on a timer thread)"""
+        with app.app_context():
+            self._publish_timer = None
+            try:
+                with store.lock():
+                    # Merge versions other workers published since we last looked
+                    if store.has_changed():
+                        self._load_shared_gallery(store)
+                    signature = self._gallery_db_signature()
+                    if not self._only_local_writes(signature):
+                        # Other processes wrote students too; a database build covers both
+                        self._rebuild_gallery(store)
+                        return
+                    with self._store_lock:
+                        generation = store.publish(self.gallery, signature)
+                        self._unpublished = {}
+                    self._gallery_signature = signature
+                    self._forget_local_writes()
+                    # Switch to the mapped copy so this worker does not keep a private one
+                    self._load_shared_gallery(store)
+                app.logger.info(f"Published face gallery generation {generation} to {store.path}")
+            except Exception as e:
+                app.logger.error(f"Failed to publish face gallery: {str(e)}")
+            finally:
+                db.session.remove()
+    
+    @staticmethod
+    def _margin(scores):
+        """Best score minus the runner-up's (scores below zero count as zero)"""
+        if not scores:
+            return 0.0
+        best = max(scores[0], 0.0)
+        second = max(scores[1], 0.0) if len(scores) > 1 else 0.0
+        return best - second
+    
+    def _match_gallery(self, embeddings, threshold, group_ids=None, margin=None):
+        """Match a stack of embeddings from one frame against the current gallery.
+        
+        Returns a list of (student_id, name, score, margin) per embedding, where
+        margin is how far the best score is ahead of the second best. Each
+        student is assigned to at most one face (see FACE_ASSIGNMENT). student_id
+        and name are None when the best score is below the threshold, the margin
+        is below the minimum margin (an ambiguous match), or the face lost its
+        students to other faces in the frame. The gallery is not refreshed.
+        """
+        if margin is None:
+            margin = current_app.config.get('FACE_MATCH_MARGIN', 0.0)
+        method = current_app.config.get('FACE_ASSIGNMENT', 'auto')
+        
+        # The runner-up comes from the same scoring pass as the best match. For
+        # several faces, extra candidates let the assignment pick a face's next
+        # best student when another face is a better match for its first choice.
+        face_count = np.asarray(embeddings).reshape(-1, self.gallery.dim).shape[0]
+        k = 2
+        if method != 'none' and face_count > 1:
+            k = max(k, min(face_count, current_app.config.get('FACE_ASSIGNMENT_CANDIDATES', 5)))
+        student_ids, names, scores = self.gallery.search_topk(embeddings, k, group_ids)
+        
+        # Face x candidate student scores, -inf where a match is not allowed
+        columns = {}
+        student_names = {}
+        for face_ids, face_names in zip(student_ids, names):
+            for student_id, name in zip(face_ids, face_names):
+                columns.setdefault(student_id, len(columns))
+                student_names[student_id] = name
+        candidates = np.full((face_count, len(columns)), -np.inf, dtype=np.float32)
+        margins = [self._margin(face_scores) for face_scores in scores]
+        for i, (face_ids, face_scores) in enumerate(zip(student_ids, scores)):
+            if margins[i] < margin:
+                continue
+            for student_id, score in zip(face_ids, face_scores):
+                if score >= threshold:
+                    candidates[i, columns[student_id]] = score
+        
+        if method == 'none':
+            # Every face takes its best student, even if another face did too
+            assignment = [int(np.argmax(row)) if np.isfinite(row).any() else -1 for row in candidates]
+        else:
+            assignment = assign_faces(
+                candidates, method, current_app.config.get('FACE_ASSIGNMENT_HUNGARIAN_MAX_FACES', 50)
+            )
+        
+        column_ids = list(columns)
+        matches = []
+        for i, column in enumerate(assignment):
+            if column >= 0:
+                student_id = column_ids[column]
+                matches.append((student_id, student_names[student_id], float(candidates[i, column]), margins[i]))
+            else:
+                best = max(scores[i][0], 0.0) if scores[i] else 0.0
+                matches.append((None, None, best, margins[i]))
+        return matches
+    
+    def match_faces(self, embeddings, threshold=None, group_ids=None, margin=None):
+        """Match all face embeddings from one frame against the gallery in a single pass.
+        
+        If group_ids is given, only students in those groups can be matched.
+        Matches less than margin (default FACE_MATCH_MARGIN) ahead of the
+        runner-up are rejected as ambiguous, and no student is matched to more
+        than one face.
+        """
+        if threshold is None:
+            threshold = current_app.config.get('FACE_MATCH_THRESHOLD', 0.60)
+        
+        self.refresh_gallery()
+        return self._match_gallery(embeddings, threshold, group_ids, margin)
+    
+    def match_face(self, embedding, threshold=None):
+        """Match a face embedding against all students in the database"""
+        if threshold is None:
+            threshold = current_app.config.get('FACE_MATCH_THRESHOLD', 0.60)
+        
+        student_id, _, score, _ = self.match_faces(np.ravel(embedding)[np.newaxis, :], threshold)[0]
+        if student_id is None:
+            return None, score
+        return db.session.get(Student, student_id), score
+    
+    def match_face_topk(self, embedding, k=5, group_ids=None):
+        """The k best (student_id, score) pairs for a face embedding and the best-to-second margin"""
+        self.refresh_gallery()
+        student_ids, _, scores = self.gallery.search_topk(np.ravel(embedding)[np.newaxis, :], k, group_ids)
+        return list(zip(student_ids[0], scores[0])), self._margin(scores[0])
+    
+    def _session_motion_gate(self, session_id):
+        """Change detector of a live camera session, or None when motion gating is off"""
+        if not session_id or not current_app.config.get('FACE_MOTION_GATING', True):
+            return None
+        self._motion_gates.ttl = current_app.config.get('FACE_TRACK_SESSION_TTL', 120)
+        return self._motion_gates.get(
+            session_id,
+            pixel_threshold=current_app.config.get('FACE_MOTION_PIXEL_THRESHOLD', 25),
+            min_changed=current_app.config.get('FACE_MOTION_MIN_CHANGED', 0.005),
+            max_age=current_app.config.get('FACE_MOTION_MAX_AGE', 5.0)
+        )
+    
+    def process_image_for_attendance(self, image_data, group_ids=None, profile='group', session_id=None):
+        """Process an image for attendance checking, optionally limited to students in group_ids.
+        
+        profile names the FACE_DETECTION_PROFILES entry used for detection. Frames
+        from a live camera session (session_id) are tracked: faces continuing a
+        verified track reuse its identity, and only new tracks and tracks due for
+        re-verification are embedded and matched. A session frame that barely
+        differs from the last processed one returns that frame's result, marked
+        skipped, without running inference; its recognized entries are stale
+        and the caller must not record attendance for them again. Encoded images
+        seen before (by a hash of their bytes) reuse their cached faces and
+        embeddings and are only matched again, marked cache_hit (see
+        FACE_RESULT_CACHE_MB).
+        """
         start_time = time.time()
         
         try:
@@ -152,21 +838,31 @@ class FaceService:
                         "error_message": "Face recognition model could not be initialized"
                     }
                     
-            # Convert bytes to image
-            if isinstance(image_data, bytes):
+            # An image seen before goes straight to matching with its cached faces and embeddings
+            gate = self._session_motion_gate(session_id)
+            cache = self._cached_results() if isinstance(image_data, (bytes, bytearray, memoryview)) else None
+            cache_key = self._result_cache_key(image_data, profile) if cache is not None else None
+            cached = cache.get(cache_key) if cache is not None else None
+            # A camera session's change detector needs the thumbnail of the frame
+            if cached is not None and gate is not None and cached[2] is None:
+                cached = None
+            img_rgb, thumbnail = None, None
+            if cached is not None:
+                faces, rejected, thumbnail = self._faces_from_cache(cached)
+            else:
+                # Decode straight to the size the profile detects at
                 try:
-                    np_arr = np.frombuffer(image_data, np.uint8)
-                    img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-                    if img is None:
-                        current_app.logger.error("Failed to decode image data")
-                        return {
-                            "recognized": [],
-                            "unrecognized_count": 0,
-                            "unrecognized_faces": [],
-                            "processing_time_ms": 0,
-                            "error": True,
-                            "error_message": "Failed to decode image data"
-                        }
+                    img_rgb = self._load_image(image_data, profile)
+                except ImageDecodeError as e:
+                    current_app.logger.error(str(e))
+                    return {
+                        "recognized": [],
+                        "unrecognized_count": 0,
+                        "unrecognized_faces": [],
+                        "processing_time_ms": 0,
+                        "error": True,
+                        "error_message": str(e)
+                    }
                 except Exception as e:
                     current_app.logger.error(f"Error decoding image: {str(e)}")
                     return {
@@ -177,76 +873,155 @@ class FaceService:
                         "error": True,
                         "error_message": f"Error decoding image: {str(e)}"
                     }
-            else:
-                img = image_data
+                if gate is not None:
+                    thumbnail = gate.thumbnail(img_rgb)
             
-            # Resize image if needed
-            max_size = current_app.config.get('MAX_IMAGE_SIZE', 800)
-            h, w = img.shape[:2]
-            if max(h, w) > max_size:
-                scale = max_size / max(h, w)
-                img = cv2.resize(img, (int(w * scale), int(h * scale)))
+            # Reuse the last result while a camera's scene stays the same
+            if gate is not None:
+                with gate.lock:
+                    if not gate.is_changed(thumbnail):
+                        metrics.increment('live_frames_skipped')
+                        result = gate.cached_result()
+                        result["processing_time_ms"] = int((time.time() - start_time) * 1000)
+                        return result
             
-            # BGR to RGB for insightface
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            if cached is None:
+                # Detect all faces
+                try:
+                    faces = self._detect_faces(img_rgb, profile, analyze=False)
+                except Exception as e:
+                    current_app.logger.error(f"Face detection failed: {str(e)}")
+                    return {
+                        "recognized": [],
+                        "unrecognized_count": 0,
+                        "unrecognized_faces": [],
+                        "processing_time_ms": int((time.time() - start_time) * 1000),
+                        "error": True,
+                        "error_message": f"Face detection failed: {str(e)}"
+                    }
+                
+                # Faces too small, blurred or turned away are not worth embedding
+                rejected = {}
+                quality_gate = self._quality_gate()
+                if quality_gate is not None:
+                    _, rejected = quality_gate.filter(img_rgb, faces)
+                    for reason, _ in rejected.values():
+                        metrics.increment('faces_rejected')
+                        metrics.increment(f'faces_rejected_{reason}')
             
-            # Detect all faces
-            try:
-                faces = self.model.get(img_rgb)
-            except Exception as e:
-                current_app.logger.error(f"Face detection failed: {str(e)}")
-                return {
-                    "recognized": [],
-                    "unrecognized_count": 0,
-                    "unrecognized_faces": [],
-                    "processing_time_ms": int((time.time() - start_time) * 1000),
-                    "error": True,
-                    "error_message": f"Face detection failed: {str(e)}"
-                }
+            tracker = self._session_tracker(session_id)
             
-            if not faces:
-                processing_time = int((time.time() - start_time) * 1000)  # ms
-                return {"recognized": [], "unrecognized_count": 0, "unrecognized_faces": [], "processing_time_ms": processing_time}
+            # (student_id, name, score, margin) of every face that was matched or tracked
+            results = {}
+            tracks = None
+            with tracker.lock if tracker is not None else nullcontext():
+                recognize = list(range(len(faces)))
+                if tracker is not None:
+                    scope = tuple(sorted(group_ids)) if group_ids is not None else None
+                    if tracker.scope != scope:
+                        tracker.reset(scope)
+                    tracks, needs_recognition = tracker.update([face.bbox for face in faces])
+                    recognize = [i for i, needed in enumerate(needs_recognition) if needed]
+                    for i, track in enumerate(tracks):
+                        if not needs_recognition[i]:
+                            results[i] = (track.student_id, track.name, track.score, track.margin)
+                
+                # Tracked faces keep their identity even when this frame's view of them is poor
+                recognize = [i for i in recognize if i not in rejected]
+                pending = [faces[i] for i in recognize if faces[i].embedding is None]
+                if pending:
+                    self._analyze_faces(img_rgb, pending)
+                
+                # Faces without an embedding cannot be matched
+                embedded = [i for i in recognize if faces[i].embedding is not None]
+                
+                # Score every face in the frame against the gallery at once
+                if embedded:
+                    try:
+                        matches = self.match_faces(
+                            np.vstack([faces[i].embedding for i in embedded]), group_ids=group_ids
+                        )
+                    except Exception as e:
+                        current_app.logger.error(f"Error matching faces: {str(e)}")
+                        matches = []
+                    
+                    # Students held by a tracked face are not matched to a second face
+                    claimed = {result[0] for result in results.values() if result[0]}
+                    for i, (student_id, name, score, margin) in zip(embedded, matches):
+                        if student_id in claimed:
+                            student_id, name = None, None
+                        results[i] = (student_id, name, score, margin)
+                        if tracks is not None:
+                            tracks[i].confirm(student_id, name, score, margin)
+            
+            # Results are only cached once every face worth recognizing has its embedding
+            if cache is not None and cached is None and all(
+                faces[i].embedding is not None for i in range(len(faces)) if i not in rejected
+            ):
+                cache.put(cache_key, *self._cache_entry(faces, rejected, thumbnail))
             
             recognized = []
-            unrecognized = 0
+            rejected_faces = [
+                dict(measures, id=f"rejected_{i}", bbox=faces[i].bbox.astype(int).tolist(), reason=reason)
+                for i, (reason, measures) in sorted(rejected.items()) if i not in results
+            ]
+            unrecognized = len(faces) - len(results) - len(rejected_faces)
             unrecognized_faces = []
-            threshold = current_app.config.get('FACE_MATCH_THRESHOLD', 0.60)
             
+            threshold = current_app.config.get('FACE_MATCH_THRESHOLD', 0.60)
+            min_margin = current_app.config.get('FACE_MATCH_MARGIN', 0.0)
             for i, face in enumerate(faces):
-                try:
-                    embedding = face.embedding
-                    bbox = face.bbox.astype(int)  # Get bounding box for each face
-                    student, score = self.match_face(embedding, threshold)
-                    
-                    if student:
-                        recognized.append({
-                            "student_id": student.student_id,
-                            "name": student.name,
-                            "score": float(score),
-                            "bbox": bbox.tolist()  # Add bounding box information
-                        })
-                    else:
-                        unrecognized += 1
-                        # Add information about unrecognized face
-                        unrecognized_faces.append({
-                            "id": f"unknown_{i}",
-                            "bbox": bbox.tolist(),
-                            "score": float(score) if score else 0.0
-                        })
-                except Exception as e:
-                    current_app.logger.error(f"Error processing face {i}: {str(e)}")
+                if i not in results:
+                    continue
+                student_id, name, score, margin = results[i]
+                bbox = face.bbox.astype(int)  # Get bounding box for each face
+                
+                if student_id:
+                    recognized.append({
+                        "student_id": student_id,
+                        "name": name,
+                        "score": float(score),
+                        "margin": float(margin),
+                        "bbox": bbox.tolist()  # Add bounding box information
+                    })
+                    if tracks is not None:
+                        recognized[-1]["track_id"] = tracks[i].track_id
+                else:
                     unrecognized += 1
+                    # Add information about unrecognized face
+                    unrecognized_faces.append({
+                        "id": f"unknown_{i}",
+                        "bbox": bbox.tolist(),
+                        "score": float(score) if score else 0.0,
+                        "margin": float(margin),
+                        # Close enough to a student, but too close to another one as well
+                        "ambiguous": score >= threshold and margin < min_margin,
+                        # Its student was assigned to a better matching face in the frame
+                        "duplicate": score >= threshold and margin >= min_margin
+                    })
             
             processing_time = int((time.time() - start_time) * 1000)  # ms
             
-            return {
-                "recognized": recognized,
-                "unrecognized_count": unrecognized,
-                "unrecognized_faces": unrecognized_faces,
-                "processing_time_ms": processing_time,
-                "total_faces": len(faces)
-            }
+            if not faces:
+                result = {"recognized": [], "unrecognized_count": 0, "unrecognized_faces": [], "processing_time_ms": processing_time}
+            else:
+                result = {
+                    "recognized": recognized,
+                    "unrecognized_count": unrecognized,
+                    "unrecognized_faces": unrecognized_faces,
+                    "processing_time_ms": processing_time,
+                    "total_faces": len(faces),
+                    "embedded_faces": len(embedded),
+                    "rejected_count": len(rejected_faces),
+                    "rejected_faces": rejected_faces
+                }
+            if cached is not None:
+                result["cache_hit"] = True
+            if gate is not None:
+                metrics.increment('live_frames_processed')
+                with gate.lock:
+                    result["skipped_frames"] = gate.remember(thumbnail, result)
+            return result
         
         except Exception as e:
             current_app.logger.error(f"Unexpected error in face processing: {str(e)}")
@@ -258,56 +1033,43 @@ class FaceService:
                 "error": True,
                 "error_message": f"Unexpected error: {str(e)}"
             }
-        
-        # Resize image if needed
-        max_size = current_app.config.get('MAX_IMAGE_SIZE', 800)
-        h, w = img.shape[:2]
-        if max(h, w) > max_size:
-            scale = max_size / max(h, w)
-            img = cv2.resize(img, (int(w * scale), int(h * scale)))
-        
-        # BGR to RGB for insightface
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        
-        # Detect all faces
-        faces = self.model.get(img_rgb)
-        
-        if not faces:
-            processing_time = int((time.time() - start_time) * 1000)  # ms
-            return {"recognized": [], "unrecognized_count": 0, "unrecognized_faces": [], "processing_time_ms": processing_time}
-        
-        recognized = []
-        unrecognized = 0
-        unrecognized_faces = []
-        threshold = current_app.config.get('FACE_MATCH_THRESHOLD', 0.60)
-        
-        for i, face in enumerate(faces):
-            embedding = face.embedding
-            bbox = face.bbox.astype(int)  # Get bounding box for each face
-            student, score = self.match_face(embedding, threshold)
-            
-            if student:
-                recognized.append({
-                    "student_id": student.student_id,
-                    "name": student.name,
-                    "score": float(score),
-                    "bbox": bbox.tolist()  # Add bounding box information
-                })
-            else:
-                unrecognized += 1
-                # Add information about unrecognized face
-                unrecognized_faces.append({
-                    "id": f"unknown_{i}",
-                    "bbox": bbox.tolist(),
-                    "score": float(score) if score else 0.0
-                })
-        
-        processing_time = int((time.time() - start_time) * 1000)  # ms
-        
-        return {
-            "recognized": recognized,
-            "unrecognized_count": unrecognized,
-            "unrecognized_faces": unrecognized_faces,
-            "processing_time_ms": processing_time,
-            "total_faces": len(faces)
-        }
\ No newline at end of file
+
+
+# Keep the gallery in step with Student writes. Changes are collected per session
+# while flushing and only applied once the transaction commits.
+_GALLERY_CHANGES_KEY = 'face_gallery_changes'
+_GALLERY_WRITTEN_AT_KEY = 'face_gallery_written_at'
+
+def _record_gallery_change(target, deleted=False):
+    session = object_session(target)
+    if session is None:
+        return
+    changes = session.info.setdefault(_GALLERY_CHANGES_KEY, {})
+    changes[target.student_id] = None if deleted else (target.name, target.group_id, target.embedding)
+    if not deleted and target.updated_at is not None:
+        written_at = session.info.get(_GALLERY_WRITTEN_AT_KEY)
+        session.info[_GALLERY_WRITTEN_AT_KEY] = max(written_at, target.updated_at) if written_at else target.updated_at
+
+@event.listens_for(Student, 'after_insert')
+def _student_inserted(mapper, connection, target):
+    _record_gallery_change(target)
+
+@event.listens_for(Student, 'after_update')
+def _student_updated(mapper, connection, target):
+    _record_gallery_change(target)
+
+@event.listens_for(Student, 'after_delete')
+def _student_deleted(mapper, connection, target):
+    _record_gallery_change(target, deleted=True)
+
+@event.listens_for(Session, 'after_commit')
+def _apply_gallery_changes(session):
+    changes = session.info.pop(_GALLERY_CHANGES_KEY, None)
+    written_at = session.info.pop(_GALLERY_WRITTEN_AT_KEY, None)
+    if changes:
+        FaceService().apply_gallery_changes(changes, written_at)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_gallery_changes(session):
+    session.info.pop(_GALLERY_CHANGES_KEY, None)
+    session.info.pop(_GALLERY_WRITTEN_AT_KEY, None)
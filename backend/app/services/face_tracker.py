@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from app.services.face_assignment import assign_faces
+
+
+def bbox_iou(a, b):
+    """(len(a) x len(b)) IoU matrix of x1, y1, x2, y2 boxes"""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(a[:, np.newaxis, 0], b[np.newaxis, :, 0])
+    y1 = np.maximum(a[:, np.newaxis, 1], b[np.newaxis, :, 1])
+    x2 = np.minimum(a[:, np.newaxis, 2], b[np.newaxis, :, 2])
+    y2 = np.minimum(a[:, np.newaxis, 3], b[np.newaxis, :, 3])
+    inter = np.maximum(x2 - x1, 0) * np.maximum(y2 - y1, 0)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, np.newaxis] + area_b[np.newaxis, :] - inter, 1e-6)
+
+
+class Track:
+    """A face followed across frames, with the identity it was last recognized as"""
+
+    def __init__(self, track_id, bbox):
+        self.track_id = track_id
+        self.bbox = bbox
+        self.student_id = None
+        self.name = None
+        self.score = 0.0
+        self.margin = 0.0
+        self.verified = False
+        self.frames_since_verify = 0
+        self.missed = 0
+
+    def confirm(self, student_id, name, score, margin):
+        self.student_id = student_id
+        self.name = name
+        self.score = score
+        self.margin = margin
+        self.verified = True
+        self.frames_since_verify = 0
+
+
+class FaceTracker:
+    """IoU tracker for the faces of one camera session.
+
+    Each frame's detections are matched one-to-one to the existing tracks by box
+    overlap. A detection needs recognition when it starts a new track or when its
+    track was last verified verify_every frames ago, or verify_unknown_every
+    frames ago if it was not recognized, so a student who turns towards the
+    camera is not left unknown for long; otherwise it keeps the identity of its
+    track. Tracks are dropped after max_missed frames without a detection.
+    """
+
+    def __init__(self, iou_threshold=0.3, verify_every=10, max_missed=3, verify_unknown_every=1):
+        self.iou_threshold = iou_threshold
+        self.verify_every = verify_every
+        self.verify_unknown_every = verify_unknown_every
+        self.max_missed = max_missed
+        self.tracks = []
+        self.scope = None
+        self.last_seen = time.time()
+        self._next_id = 1
+        self.lock = threading.Lock()
+
+    def reset(self, scope=None):
+        self.tracks = []
+        self.scope = scope
+
+    def update(self, bboxes):
+        """Match a frame's (F x 4) detections to tracks.
+
+        Returns (tracks, needs_recognition): the track of every detection, and
+        a boolean per detection telling whether it must be recognized again.
+        """
+        self.last_seen = time.time()
+        bboxes = np.asarray(bboxes, dtype=np.float32).reshape(-1, 4)
+        assignment = np.full(bboxes.shape[0], -1, dtype=np.intp)
+        if self.tracks and bboxes.shape[0]:
+            overlap = bbox_iou(bboxes, [track.bbox for track in self.tracks])
+            overlap[overlap < self.iou_threshold] = -np.inf
+            assignment = assign_faces(overlap, 'greedy')
+
+        tracks = []
+        needs_recognition = []
+        matched = set()
+        for bbox, column in zip(bboxes, assignment):
+            if column >= 0:
+                track = self.tracks[column]
+                track.bbox = bbox
+                track.missed = 0
+                track.frames_since_verify += 1
+                matched.add(column)
+            else:
+                track = Track(self._next_id, bbox)
+                self._next_id += 1
+            tracks.append(track)
+            interval = self.verify_every if track.student_id is not None else self.verify_unknown_every
+            needs_recognition.append(not track.verified or track.frames_since_verify >= interval)
+
+        # Age out tracks that were not seen in this frame
+        survivors = []
+        for column, track in enumerate(self.tracks):
+            if column not in matched:
+                track.missed += 1
+                if track.missed > self.max_missed:
+                    continue
+            survivors.append(track)
+        self.tracks = survivors + [track for track, column in zip(tracks, assignment) if column < 0]
+        return tracks, needs_recognition
+
+
+class SessionRegistry:
+    """Per camera session state (a FaceTracker by default), evicting sessions idle for ttl seconds.
+
+    Objects made by factory must have a last_seen timestamp.
+    """
+
+    def __init__(self, ttl=120, max_sessions=256, factory=FaceTracker):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.factory = factory
+        self._trackers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id, **settings):
+        now = time.time()
+        with self._lock:
+            tracker = self._trackers.pop(session_id, None)
+            if tracker is not None and now - tracker.last_seen > self.ttl:
+                tracker = None
+            while self._trackers:
+                oldest_id, oldest = next(iter(self._trackers.items()))
+                if now - oldest.last_seen <= self.ttl and len(self._trackers) < self.max_sessions:
+                    break
+                del self._trackers[oldest_id]
+            if tracker is None:
+                tracker = self.factory(**settings)
+            self._trackers[session_id] = tracker
+            return tracker
+
+    def __len__(self):
+        return len(self._trackers)
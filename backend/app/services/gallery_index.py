@@ -0,0 +1,493 @@
+import mmap
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+
+
+class GalleryIndex:
+    """In-memory matrix of enrolled student embeddings used for face matching.
+
+    Embeddings are kept as one contiguous float32 (N x dim) matrix of L2-normalized
+    rows with parallel lists of student IDs, names and group IDs, so matching a face
+    is a single matrix-vector product followed by an argmax. The rows of each group
+    form a partition, copied into its own contiguous matrix the first time the group
+    is searched, so matching can be limited to one class.
+
+    Students can be added, replaced and removed one at a time. Removal moves the
+    last row into the freed slot so the matrix stays dense. The matrix may also be
+    a read-only mapping of a shared GalleryStore file, in which case it is copied
+    into private memory on the first local change.
+
+    With spill_dir set, the matrix is kept in a file in that directory instead
+    of private memory, and only the pages that are read are resident. This suits
+    a QuantizedIndex backend, which scans its compact codes and reads only the
+    few candidate rows it re-ranks. Group partitions are then read from the file
+    on each search rather than cached.
+
+    An optional search backend (IVFIndex or QuantizedIndex) narrows whole-gallery
+    searches down to candidate rows, which are then scored exactly. When an
+    upsert makes the backend due for retraining, it is retrained on a background
+    thread and searches fall back to exact scan until the new index is in place.
+    """
+
+    SPILL_CHUNK_ROWS = 8192
+
+    def __init__(self, dim=512, backend=None, spill_dir=None):
+        self.dim = dim
+        self.backend = backend
+        self.spill_dir = spill_dir
+        self._spill_file = None
+        self._spill_map = None
+        self._lock = threading.RLock()
+        self.version = 0
+        self.built_at = None
+        self.build_time_ms = 0
+        self.recall = None
+        self._stale = False
+        self._retraining = False
+        self._retrained = threading.Condition(self._lock)
+        self._set_arrays(np.empty((0, dim), dtype=np.float32), [], [], [])
+
+    def _set_arrays(self, matrix, student_ids, names, group_ids):
+        self._vectors = np.ascontiguousarray(matrix, dtype=np.float32)
+        self._count = self._vectors.shape[0]
+        self.student_ids = list(student_ids)
+        self.names = list(names)
+        self.group_ids = list(group_ids)
+        self._positions = {student_id: row for row, student_id in enumerate(self.student_ids)}
+        self.partitions = {}
+        for row, group_id in enumerate(self.group_ids):
+            self.partitions.setdefault(group_id, []).append(row)
+        self._partition_cache = {}
+
+    def _partition(self, group_id):
+        """Rows and contiguous embedding matrix for one group, cached until the group changes"""
+        cached = self._partition_cache.get(group_id)
+        if cached is None:
+            rows = self.partitions.get(group_id)
+            if not rows:
+                return None
+            rows = np.array(rows, dtype=np.intp)
+            cached = (rows, self._read_rows(rows))
+            if self.spill_dir is None:
+                self._partition_cache[group_id] = cached
+        return cached
+
+    @property
+    def lock(self):
+        """Lock held while the gallery is read or changed"""
+        return self._lock
+
+    def __contains__(self, student_id):
+        return student_id in self._positions
+
+    @property
+    def matrix(self):
+        return self._vectors[:self._count]
+
+    @property
+    def size(self):
+        return self._count
+
+    @property
+    def is_built(self):
+        return self.built_at is not None
+
+    @staticmethod
+    def normalize(vectors):
+        """Return L2-normalized float32 copies of one or more embeddings"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def build(self, rows):
+        """Replace the gallery with rows of (student_id, name, group_id, embedding)"""
+        start_time = time.time()
+        student_ids = []
+        names = []
+        group_ids = []
+        vectors = []
+        for student_id, name, group_id, embedding in rows:
+            if embedding is None or embedding.size != self.dim:
+                continue
+            student_ids.append(student_id)
+            names.append(name)
+            group_ids.append(group_id)
+            vectors.append(embedding.reshape(self.dim))
+
+        if vectors:
+            matrix = self.normalize(np.vstack(vectors))
+        else:
+            matrix = np.empty((0, self.dim), dtype=np.float32)
+        return self._install(matrix, student_ids, names, group_ids, start_time)
+
+    def load(self, matrix, student_ids, names, group_ids, backend_state=None):
+        """Adopt already-normalized embeddings (such as a GalleryStore mapping) without copying.
+
+        backend_state is the (params, arrays) exported by a trained search backend
+        of the same kind; the backend adopts it instead of being rebuilt, unless it
+        does not match the backend's configuration.
+        """
+        return self._install(matrix, student_ids, names, group_ids, time.time(), backend_state)
+
+    def _install(self, matrix, student_ids, names, group_ids, start_time, backend_state=None):
+        with self._lock:
+            # A GalleryStore mapping is already file-backed
+            self._spill_file = self._spill_map = None
+            if self.spill_dir is not None and matrix.shape[0] and not isinstance(matrix, np.memmap):
+                matrix = self._spill(matrix, matrix.shape[0])
+            self._set_arrays(matrix, student_ids, names, group_ids)
+            if self.backend is not None:
+                if backend_state is None or not self.backend.adopt_state(*backend_state, self._count):
+                    self.backend.build(self.matrix)
+                    self._release_spilled_rows()
+            self._stale = False
+            self.recall = None
+            self.version += 1
+            self.built_at = time.time()
+            self.build_time_ms = int((self.built_at - start_time) * 1000)
+        return self.size
+
+    def _ensure_capacity(self, count):
+        """Grow the embedding buffer geometrically so appends stay amortized O(dim).
+
+        A read-only (mapped) buffer is always copied so it can be written, with
+        less headroom since it may be large.
+        """
+        capacity = self._vectors.shape[0]
+        writeable = self._vectors.flags.writeable
+        if count <= capacity and writeable:
+            return
+        growth = capacity * 2 if writeable else capacity + capacity // 8
+        capacity = max(count, growth, 64)
+        if self.spill_dir is not None:
+            self._vectors = self._spill(self._vectors[:self._count], capacity)
+            return
+        vectors = np.empty((capacity, self.dim), dtype=np.float32)
+        vectors[:self._count] = self._vectors[:self._count]
+        self._vectors = vectors
+
+    def _spill(self, matrix, capacity):
+        """Writeable (capacity x dim) buffer mapped from a file in spill_dir, starting with matrix's rows"""
+        fd, path = tempfile.mkstemp(prefix='face-gallery-', suffix='.f32', dir=self.spill_dir or None)
+        spill_file = os.fdopen(fd, 'r+b')
+        try:
+            # Written through the file rather than the mapping, so the rows are not paged into this process
+            for start in range(0, matrix.shape[0], self.SPILL_CHUNK_ROWS):
+                spill_file.write(np.ascontiguousarray(matrix[start:start + self.SPILL_CHUNK_ROWS], dtype=np.float32).data)
+            spill_file.truncate(capacity * self.dim * 4)
+            spill_file.flush()
+            spill_map = mmap.mmap(spill_file.fileno(), 0)
+        except Exception:
+            spill_file.close()
+            raise
+        finally:
+            # The open file keeps it alive until it is dropped; nothing is left behind
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._spill_file, self._spill_map = spill_file, spill_map
+        return np.ndarray((capacity, self.dim), dtype=np.float32, buffer=spill_map)
+
+    def _read_rows(self, rows):
+        """Copy of some rows of the matrix.
+
+        Spilled rows are read from the file rather than the mapping: a page
+        fault maps the neighbouring pages too, so re-ranking scattered rows
+        through the mapping would soon make the whole file resident.
+        """
+        if self._spill_file is None or not hasattr(os, 'preadv'):
+            return np.ascontiguousarray(self._vectors[rows])
+        vectors = np.empty((len(rows), self.dim), dtype=np.float32)
+        fd = self._spill_file.fileno()
+        row_bytes = self.dim * vectors.itemsize
+        for i, row in enumerate(rows):
+            os.preadv(fd, [vectors[i]], int(row) * row_bytes)
+        return vectors
+
+    def _release_spilled_rows(self):
+        """Let the OS drop the spill file pages this process has read; they stay in the file"""
+        if self._spill_map is not None and hasattr(mmap, 'MADV_DONTNEED'):
+            self._spill_map.madvise(mmap.MADV_DONTNEED)
+
+    def upsert(self, student_id, name, group_id, embedding):
+        """Add a student to the gallery or replace their entry.
+
+        A student without a usable embedding is removed instead. Returns True if
+        the gallery changed.
+        """
+        if embedding is None or embedding.size != self.dim:
+            return self.remove(student_id)
+
+        vector = self.normalize(embedding.reshape(self.dim))
+        with self._lock:
+            row = self._positions.get(student_id)
+            if row is None:
+                row = self._count
+                self._ensure_capacity(row + 1)
+                self._vectors[row] = vector
+                self._count += 1
+                self.student_ids.append(student_id)
+                self.names.append(name)
+                self.group_ids.append(group_id)
+                self._positions[student_id] = row
+                self.partitions.setdefault(group_id, []).append(row)
+                if self.backend is not None:
+                    self.backend.add(row, vector)
+                    if self.backend.needs_training(self._count):
+                        self._start_retrain()
+            else:
+                self._ensure_capacity(self._count)
+                old_group_id = self.group_ids[row]
+                if old_group_id != group_id:
+                    self._drop_partition_row(old_group_id, row)
+                    self.partitions.setdefault(group_id, []).append(row)
+                self._vectors[row] = vector
+                self.names[row] = name
+                self.group_ids[row] = group_id
+                if self.backend is not None:
+                    self.backend.update(row, vector)
+            self._partition_cache.pop(group_id, None)
+            self.version += 1
+        return True
+
+    def remove(self, student_id):
+        """Remove a student from the gallery. Returns True if they were present."""
+        with self._lock:
+            row = self._positions.pop(student_id, None)
+            if row is None:
+                return False
+
+            self._ensure_capacity(self._count)
+            last = self._count - 1
+            self._drop_partition_row(self.group_ids[row], row)
+            if self.backend is not None:
+                self.backend.remove(row, last)
+
+            # Keep the matrix dense by moving the last row into the freed slot
+            if row != last:
+                moved_group_id = self.group_ids[last]
+                self._vectors[row] = self._vectors[last]
+                self.student_ids[row] = self.student_ids[last]
+                self.names[row] = self.names[last]
+                self.group_ids[row] = moved_group_id
+                self._positions[self.student_ids[row]] = row
+                moved_rows = self.partitions[moved_group_id]
+                moved_rows[moved_rows.index(last)] = row
+                self._partition_cache.pop(moved_group_id, None)
+
+            self.student_ids.pop()
+            self.names.pop()
+            self.group_ids.pop()
+            self._count -= 1
+            self.version += 1
+        return True
+
+    @property
+    def backend_ready(self):
+        """True when searches use the backend; False while it is untrained or being retrained"""
+        return self.backend is not None and self.backend.is_trained and not self._stale
+
+    def _start_retrain(self):
+        """Retrain the backend on a background thread; call with the lock held.
+
+        Training k-means on a large gallery takes seconds, which must not block
+        searches or the write that triggered it. Until the new index is adopted,
+        searches use exact scan.
+        """
+        self._stale = True
+        if self._retraining:
+            return
+        self._retraining = True
+        threading.Thread(target=self._retrain, args=(self.backend,), name='gallery-retrain', daemon=True).start()
+
+    def _retrain(self, backend):
+        try:
+            while True:
+                with self._lock:
+                    if self.backend is not backend or not self._stale:
+                        return
+                    version = self.version
+                    snapshot = np.array(self.matrix)
+                state = backend.train(snapshot)
+                with self._lock:
+                    # Train again if the gallery changed meanwhile, so every row is assigned
+                    if self.backend is backend and self.version == version:
+                        if state is not None:
+                            backend.adopt_state(*state, self._count)
+                        self._stale = False
+                        self.recall = None
+                        return
+        finally:
+            with self._lock:
+                self._retraining = False
+                self._retrained.notify_all()
+
+    def wait_for_retrain(self, timeout=None):
+        """Block until a background retrain has finished; returns False on timeout"""
+        with self._lock:
+            return self._retrained.wait_for(lambda: not self._retraining, timeout)
+
+    def _drop_partition_row(self, group_id, row):
+        rows = self.partitions.get(group_id)
+        if rows is not None:
+            rows.remove(row)
+            if not rows:
+                del self.partitions[group_id]
+        self._partition_cache.pop(group_id, None)
+
+    def search(self, embedding, group_ids=None):
+        """Find the closest gallery entry to an embedding.
+
+        Returns (student_id, name, score), or (None, None, 0.0) for an empty gallery.
+        """
+        student_ids, names, scores = self.search_batch(np.ravel(embedding)[np.newaxis, :], group_ids)
+        return student_ids[0], names[0], scores[0]
+
+    def search_batch(self, embeddings, group_ids=None):
+        """Find the closest gallery entry for each row of an (F x dim) embedding matrix.
+
+        All faces are scored against the gallery in a single matrix product. When
+        group_ids is given, only students in those groups are considered.
+        Returns (student_ids, names, scores) lists of length F; entries are
+        None with a score of 0.0 when there is nothing to match against.
+        """
+        with self._lock:
+            rows, scores = self._search(embeddings, group_ids, 1)
+            student_ids = [self.student_ids[row] if row >= 0 else None for row in rows[:, 0]]
+            names = [self.names[row] if row >= 0 else None for row in rows[:, 0]]
+        return student_ids, names, [float(score) for score in scores[:, 0]]
+
+    def search_topk(self, embeddings, k=2, group_ids=None):
+        """The k closest gallery entries for each row of an (F x dim) embedding matrix.
+
+        Returns (student_ids, names, scores): one list per face holding up to k
+        results, best first. Fewer are returned when fewer students are searched.
+        """
+        student_ids = []
+        names = []
+        result_scores = []
+        with self._lock:
+            rows, scores = self._search(embeddings, group_ids, k)
+            for face_rows, face_scores in zip(rows, scores):
+                found = face_rows >= 0
+                student_ids.append([self.student_ids[row] for row in face_rows[found]])
+                names.append([self.names[row] for row in face_rows[found]])
+                result_scores.append([float(score) for score in face_scores[found]])
+        return student_ids, names, result_scores
+
+    def _search(self, embeddings, group_ids, k):
+        """(F x k) gallery rows and scores, best first, padded with row -1 and score 0.0.
+
+        Call with the lock held so the rows stay valid while they are looked up.
+        """
+        queries = self.normalize(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim))
+        with self._lock:
+            if group_ids is not None:
+                rows, matrix = self._select_partitions(group_ids)
+                best, scores = self._exact_search(queries, matrix, k)
+                if rows.size:
+                    best = np.where(best >= 0, rows[best], -1)
+            elif self.backend_ready:
+                best, scores = self._candidate_search(queries, self.backend.candidates(queries, k), k)
+            else:
+                best, scores = self._exact_search(queries, self.matrix, k)
+        return best, scores
+
+    @staticmethod
+    def _top_k(scores, k):
+        """Column indices of the k largest scores in each row, best first, and their scores"""
+        if k < scores.shape[1]:
+            # Partial selection of the k best, then sort only those
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    @classmethod
+    def _exact_search(cls, queries, matrix, k=1):
+        """(F x k) best rows and scores by brute force; row -1 where the matrix runs out"""
+        count = queries.shape[0]
+        best = np.full((count, k), -1, dtype=np.intp)
+        best_scores = np.zeros((count, k), dtype=np.float32)
+        if matrix.shape[0] == 0 or count == 0:
+            return best, best_scores
+        if k == 1:
+            scores = queries @ matrix.T
+            best[:, 0] = np.argmax(scores, axis=1)
+            best_scores[:, 0] = scores[np.arange(count), best[:, 0]]
+            return best, best_scores
+        top, top_scores = cls._top_k(queries @ matrix.T, k)
+        best[:, :top.shape[1]] = top
+        best_scores[:, :top.shape[1]] = top_scores
+        return best, best_scores
+
+    def _candidate_search(self, queries, candidates, k=1):
+        """Exactly re-rank each query's candidate rows into (F x k) best rows and scores"""
+        best = np.full((queries.shape[0], k), -1, dtype=np.intp)
+        best_scores = np.zeros((queries.shape[0], k), dtype=np.float32)
+        for i, rows in enumerate(candidates):
+            if rows.size == 0:
+                continue
+            scores = self._read_rows(rows) @ queries[i]
+            top, top_scores = self._top_k(scores[np.newaxis, :], k)
+            best[i, :top.shape[1]] = rows[top[0]]
+            best_scores[i, :top.shape[1]] = top_scores[0]
+        return best, best_scores
+
+    def _select_partitions(self, group_ids):
+        """Gallery rows and matrix covering the requested groups"""
+        selected = [self._partition(group_id) for group_id in dict.fromkeys(group_ids)]
+        selected = [partition for partition in selected if partition is not None]
+        if not selected:
+            return np.empty(0, dtype=np.intp), np.empty((0, self.dim), dtype=np.float32)
+        if len(selected) == 1:
+            return selected[0]
+        return (np.concatenate([rows for rows, _ in selected]),
+                np.vstack([matrix for _, matrix in selected]))
+
+    def measure_recall(self, sample_size=200, noise=0.045, seed=0):
+        """Fraction of queries where the search backend finds the exact best match.
+
+        Queries are gallery embeddings with Gaussian noise added (the default gives
+        a cosine similarity of about 0.7 to the original, like a new photo of an
+        enrolled student). Returns None when no approximate backend is active.
+        """
+        with self._lock:
+            if not self.backend_ready or self._count == 0:
+                self.recall = None
+                return None
+
+            rng = np.random.default_rng(seed)
+            sample = rng.choice(self._count, min(sample_size, self._count), replace=False)
+            queries = self.matrix[sample] + rng.normal(0, noise, (sample.size, self.dim)).astype(np.float32)
+            queries = self.normalize(queries)
+
+            exact, _ = self._exact_search(queries, self.matrix)
+            self._release_spilled_rows()
+            approximate, _ = self._candidate_search(queries, self.backend.candidates(queries))
+            self.recall = float(np.mean(exact[:, 0] == approximate[:, 0]))
+        return self.recall
+
+    def stats(self):
+        """Summary of the current gallery for health and debug endpoints"""
+        with self._lock:
+            return {
+                "size": self.size,
+                "groups": len([group_id for group_id in self.partitions if group_id is not None]),
+                "dim": self.dim,
+                "version": self.version,
+                "built_at": self.built_at,
+                "build_time_ms": self.build_time_ms,
+                "memory_bytes": int(self._vectors.nbytes),
+                "spilled": self._spill_map is not None,
+                "backend": self.backend.stats() if self.backend is not None else {"name": "flat"},
+                "retraining": self._stale,
+                "recall": self.recall
+            }
@@ -0,0 +1,200 @@
+import json
+import os
+import struct
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; publishing then relies on the atomic rename alone
+    fcntl = None
+
+
+class GalleryStoreData:
+    """Contents of a gallery file: a read-only float32 matrix plus the ID table.
+
+    backend is the (params, arrays) state of the trained search backend the
+    gallery was published with, or None if it had none.
+    """
+
+    def __init__(self, generation, matrix, student_ids, names, group_ids, signature, backend=None):
+        self.generation = generation
+        self.matrix = matrix
+        self.student_ids = student_ids
+        self.names = names
+        self.group_ids = group_ids
+        self.signature = signature
+        self.backend = backend
+
+
+class GalleryStore:
+    """Versioned gallery file shared by every worker process on a host.
+
+    Layout (little-endian):
+      header   64 bytes: magic, format version, dim, count, generation,
+               ID table offset and ID table length
+      matrix   count x dim float32 rows starting at byte 64
+      backend  arrays of the trained search backend (IVF centroids and cell
+               assignments, or quantized codes), each 64-byte aligned
+      ID table UTF-8 JSON with the student IDs, names and group IDs of each row,
+               the database signature the gallery was built from and the
+               parameters, offsets, dtypes and shapes of the backend arrays
+
+    Workers map the matrix read-only with np.memmap, so the page cache holds a
+    single copy per host. Backend arrays are mapped the same way, so workers
+    adopt the publisher's trained index instead of retraining it. New versions are written to a temporary file and
+    swapped in with an atomic rename; existing mappings keep the old file alive
+    until they are dropped.
+    """
+
+    MAGIC = b'FLGALLRY'
+    FORMAT_VERSION = 1
+    HEADER = struct.Struct('<8sIIQQQQ')
+    MATRIX_OFFSET = 64
+
+    def __init__(self, path):
+        self.path = path
+        self._identity = None
+
+    def _file_identity(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def has_changed(self):
+        """True if the file differs from the one last loaded or published by this process"""
+        return self._file_identity() != self._identity
+
+    @contextmanager
+    def lock(self):
+        """Exclusive lock serializing rebuilds and publishes across processes"""
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_header(self, f):
+        data = f.read(self.HEADER.size)
+        if len(data) < self.HEADER.size:
+            raise ValueError("Gallery file is truncated")
+        magic, version, dim, count, generation, ids_offset, ids_length = self.HEADER.unpack(data)
+        if magic != self.MAGIC or version != self.FORMAT_VERSION:
+            raise ValueError("Unrecognized gallery file format")
+        return dim, count, generation, ids_offset, ids_length
+
+    def load(self, dim=512):
+        """Map the current gallery file, or return None if there is no valid file"""
+        identity = self._file_identity()
+        if identity is None:
+            return None
+
+        with open(self.path, 'rb') as f:
+            file_dim, count, generation, ids_offset, ids_length = self._read_header(f)
+            if file_dim != dim:
+                raise ValueError(f"Gallery file has {file_dim}-d embeddings, expected {dim}")
+            f.seek(ids_offset)
+            table = json.loads(f.read(ids_length).decode('utf-8'))
+
+        if count:
+            matrix = np.memmap(self.path, dtype='<f4', mode='r', offset=self.MATRIX_OFFSET, shape=(count, dim))
+        else:
+            matrix = np.empty((0, dim), dtype=np.float32)
+
+        rows = table['rows']
+        if len(rows) != count:
+            raise ValueError("Gallery file ID table does not match the matrix")
+        backend = table.get('backend')
+        if backend is not None:
+            arrays = {name: self._map_array(layout) for name, layout in backend['arrays'].items()}
+            backend = (backend['params'], arrays)
+        self._identity = identity
+        return GalleryStoreData(
+            generation,
+            matrix,
+            [row[0] for row in rows],
+            [row[1] for row in rows],
+            [row[2] for row in rows],
+            table.get('signature'),
+            backend
+        )
+
+    def _map_array(self, layout):
+        shape = tuple(layout['shape'])
+        if not np.prod(shape):
+            return np.empty(shape, dtype=layout['dtype'])
+        return np.memmap(self.path, dtype=layout['dtype'], mode='r', offset=layout['offset'], shape=shape)
+
+    def _backend_layout(self, backend, offset):
+        """Table entry and aligned (offset, array) pairs for a backend's exported state"""
+        state = backend.export_state() if backend is not None else None
+        if state is None:
+            return None, []
+        params, arrays = state
+        layout = {}
+        placed = []
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            array = array.astype(array.dtype.newbyteorder('<'), copy=False)
+            offset = -(-offset // self.MATRIX_OFFSET) * self.MATRIX_OFFSET
+            layout[name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+            placed.append((offset, array))
+            offset += array.nbytes
+        return {'params': params, 'arrays': layout}, placed
+
+    def _current_generation(self):
+        try:
+            with open(self.path, 'rb') as f:
+                return self._read_header(f)[2]
+        except (OSError, ValueError):
+            return 0
+
+    def publish(self, gallery, signature=None):
+        """Write the gallery to a new file version and atomically swap it in.
+
+        Call with lock() held so generations increase monotonically. Returns the
+        new generation number.
+        """
+        generation = self._current_generation() + 1
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+
+        with gallery.lock:
+            matrix = gallery.matrix
+            backend, arrays = self._backend_layout(gallery.backend, self.MATRIX_OFFSET + matrix.nbytes)
+            table = json.dumps({
+                'signature': signature,
+                'rows': [list(row) for row in zip(gallery.student_ids, gallery.names, gallery.group_ids)],
+                'backend': backend
+            }).encode('utf-8')
+            ids_offset = arrays[-1][0] + arrays[-1][1].nbytes if arrays else self.MATRIX_OFFSET + matrix.nbytes
+
+            try:
+                with open(temp_path, 'wb') as f:
+                    header = self.HEADER.pack(self.MAGIC, self.FORMAT_VERSION, gallery.dim, matrix.shape[0],
+                                              generation, ids_offset, len(table))
+                    f.write(header.ljust(self.MATRIX_OFFSET, b'\0'))
+                    f.write(np.ascontiguousarray(matrix, dtype='<f4').data)
+                    for offset, array in arrays:
+                        f.write(b'\0' * (offset - f.tell()))
+                        f.write(array.data)
+                    f.write(table)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+        self._identity = self._file_identity()
+        return generation
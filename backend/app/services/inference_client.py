@@ -0,0 +1,111 @@
+import socket
+import cv2
+import numpy as np
+from app.services.face_embedding import embed_faces
+from app.services.inference_protocol import InferenceError, recv_message, send_message
+
+
+class InferenceClient:
+    """Sends requests to the inference server, one Unix socket connection per request.
+
+    A connection is held by one server process for the length of a request,
+    so connections are not kept open between requests; connecting to a local
+    socket costs microseconds.
+    """
+
+    def __init__(self, socket_path, timeout=30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def request(self, op, arrays=(), **params):
+        """Run op on the server; returns (header, arrays) of the reply"""
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                send_message(sock, dict(params, op=op), arrays)
+                header, arrays = recv_message(sock)
+        except OSError as e:
+            raise InferenceError(f"Inference server at {self.socket_path} is unavailable: {str(e)}") from e
+        if not header.get('ok'):
+            raise InferenceError(header.get('error', f"Inference server failed to run '{op}'"))
+        return header, arrays
+
+
+class RemoteDetector:
+    """Stand-in for the RetinaFace model of a FaceAnalysis, run by the inference server"""
+    taskname = 'detection'
+
+    def __init__(self, client, info):
+        self.client = client
+        self.input_size = tuple(info['input_size']) if info.get('input_size') else None
+
+    def detect(self, img, input_size=None, max_num=0, metric='default'):
+        """RetinaFace.detect; the image is shrunk to the detector input here so less of it is sent"""
+        height, width = img.shape[:2]
+        scale_x = scale_y = 1.0
+        if input_size is not None:
+            scale = min(input_size[0] / width, input_size[1] / height)
+            if scale < 1.0:
+                small_width, small_height = max(int(width * scale), 1), max(int(height * scale), 1)
+                img = cv2.resize(img, (small_width, small_height))
+                scale_x, scale_y = small_width / width, small_height / height
+        _, arrays = self.client.request(
+            'detect', [img], input_size=list(input_size) if input_size else None, max_num=max_num, metric=metric
+        )
+        bboxes = arrays[0].copy()
+        kpss = arrays[1].copy() if len(arrays) > 1 else None
+        bboxes[:, [0, 2]] /= scale_x
+        bboxes[:, [1, 3]] /= scale_y
+        if kpss is not None:
+            kpss /= np.array([scale_x, scale_y], dtype=kpss.dtype)
+        return bboxes, kpss
+
+
+class RemoteRecognizer:
+    """Stand-in for the ArcFace model of a FaceAnalysis; crops are aligned locally and embedded by the server"""
+    taskname = 'recognition'
+
+    def __init__(self, client, info):
+        self.client = client
+        self.input_size = tuple(info['input_size'])
+        self.input_shape = info['input_shape']
+
+    def get_feat(self, imgs):
+        if not isinstance(imgs, list):
+            imgs = [imgs]
+        _, arrays = self.client.request('embed', [np.stack(imgs)])
+        return arrays[0]
+
+    def get(self, img, face):
+        """Embed one face like ArcFaceONNX.get; prefer embed_faces to send a frame's faces in one request"""
+        embed_faces(self, img, [face])
+        return face.embedding
+
+
+class RemoteFaceAnalysis:
+    """FaceAnalysis look-alike whose detection and recognition run in the inference server.
+
+    Only detection and recognition are proxied; other modules loaded by the
+    server are listed by server_modules but not run.
+    """
+
+    def __init__(self, socket_path, timeout=30.0):
+        self.client = InferenceClient(socket_path, timeout)
+        info, _ = self.client.request('info')
+        self.server_modules = info['modules']
+        self.processes = info.get('processes')
+        self.models = {}
+        if 'detection' not in info['models']:
+            raise InferenceError("Inference server has no face detection model")
+        self.det_model = self.models['detection'] = RemoteDetector(self.client, info['models']['detection'])
+        if 'recognition' in info['models']:
+            self.models['recognition'] = RemoteRecognizer(self.client, info['models']['recognition'])
+
+    def metrics(self):
+        """Metrics snapshot of the server process that answers"""
+        header, _ = self.client.request('metrics')
+        return header['metrics']
+
+    def prepare(self, ctx_id, det_thresh=0.5, det_size=(640, 640)):
+        """The server prepares its own models"""
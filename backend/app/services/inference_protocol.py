@@ -0,0 +1,58 @@
+import json
+import struct
+import numpy as np
+
+# Every message is a frame header, a JSON header and the raw bytes of its arrays
+FRAME = struct.Struct('!II')
+MAX_HEADER_SIZE = 1 << 20
+
+
+class InferenceError(RuntimeError):
+    """Raised when the inference server cannot be reached or reports a failure"""
+
+
+def _recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise InferenceError("Inference connection closed mid-message")
+        received += count
+    return buffer
+
+
+def send_message(sock, header, arrays=()):
+    """Send a JSON header and numpy arrays; array dtypes and shapes travel in the header"""
+    arrays = [np.ascontiguousarray(array) for array in arrays]
+    header = dict(header, arrays=[{"dtype": array.dtype.str, "shape": list(array.shape)} for array in arrays])
+    encoded = json.dumps(header).encode('utf-8')
+    payload_size = sum(array.nbytes for array in arrays)
+    sock.sendall(FRAME.pack(len(encoded), payload_size) + encoded)
+    for array in arrays:
+        if array.nbytes:
+            sock.sendall(memoryview(array.reshape(-1)).cast('B'))
+
+
+def recv_message(sock):
+    """Receive a message sent by send_message; returns (header, arrays)"""
+    header_size, payload_size = FRAME.unpack(bytes(_recv_exactly(sock, FRAME.size)))
+    if header_size > MAX_HEADER_SIZE:
+        raise InferenceError(f"Inference message header of {header_size} bytes is too large")
+    header = json.loads(bytes(_recv_exactly(sock, header_size)).decode('utf-8'))
+    payload = _recv_exactly(sock, payload_size)
+
+    arrays = []
+    offset = 0
+    for spec in header.pop('arrays', []):
+        dtype = np.dtype(spec['dtype'])
+        if dtype.hasobject:
+            raise InferenceError("Inference messages cannot carry object arrays")
+        count = int(np.prod(spec['shape'], dtype=np.int64))
+        array = np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(spec['shape'])
+        offset += array.nbytes
+        arrays.append(array)
+    if offset != payload_size:
+        raise InferenceError("Inference message payload does not match its arrays")
+    return header, arrays
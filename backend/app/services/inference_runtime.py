@@ -0,0 +1,151 @@
+import glob
+import os
+import os.path as osp
+import cv2
+import onnxruntime
+from insightface.app import FaceAnalysis
+from insightface.model_zoo.model_zoo import ModelRouter
+from insightface.utils.storage import ensure_available
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    # Without threadpoolctl, BLAS is capped through environment variables,
+    # which only take effect if NumPy has not loaded its BLAS yet
+    threadpool_limits = None
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+EXECUTION_MODES = {
+    'sequential': onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+BLAS_THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+# Quantized copies of a model pack (see scripts/quantize_models.py) sit next to it under this suffix
+QUANTIZED_PACK_SUFFIX = '-int8'
+MODEL_PRECISIONS = ('float32', 'int8')
+
+
+def available_cores():
+    """CPU cores this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def parse_allowed_modules(modules):
+    """InsightFace modules to load from a FACE_ALLOWED_MODULES value, or None for all of them"""
+    if isinstance(modules, str):
+        modules = [module.strip() for module in modules.split(',') if module.strip()]
+    if not modules or 'all' in modules:
+        return None
+    return list(modules)
+
+
+def model_pack(root, name, precision='float32'):
+    """(pack name, precision) of the models to load for FACE_MODEL_PRECISION.
+
+    'int8' selects the quantized copy of the pack written by
+    scripts/quantize_models.py, or the float pack while there is none.
+    """
+    if precision not in MODEL_PRECISIONS:
+        raise ValueError(f"Unknown model precision '{precision}'")
+    if precision == 'int8':
+        quantized = name + QUANTIZED_PACK_SUFFIX
+        if glob.glob(osp.join(osp.expanduser(root), 'models', quantized, '*.onnx')):
+            return quantized, 'int8'
+    return name, 'float32'
+
+
+def thread_budget(config):
+    """Compute threads one worker process may use: FACE_CPU_THREADS, or the cores split evenly across FACE_WORKER_COUNT"""
+    threads = config.get('FACE_CPU_THREADS', 0)
+    if threads > 0:
+        return threads
+    return max(1, available_cores() // max(config.get('FACE_WORKER_COUNT', 1), 1))
+
+
+def runtime_settings(config):
+    """Thread and ONNX Runtime session settings of this worker, as reported on /health"""
+    budget = thread_budget(config)
+    return {
+        "cores": available_cores(),
+        "workers": config.get('FACE_WORKER_COUNT', 1),
+        "thread_budget": budget,
+        "intra_op_threads": config.get('FACE_ORT_INTRA_OP_THREADS', 0) or budget,
+        "tile_workers": min(4, budget),
+        "tile_intra_op_threads": config.get('FACE_ORT_TILE_INTRA_OP_THREADS', 0) or max(1, budget // min(4, budget)),
+        "inter_op_threads": config.get('FACE_ORT_INTER_OP_THREADS', 1),
+        "graph_optimization": config.get('FACE_ORT_GRAPH_OPTIMIZATION', 'all'),
+        "execution_mode": config.get('FACE_ORT_EXECUTION_MODE', 'sequential'),
+        "cpu_mem_arena": config.get('FACE_ORT_CPU_MEM_ARENA', True),
+        "mem_pattern": config.get('FACE_ORT_MEM_PATTERN', True),
+        "allow_spinning": config.get('FACE_ORT_ALLOW_SPINNING', True),
+    }
+
+
+def session_options(settings):
+    """onnxruntime.SessionOptions for runtime_settings()"""
+    if settings['graph_optimization'] not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unknown graph optimization level '{settings['graph_optimization']}'")
+    if settings['execution_mode'] not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode '{settings['execution_mode']}'")
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = settings['intra_op_threads']
+    options.inter_op_num_threads = settings['inter_op_threads']
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[settings['graph_optimization']]
+    options.execution_mode = EXECUTION_MODES[settings['execution_mode']]
+    options.enable_cpu_mem_arena = settings['cpu_mem_arena']
+    options.enable_mem_pattern = settings['mem_pattern']
+    options.add_session_config_entry('session.intra_op.allow_spinning', '1' if settings['allow_spinning'] else '0')
+    return options
+
+
+def detector_session(detector, providers=None, sess_options=None):
+    """Another ONNX Runtime session of a loaded detector, e.g. with fewer intra-op threads for tiles"""
+    session = ModelRouter(detector.model_file).get_model(providers=providers, sess_options=sess_options)
+    session.prepare(0, input_size=detector.input_size, det_thresh=detector.det_thresh)
+    return session
+
+
+def limit_library_threads(threads):
+    """Cap the BLAS (NumPy) and OpenCV thread pools of this process; returns how BLAS was capped"""
+    cv2.setNumThreads(threads)
+    if threadpool_limits is not None:
+        threadpool_limits(limits=threads, user_api='blas')
+        return "threadpoolctl"
+    for variable in BLAS_THREAD_VARIABLES:
+        os.environ.setdefault(variable, str(threads))
+    return "environment"
+
+
+class TunedFaceAnalysis(FaceAnalysis):
+    """FaceAnalysis whose ONNX Runtime sessions are created with the given SessionOptions.
+
+    insightface's model_zoo.get_model only forwards providers, so the models
+    are routed here instead, loading the same files in the same order.
+    """
+
+    def __init__(self, name, root, allowed_modules=None, providers=None, sess_options=None):
+        onnxruntime.set_default_logger_severity(3)
+        self.models = {}
+        self.model_dir = ensure_available('models', name, root=root)
+        for onnx_file in sorted(glob.glob(osp.join(self.model_dir, '*.onnx'))):
+            model = ModelRouter(onnx_file).get_model(providers=providers, sess_options=sess_options)
+            if model is None:
+                continue
+            if allowed_modules is not None and model.taskname not in allowed_modules:
+                continue
+            if model.taskname not in self.models:
+                self.models[model.taskname] = model
+        if 'detection' not in self.models:
+            raise RuntimeError(f"No face detection model found in {self.model_dir}")
+        self.det_model = self.models['detection']
@@ -0,0 +1,186 @@
+"""Face inference server: a pool of processes that each own one InsightFace model.
+
+Web workers with FACE_INFERENCE_SOCKET set send detection and recognition
+requests to this server over a Unix socket instead of loading the models
+themselves, so model memory and inference CPU scale with --processes rather
+than with the gunicorn worker count, and slow group photos no longer hold up
+the web workers' threads for cheap endpoints.
+
+Every process loads and warms up the models, then accepts connections on the
+shared listening socket; the kernel hands each connection to a process with
+a free handler thread. Face crops of concurrent embed requests are merged
+into one recognition batch (see micro_batcher).
+Messages are framed JSON headers followed by raw array bytes (see
+inference_protocol), never pickles.
+
+Usage: python -m app.services.inference_server --socket /tmp/face-inference.sock --processes 2 --threads 4
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from flask import Flask
+from app.config import config_by_name
+from app.services.inference_protocol import InferenceError, recv_message, send_message
+from app.utils.metrics import metrics
+
+logger = logging.getLogger('inference_server')
+
+
+def create_inference_app(config_name, processes):
+    """Flask app holding the configuration the models are loaded with; it serves no HTTP"""
+    app = Flask('inference_server')
+    app.config.from_object(config_by_name[config_name])
+    # This process runs the models itself and shares the cores with the other inference processes
+    app.config['FACE_INFERENCE_SOCKET'] = None
+    app.config['FACE_WORKER_COUNT'] = processes
+    return app
+
+
+class InferenceHandler:
+    """Runs the requests of one connection against a loaded FaceService model"""
+
+    def __init__(self, face_service, processes):
+        self.face_service = face_service
+        self.processes = processes
+
+    def info(self, header, arrays):
+        model = self.face_service.model
+        models = {'detection': {'input_size': model.det_model.input_size}}
+        recognizer = model.models.get('recognition')
+        if recognizer is not None:
+            models['recognition'] = {
+                'input_size': recognizer.input_size,
+                'input_shape': [dim if isinstance(dim, int) else None for dim in recognizer.input_shape]
+            }
+        return {'modules': self.face_service.active_modules(), 'processes': self.processes, 'models': models}, []
+
+    def detect(self, header, arrays):
+        input_size = tuple(header['input_size']) if header.get('input_size') else None
+        bboxes, kpss = self.face_service.model.det_model.detect(
+            arrays[0], input_size=input_size, max_num=header.get('max_num', 0), metric=header.get('metric', 'default')
+        )
+        results = [bboxes.astype(np.float32)]
+        if kpss is not None:
+            results.append(kpss.astype(np.float32))
+        return {}, results
+
+    def embed(self, header, arrays):
+        recognizer = self.face_service._recognizer()
+        if recognizer is None:
+            raise InferenceError("Recognition module is not loaded")
+        return {}, [np.asarray(recognizer.get_feat(list(arrays[0])), dtype=np.float32)]
+
+    def metrics(self, header, arrays):
+        return {'metrics': metrics.snapshot()}, []
+
+    def ping(self, header, arrays):
+        return {}, []
+
+    OPS = ('info', 'detect', 'embed', 'metrics', 'ping')
+
+    def handle(self, conn):
+        header, arrays = recv_message(conn)
+        op = header.get('op')
+        try:
+            if op not in self.OPS:
+                raise InferenceError(f"Unknown inference operation '{op}'")
+            reply, results = getattr(self, op)(header, arrays)
+            reply['ok'] = True
+        except Exception as e:
+            logger.error(f"Inference '{op}' failed: {str(e)}")
+            reply, results = {'ok': False, 'error': str(e)}, []
+        send_message(conn, reply, results)
+
+
+def serve(listener, config_name, processes, threads, timeout):
+    """Body of one inference process: load and warm up the models, then answer connections"""
+    from app.services.face_service import FaceService
+
+    # The supervisor's handlers were inherited by fork; it stops this process with SIGTERM
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    app = create_inference_app(config_name, processes)
+    with app.app_context():
+        face_service = FaceService()
+        if not face_service.initialize():
+            raise SystemExit("Could not load the face models")
+        face_service.warm_up()
+        handler = InferenceHandler(face_service, processes)
+        logger.info(f"Inference process {os.getpid()} ready")
+        
+        # Only accept while a handler thread is free, so busy processes leave connections to idle ones
+        free = threading.Semaphore(threads)
+        
+        def answer(conn):
+            with app.app_context(), conn:
+                try:
+                    handler.handle(conn)
+                except Exception as e:
+                    logger.warning(f"Dropped inference connection: {str(e)}")
+                finally:
+                    free.release()
+        
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            while True:
+                free.acquire()
+                conn, _ = listener.accept()
+                conn.settimeout(timeout)
+                pool.submit(answer, conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--socket', default=os.getenv('FACE_INFERENCE_SOCKET', '/tmp/face-inference.sock'))
+    parser.add_argument('--processes', type=int, default=int(os.getenv('FACE_INFERENCE_PROCESSES', 2)))
+    parser.add_argument('--threads', type=int, default=int(os.getenv('FACE_INFERENCE_THREADS', 4)),
+                        help='Requests each process handles at once; their face crops share recognition batches')
+    parser.add_argument('--config', default=os.getenv('FLASK_ENV', 'dev'))
+    parser.add_argument('--timeout', type=float, default=float(os.getenv('FACE_INFERENCE_TIMEOUT', 30.0)))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s in %(name)s: %(message)s')
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(args.socket)
+    listener.listen(128)
+
+    # Fork before any model is loaded; every process creates its own ONNX Runtime sessions
+    context = multiprocessing.get_context('fork')
+
+    def start():
+        process = context.Process(target=serve, args=(listener, args.config, args.processes, max(args.threads, 1), args.timeout), daemon=True)
+        process.start()
+        return process
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+
+    workers = [start() for _ in range(max(args.processes, 1))]
+    logger.info(f"Inference server listening on {args.socket} with {len(workers)} processes")
+    try:
+        while not stopping.wait(1.0):
+            for i, process in enumerate(workers):
+                if not process.is_alive():
+                    logger.warning(f"Inference process {process.pid} exited with {process.exitcode}, restarting")
+                    workers[i] = start()
+    finally:
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.join(5)
+        listener.close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == '__main__':
+    main()
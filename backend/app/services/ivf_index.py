@@ -0,0 +1,209 @@
+import numpy as np
+
+
+class IVFIndex:
+    """Inverted-file approximate nearest-neighbour search for GalleryIndex.
+
+    Gallery rows are clustered with spherical k-means into nlist cells. A query
+    only visits the nprobe cells with the closest centroids, and GalleryIndex
+    scores the rows in those cells exactly. Galleries smaller than min_train_size
+    are left untrained, in which case GalleryIndex falls back to exact search.
+
+    Rows are tracked by their index in the gallery matrix, so the index follows
+    the gallery's add, update and remove (move last row into the hole) operations
+    without retraining. The centroids are retrained when the gallery doubles.
+    """
+
+    name = 'ivf'
+
+    def __init__(self, nlist=0, nprobe=8, min_train_size=5000, max_iterations=20, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.max_iterations = max_iterations
+        self.seed = seed
+        self.centroids = None
+        self.lists = []
+        self.trained_size = 0
+        self._row_cells = []
+        self._list_cache = {}
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def needs_training(self, size):
+        """True once the gallery is big enough to train, or has doubled since training"""
+        if size < self.min_train_size:
+            return False
+        return not self.is_trained or size >= 2 * self.trained_size
+
+    def build(self, matrix):
+        """Train centroids on the gallery matrix and assign every row to a cell"""
+        self.centroids = None
+        self.lists = []
+        self._row_cells = []
+        self._list_cache = {}
+        self.trained_size = 0
+
+        count = matrix.shape[0]
+        if count < max(self.min_train_size, 1):
+            return
+
+        nlist = self.nlist or int(round(np.sqrt(count)))
+        nlist = max(1, min(nlist, count))
+        self.centroids = self._train(matrix, nlist)
+
+        self._set_cells(self._assign(matrix), nlist)
+        self.trained_size = count
+
+    def _set_cells(self, cells, nlist):
+        """Rebuild the inverted lists from the cell of every row"""
+        self._row_cells = cells.tolist()
+        order = np.argsort(cells, kind='stable')
+        bounds = np.searchsorted(cells[order], np.arange(nlist + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]].tolist() for c in range(nlist)]
+        self._list_cache = {}
+
+    def export_state(self):
+        """Parameters and arrays another process can adopt instead of training, or None"""
+        if not self.is_trained:
+            return None
+        params = {
+            "name": self.name,
+            "nlist": len(self.lists),
+            "min_train_size": self.min_train_size,
+            "max_iterations": self.max_iterations,
+            "seed": self.seed,
+            "trained_size": self.trained_size
+        }
+        arrays = {
+            "centroids": self.centroids,
+            "cells": np.asarray(self._row_cells, dtype=np.int32)
+        }
+        return params, arrays
+
+    def adopt_state(self, params, arrays, count):
+        """Take over centroids and cell assignments from export_state.
+
+        Returns False, leaving the index untouched, if they were trained with a
+        different configuration or do not cover count rows.
+        """
+        if (params.get("name") != self.name
+                or (self.nlist and params.get("nlist") != self.nlist)
+                or params.get("min_train_size") != self.min_train_size
+                or params.get("max_iterations") != self.max_iterations
+                or params.get("seed") != self.seed):
+            return False
+        centroids = arrays.get("centroids")
+        cells = arrays.get("cells")
+        if centroids is None or cells is None or cells.shape[0] != count:
+            return False
+        nlist = centroids.shape[0]
+        if nlist != params["nlist"] or (cells.size and (cells.min() < 0 or cells.max() >= nlist)):
+            return False
+
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self._set_cells(np.asarray(cells, dtype=np.intp), nlist)
+        self.trained_size = params["trained_size"]
+        return True
+
+    def train(self, matrix):
+        """Train a copy of this index on matrix and return its export_state, leaving this index as it is"""
+        trained = IVFIndex(self.nlist, self.nprobe, self.min_train_size, self.max_iterations, self.seed)
+        trained.build(matrix)
+        return trained.export_state()
+
+    def _train(self, matrix, nlist):
+        """Spherical k-means on a sample of up to 64 rows per centroid"""
+        rng = np.random.default_rng(self.seed)
+        count = matrix.shape[0]
+        sample = matrix[rng.choice(count, min(count, nlist * 64), replace=False)]
+        centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+
+        for _ in range(self.max_iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+
+            # Reseed empty cells from random sample points
+            empty = np.bincount(labels, minlength=nlist) == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()), replace=False)]
+
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            updated = (sums / norms).astype(np.float32)
+            converged = np.allclose(updated, centroids, atol=1e-4)
+            centroids = updated
+            if converged:
+                break
+        return centroids
+
+    def _assign(self, vectors, chunk_size=8192):
+        """Nearest centroid for each row, in chunks to bound memory"""
+        cells = np.empty(vectors.shape[0], dtype=np.intp)
+        for start in range(0, vectors.shape[0], chunk_size):
+            chunk = vectors[start:start + chunk_size]
+            cells[start:start + chunk_size] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return cells
+
+    def _cell_rows(self, cell):
+        rows = self._list_cache.get(cell)
+        if rows is None:
+            rows = np.array(self.lists[cell], dtype=np.intp)
+            self._list_cache[cell] = rows
+        return rows
+
+    def add(self, row, vector):
+        if not self.is_trained:
+            return
+        cell = int(np.argmax(self.centroids @ vector))
+        self.lists[cell].append(row)
+        self._list_cache.pop(cell, None)
+        self._row_cells.append(cell)
+
+    def update(self, row, vector):
+        if not self.is_trained:
+            return
+        old_cell = self._row_cells[row]
+        cell = int(np.argmax(self.centroids @ vector))
+        if cell != old_cell:
+            self.lists[old_cell].remove(row)
+            self.lists[cell].append(row)
+            self._row_cells[row] = cell
+            self._list_cache.pop(old_cell, None)
+            self._list_cache.pop(cell, None)
+
+    def remove(self, row, last_row):
+        """Drop a row; the gallery then moves last_row into its slot"""
+        if not self.is_trained:
+            return
+        cell = self._row_cells[row]
+        self.lists[cell].remove(row)
+        self._list_cache.pop(cell, None)
+        if row != last_row:
+            moved_cell = self._row_cells[last_row]
+            moved = self.lists[moved_cell]
+            moved[moved.index(last_row)] = row
+            self._row_cells[row] = moved_cell
+            self._list_cache.pop(moved_cell, None)
+        self._row_cells.pop()
+
+    def candidates(self, queries, k=1):
+        """Candidate gallery rows for each normalized query, from its nprobe closest cells"""
+        nprobe = min(self.nprobe, len(self.lists))
+        coarse = queries @ self.centroids.T
+        probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+        return [np.concatenate([self._cell_rows(cell) for cell in cells]) for cells in probes]
+
+    def stats(self):
+        sizes = [len(rows) for rows in self.lists]
+        return {
+            "name": self.name,
+            "trained": self.is_trained,
+            "nlist": len(self.lists),
+            "nprobe": self.nprobe,
+            "trained_size": self.trained_size,
+            "largest_list": max(sizes) if sizes else 0
+        }
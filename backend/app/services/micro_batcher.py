@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import deque
+import numpy as np
+from app.utils.metrics import BATCH_SIZE_BUCKETS, metrics
+
+
+class _Request:
+    def __init__(self, items):
+        self.items = items
+        self.submitted_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Runs the items submitted by concurrent threads through run_batch together.
+
+    A background thread takes the oldest waiting request, then waits up to
+    max_wait_ms for more requests to arrive, until max_batch items are
+    collected. The combined items go through run_batch once and every
+    request gets its own rows of the result. A larger max_wait_ms forms larger
+    batches under concurrent load at the cost of that much added latency per
+    request; 0 only batches what is already waiting. A request larger than
+    max_batch is run on its own, in chunks of max_batch.
+
+    Queue wait (ms) and batch size histograms are recorded as
+    <name>_queue_wait_ms and <name>_batch_size.
+    """
+
+    def __init__(self, run_batch, max_batch=32, max_wait_ms=2.0, name='batch'):
+        self.run_batch = run_batch
+        self.max_batch = max(max_batch, 1)
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=f'{name}-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, items):
+        """Run items (a list) as part of a batch; returns their rows of the batch result"""
+        request = _Request(list(items))
+        if not request.items:
+            return self.run_batch([])
+        with self._condition:
+            self._pending.append(request)
+            self._condition.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _collect(self):
+        """Wait for the next batch of requests"""
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            batch = [self._pending.popleft()]
+            size = len(batch[0].items)
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch:
+                if self._pending:
+                    if size + len(self._pending[0].items) > self.max_batch:
+                        break
+                    batch.append(self._pending.popleft())
+                    size += len(batch[-1].items)
+                    continue
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started_at = time.perf_counter()
+            items = [item for request in batch for item in request.items]
+            try:
+                results = [self.run_batch(items[start:start + self.max_batch])
+                           for start in range(0, len(items), self.max_batch)]
+                results = np.concatenate(results) if len(results) > 1 else np.asarray(results[0])
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                continue
+
+            metrics.increment(f'{self.name}_batches')
+            metrics.observe(f'{self.name}_batch_size', len(items), BATCH_SIZE_BUCKETS)
+            offset = 0
+            for request in batch:
+                metrics.observe(f'{self.name}_queue_wait_ms', (started_at - request.submitted_at) * 1000)
+                request.result = results[offset:offset + len(request.items)]
+                offset += len(request.items)
+                request.done.set()
+
+
+class BatchedRecognizer:
+    """Recognizer whose get_feat calls from concurrent requests are merged by a MicroBatcher"""
+
+    def __init__(self, recognizer, max_batch=32, max_wait_ms=2.0):
+        self.recognizer = recognizer
+        self.input_size = recognizer.input_size
+        self.input_shape = recognizer.input_shape
+        self.batcher = MicroBatcher(recognizer.get_feat, max_batch, max_wait_ms, name='recognition')
+
+    def get_feat(self, imgs):
+        if not isinstance(imgs, list):
+            imgs = [imgs]
+        return self.batcher.submit(imgs)
@@ -0,0 +1,65 @@
+import copy
+import threading
+import time
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """Change detector for the frames of one live camera session.
+
+    Each frame is reduced to a small blurred grayscale thumbnail and compared to
+    the thumbnail of the last frame that went through recognition. When fewer
+    than min_changed of its pixels differ by more than pixel_threshold, the
+    scene is treated as unchanged and the last result can be reused. A frame is
+    processed at least every max_age seconds so slow changes are not missed.
+    """
+
+    def __init__(self, size=64, pixel_threshold=25, min_changed=0.005, max_age=5.0):
+        self.size = size
+        self.pixel_threshold = pixel_threshold
+        self.min_changed = min_changed
+        self.max_age = max_age
+        self.reference = None
+        self.result = None
+        self.processed_at = 0.0
+        self.skipped = 0
+        self.last_seen = time.time()
+        self.lock = threading.Lock()
+
+    def thumbnail(self, img):
+        """Blurred size x size grayscale version of an RGB frame"""
+        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) if img.ndim == 3 else img
+        small = cv2.resize(gray, (self.size, self.size), interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(small, (3, 3), 0).astype(np.int16)
+
+    def is_changed(self, thumbnail):
+        """Whether a frame with this thumbnail needs to be processed"""
+        self.last_seen = time.time()
+        if self.result is None or self.last_seen - self.processed_at >= self.max_age:
+            return True
+        if thumbnail.shape != self.reference.shape:
+            return True
+        changed = np.count_nonzero(np.abs(thumbnail - self.reference) > self.pixel_threshold)
+        return changed >= self.min_changed * thumbnail.size
+
+    def remember(self, thumbnail, result):
+        """Record the frame that was just processed and its result; returns the frames skipped before it"""
+        skipped = self.skipped
+        self.reference = thumbnail
+        self.result = copy.deepcopy(result)
+        self.processed_at = time.time()
+        self.skipped = 0
+        return skipped
+
+    def cached_result(self):
+        """Copy of the last result for an unchanged frame, marked skipped.
+
+        Its faces are those of the last processed frame, as recognized then;
+        skipped_frames counts the frames that reused them so far.
+        """
+        self.skipped += 1
+        result = copy.deepcopy(self.result)
+        result["skipped"] = True
+        result["skipped_frames"] = self.skipped
+        return result
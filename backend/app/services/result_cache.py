@@ -0,0 +1,82 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from app.utils.metrics import metrics
+
+
+def content_key(data, *parts):
+    """Hash of raw image bytes, together with anything else the cached result depends on"""
+    digest = hashlib.blake2b(data, digest_size=16)
+    for part in parts:
+        digest.update(b'\0' + str(part).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Thread-safe LRU cache whose entries are bounded by their estimated size in bytes.
+
+    put takes the size of each value; the least recently used entries are
+    evicted once the sizes add up to more than max_bytes, and a value larger
+    than max_bytes on its own is not cached. Lookups are counted as
+    <name>_hits and <name>_misses, evictions as <name>_evictions.
+    """
+
+    def __init__(self, max_bytes, name='result_cache'):
+        self.max_bytes = max_bytes
+        self.name = name
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """The value cached under key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        metrics.increment(f'{self.name}_misses' if entry is None else f'{self.name}_hits')
+        return entry[0] if entry is not None else None
+
+    def put(self, key, value, nbytes):
+        """Cache value under key; returns False if it is too large to cache"""
+        if nbytes > self.max_bytes:
+            return False
+        evicted = 0
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous[1]
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, size) = self._entries.popitem(last=False)
+                self.nbytes -= size
+                evicted += 1
+        if evicted:
+            metrics.increment(f'{self.name}_evictions', evicted)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None
+            }
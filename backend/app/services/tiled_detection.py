@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+def tile_origins(length, tile_size, overlap):
+    """Start offsets of overlapping tiles covering length pixels; the last tile ends at the edge"""
+    if length <= tile_size:
+        return [0]
+    step = max(tile_size - overlap, 1)
+    origins = list(range(0, length - tile_size, step))
+    origins.append(length - tile_size)
+    return origins
+
+
+def merge_detections(bboxes, kpss, iou_threshold=0.4, containment_threshold=0.6):
+    """Non-maximum suppression across tiles.
+
+    bboxes is an (N x 5) array of x1, y1, x2, y2, score. Besides the usual IoU
+    test, a box mostly contained in a higher-scoring one is dropped, which
+    removes partial faces cut by a tile seam. Returns the kept bboxes and kpss.
+    """
+    if bboxes.shape[0] == 0:
+        return bboxes, kpss
+    x1, y1, x2, y2, scores = bboxes.T
+    areas = np.maximum(x2 - x1, 0) * np.maximum(y2 - y1, 0)
+    order = np.argsort(-scores, kind='stable')
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        width = np.maximum(0.0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]))
+        height = np.maximum(0.0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]))
+        inter = width * height
+        iou = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-6)
+        contained = inter / np.maximum(np.minimum(areas[i], areas[rest]), 1e-6)
+        order = rest[(iou <= iou_threshold) & (contained <= containment_threshold)]
+    keep = np.array(keep, dtype=np.intp)
+    return bboxes[keep], kpss[keep] if kpss is not None else None
+
+
+def detect_tiled(detector, img, det_size, tile_size, overlap, workers=1):
+    """Detect faces in a large image by running the detector on overlapping tiles.
+
+    Tiles of tile_size pixels are detected at det_size, so with tile_size equal
+    to the detector size faces are found at native resolution. A whole-image pass
+    at det_size catches faces too large for one tile. Tiles run on up to workers
+    threads (ONNX Runtime releases the GIL). Returns (bboxes, kpss) in image
+    coordinates, merged across tile seams, plus the number of tiles.
+    """
+    height, width = img.shape[:2]
+    regions = [(x, y) for y in tile_origins(height, tile_size, overlap)
+               for x in tile_origins(width, tile_size, overlap)]
+
+    def detect(region):
+        if region is None:
+            return detector.detect(img, input_size=det_size, max_num=0)
+        x, y = region
+        bboxes, kpss = detector.detect(img[y:y + tile_size, x:x + tile_size], input_size=det_size, max_num=0)
+        bboxes = bboxes.copy()
+        bboxes[:, [0, 2]] += x
+        bboxes[:, [1, 3]] += y
+        if kpss is not None:
+            kpss = kpss + np.array([x, y], dtype=kpss.dtype)
+        return bboxes, kpss
+
+    jobs = [None] + regions
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(detect, jobs))
+    else:
+        results = [detect(job) for job in jobs]
+
+    bboxes = np.vstack([result[0] for result in results])
+    kpss = None
+    if all(result[1] is not None for result in results):
+        kpss = np.concatenate([result[1] for result in results])
+    bboxes, kpss = merge_detections(bboxes, kpss)
+    return bboxes, kpss, len(regions)
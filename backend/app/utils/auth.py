@@ -1,6 +1,6 @@
 from functools import wraps
 from flask import request, jsonify, current_app
-from flask_jwt_extended import jwt_required, get_jwt, verify_jwt_in_request
+from flask_jwt_extended import jwt_required, get_jwt, verify_jwt_in_request, decode_token
 
 
 def _has_admin_jwt() -> bool:
@@ -23,6 +23,28 @@ def _has_legacy_admin_token() -> bool:
     return bool(expected_token) and received == expected_token
 
 
+def is_admin_request() -> bool:
+    """Return True if the current request carries an admin JWT or the legacy admin token."""
+    return _has_admin_jwt() or _has_legacy_admin_token()
+
+
+def is_admin_token(token) -> bool:
+    """Return True if token is an admin JWT or the legacy admin token.
+
+    For clients that cannot set headers, such as browser WebSockets, and send
+    their token in a message instead.
+    """
+    expected_token = current_app.config.get("ADMIN_TOKEN")
+    if not token:
+        return False
+    if expected_token and token == expected_token:
+        return True
+    try:
+        return decode_token(token).get("role") == "admin"
+    except Exception:
+        return False
+
+
 def require_admin(f):
     """Decorator to require admin via JWT role or legacy admin token."""
     @wraps(f)
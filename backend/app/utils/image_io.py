@@ -0,0 +1,65 @@
+import io
+import warnings
+import cv2
+import numpy as np
+from PIL import Image
+
+# imread flags that let libjpeg decode at 1/2, 1/4 or 1/8 of the full size
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+class ImageDecodeError(ValueError):
+    """Raised when uploaded image data cannot be decoded"""
+
+
+def image_dimensions(data):
+    """(width, height) read from the image header without decoding the pixels, or None if unknown"""
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(io.BytesIO(data)) as image:
+                return image.size
+    except Image.DecompressionBombError as e:
+        raise ImageDecodeError(str(e)) from e
+    except Exception:
+        return None
+
+
+def reduction_factor(width, height, max_size):
+    """Largest decode reduction (1, 2, 4 or 8) that keeps the longest side at least max_size"""
+    longest = max(width, height)
+    factor = 1
+    while factor < 8 and longest // (factor * 2) >= max_size:
+        factor *= 2
+    return factor
+
+
+def load_image(image_data, max_size, dimensions=None):
+    """Decode image bytes (or take a BGR array) into an RGB array whose longest side is at most max_size.
+
+    Encoded images are first measured from their header, then decoded with the
+    largest power-of-two reduction that still leaves at least max_size pixels,
+    so libjpeg skips most of the work for oversized JPEG uploads; the rest of
+    the way is an INTER_AREA resize. dimensions may pass the (width, height)
+    already read with image_dimensions.
+    """
+    if isinstance(image_data, (bytes, bytearray, memoryview)):
+        if dimensions is None:
+            dimensions = image_dimensions(image_data)
+        factor = reduction_factor(*dimensions, max_size) if dimensions else 1
+        img = cv2.imdecode(np.frombuffer(image_data, np.uint8), REDUCED_DECODE_FLAGS[factor])
+        if img is None:
+            raise ImageDecodeError("Failed to decode image data")
+    else:
+        img = image_data
+
+    h, w = img.shape[:2]
+    if max(h, w) > max_size:
+        scale = max_size / max(h, w)
+        img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
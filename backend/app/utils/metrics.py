@@ -0,0 +1,82 @@
+import bisect
+import os
+import threading
+import time
+
+# Default histogram bucket upper bounds
+LATENCY_MS_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class Histogram:
+    """Counts of observed values per bucket, with their count and sum"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        bounds = [f"le_{bound:g}" for bound in self.buckets] + ["le_inf"]
+        return {
+            "buckets": dict(zip(bounds, self.counts)),
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "mean": round(self.sum / self.count, 3) if self.count else None
+        }
+
+
+class Metrics:
+    """Process-wide counters and histograms reported by the metrics endpoint.
+
+    Every worker process keeps its own counts; the endpoint reports the worker
+    that served the request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self.started_at = time.time()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def get(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def observe(self, name, value, buckets=LATENCY_MS_BUCKETS):
+        """Add value to histogram name; buckets are only used when the histogram is first created"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(sorted(self._counters.items()))
+            histograms = {name: histogram.snapshot() for name, histogram in sorted(self._histograms.items())}
+        return {
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "counters": counters,
+            "histograms": histograms
+        }
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+            self.started_at = time.time()
+
+
+metrics = Metrics()
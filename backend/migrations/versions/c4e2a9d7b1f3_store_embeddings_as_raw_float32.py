@@ -0,0 +1,101 @@
+"""Store embeddings as raw float32 instead of pickles
+
+Revision ID: c4e2a9d7b1f3
+Revises: b9af6984ff95
+Create Date: 2026-10-17 10:12:40.518204
+
+"""
+import io
+import pickle
+import struct
+
+from alembic import op
+import numpy as np
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e2a9d7b1f3'
+down_revision = 'b9af6984ff95'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+# Same layout as app.models.student; duplicated so this revision keeps working
+# if the model changes later
+EMBEDDING_MAGIC = b'FEMB'
+EMBEDDING_HEADER = struct.Struct('<4sHH')
+
+students = sa.table(
+    'students',
+    sa.column('student_id', sa.String(50)),
+    sa.column('embedding', sa.LargeBinary())
+)
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+    ALLOWED = {
+        ('numpy', 'ndarray'),
+        ('numpy', 'dtype'),
+        ('numpy.core.multiarray', '_reconstruct'),
+        ('numpy._core.multiarray', '_reconstruct'),
+    }
+
+    def find_class(self, module, name):
+        if (module, name) not in self.ALLOWED:
+            raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from a stored embedding")
+        return super().find_class(module, name)
+
+
+def _to_raw(data):
+    if data[:4] == EMBEDDING_MAGIC:
+        return None
+    vector = np.ascontiguousarray(np.ravel(_ArrayUnpickler(io.BytesIO(data)).load()), dtype='<f4')
+    return EMBEDDING_HEADER.pack(EMBEDDING_MAGIC, 1, vector.size) + vector.tobytes()
+
+
+def _to_pickle(data):
+    if data[:4] != EMBEDDING_MAGIC:
+        return None
+    _, _, dim = EMBEDDING_HEADER.unpack_from(data)
+    vector = np.frombuffer(data, dtype='<f4', count=dim, offset=EMBEDDING_HEADER.size)
+    return pickle.dumps(vector.astype('float32'))
+
+
+def _convert(convert):
+    """Rewrite every stored embedding in batches, keyed on student_id"""
+    bind = op.get_bind()
+    last_id = None
+    while True:
+        query = sa.select(students.c.student_id, students.c.embedding) \
+            .where(students.c.embedding.isnot(None)) \
+            .order_by(students.c.student_id) \
+            .limit(BATCH_SIZE)
+        if last_id is not None:
+            query = query.where(students.c.student_id > last_id)
+        rows = bind.execute(query).fetchall()
+        if not rows:
+            break
+
+        updates = []
+        for student_id, data in rows:
+            converted = convert(data)
+            if converted is not None:
+                updates.append({'sid': student_id, 'data': converted})
+        if updates:
+            bind.execute(
+                students.update()
+                .where(students.c.student_id == sa.bindparam('sid'))
+                .values(embedding=sa.bindparam('data')),
+                updates
+            )
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    _convert(_to_raw)
+
+
+def downgrade():
+    _convert(_to_pickle)
@@ -0,0 +1,32 @@
+"""Add students.updated_at for gallery change detection
+
+Revision ID: e3b7c1d9a5f2
+Revises: c4e2a9d7b1f3
+Create Date: 2026-10-17 14:05:11.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3b7c1d9a5f2'
+down_revision = 'c4e2a9d7b1f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('students', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime().with_variant(mysql.DATETIME(fsp=6), 'mysql'), nullable=True))
+        batch_op.create_index(batch_op.f('ix_students_updated_at'), ['updated_at'], unique=False)
+
+    # Existing rows were last written when they were created
+    op.execute("UPDATE students SET updated_at = created_at")
+
+
+def downgrade():
+    with op.batch_alter_table('students', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_students_updated_at'))
+        batch_op.drop_column('updated_at')
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Compare per-face and batched ArcFace recognition throughput on CPU.
+
+Builds frames with 1, 10 and 50 synthetic faces (the ArcFace reference
+landmarks placed across a noise image) and embeds them once per face, like
+FaceAnalysis.get, and in batches with embed_faces. Reports milliseconds per
+frame, faces per second and the largest difference between the embeddings.
+
+Usage: python scripts/benchmark_batched_recognition.py [--faces 1 10 50] [--batch-size 32]
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+# Add parent directory to path so we can import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from insightface.app import FaceAnalysis
+from insightface.app.common import Face
+from insightface.utils import face_align
+from app.services.face_embedding import embed_faces, recognizer_batch_limit
+
+
+def synthetic_faces(count, face_size=112, seed=0):
+    """A noise image with count faces laid out on a grid"""
+    columns = int(np.ceil(np.sqrt(count)))
+    rows = int(np.ceil(count / columns))
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 255, (rows * face_size * 2, columns * face_size * 2, 3), dtype=np.uint8)
+    faces = []
+    for i in range(count):
+        y, x = divmod(i, columns)
+        origin = np.array([x, y], dtype=np.float32) * face_size * 2 + face_size / 2
+        kps = face_align.arcface_dst + origin
+        faces.append(Face(bbox=np.array([*origin, *(origin + face_size)]), kps=kps, det_score=1.0))
+    return img, faces
+
+
+def timed(function, repeat):
+    function()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model-root', default=os.getenv('INSIGHTFACE_MODEL_ROOT', 'models'))
+    parser.add_argument('--detector', default=os.getenv('FACE_DETECTOR_BACKEND', 'retinaface'))
+    parser.add_argument('--faces', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    model = FaceAnalysis(name=args.detector, root=args.model_root, allowed_modules=['detection', 'recognition'],
+                         providers=['CPUExecutionProvider'])
+    model.prepare(ctx_id=0)
+    recognizer = model.models.get('recognition')
+    if recognizer is None:
+        sys.exit(f"No recognition model found under {args.model_root}/models/{args.detector}")
+    batch_size = recognizer_batch_limit(recognizer, args.batch_size)
+    if batch_size < args.batch_size:
+        print(f"Recognition model has a fixed batch size of {batch_size}")
+
+    print(f"{'faces':>6}{'mode':>14}{'ms/frame':>11}{'faces/s':>10}{'max diff':>11}")
+    for count in args.faces:
+        img, faces = synthetic_faces(count)
+
+        def per_face():
+            for face in faces:
+                recognizer.get(img, face)
+
+        ms = timed(per_face, args.repeat)
+        single = np.vstack([face.embedding for face in faces])
+        print(f"{count:>6}{'per face':>14}{ms:>11.1f}{count * 1000 / ms:>10.1f}{'':>11}")
+
+        ms = timed(lambda: embed_faces(recognizer, img, faces, batch_size), args.repeat)
+        batched = np.vstack([face.embedding for face in faces])
+        diff = np.abs(batched - single).max()
+        print(f"{count:>6}{f'batch {batch_size}':>14}{ms:>11.1f}{count * 1000 / ms:>10.1f}{diff:>11.2e}")
+
+
+if __name__ == '__main__':
+    main()
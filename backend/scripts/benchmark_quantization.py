@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""Compare int8 gallery scoring against exact float32 matching.
+
+Builds the same gallery with each backend and reports, per backend, how often
+the best match differs from the exact (match_face) result, the largest score
+difference, how often the accept/reject decision at the match threshold
+changes, the time per query and the memory used by the scoring codes. The
+float32 rows of the int8 galleries are spilled to a temporary file, as
+FaceService does, so re-ranking reads them from disk.
+
+By default a synthetic gallery is used. Pass --database to benchmark against
+the embeddings enrolled in the configured database instead.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import argparse
+import numpy as np
+
+# Add parent directory to path so we can import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.gallery_index import GalleryIndex
+from app.services.quantized_index import QuantizedIndex
+
+
+def synthetic_rows(size, dim, seed):
+    """Embeddings spread around a few thousand identities, like a real gallery"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(size // 20, 1), dim)).astype(np.float32)
+    labels = rng.integers(0, centers.shape[0], size)
+    embeddings = centers[labels] + 0.8 * rng.standard_normal((size, dim)).astype(np.float32)
+    return [(f"s{i}", None, None, embedding) for i, embedding in enumerate(embeddings)]
+
+
+def database_rows(config_name):
+    from app import create_app, db
+    from app.models.student import Student
+
+    app = create_app(config_name)
+    with app.app_context():
+        rows = db.session.query(Student.student_id, Student.name, Student.group_id, Student.embedding) \
+            .filter(Student.embedding.isnot(None)).all()
+        return [(sid, name, group_id, Student.decode_embedding(data)) for sid, name, group_id, data in rows]
+
+
+def time_search(gallery, queries, batch_size):
+    start = time.perf_counter()
+    results = ([], [])
+    for i in range(0, queries.shape[0], batch_size):
+        student_ids, _, scores = gallery.search_batch(queries[i:i + batch_size])
+        results[0].extend(student_ids)
+        results[1].extend(scores)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return results[0], np.array(results[1]), elapsed_ms / queries.shape[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=50000, help='Synthetic gallery size')
+    parser.add_argument('--queries', type=int, default=1000, help='Number of probe faces')
+    parser.add_argument('--batch-size', type=int, default=10, help='Faces matched per search call')
+    parser.add_argument('--rerank-k', type=int, nargs='+', default=[1, 5, 10, 50])
+    parser.add_argument('--threshold', type=float, default=0.60, help='Match threshold (FACE_MATCH_THRESHOLD)')
+    parser.add_argument('--noise', type=float, default=0.045, help='Probe noise (0.045 ~ cosine 0.7 to the enrolled face)')
+    parser.add_argument('--database', action='store_true', help='Use the enrolled embeddings from the database')
+    parser.add_argument('--config', default=os.getenv('FLASK_ENV', 'dev'), help='App config for --database')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = database_rows(args.config) if args.database else synthetic_rows(args.size, 512, args.seed)
+    exact = GalleryIndex()
+    exact.build(rows)
+    if exact.size == 0:
+        print("Gallery is empty")
+        return
+
+    # Probes are noisy copies of enrolled faces plus some unknown faces
+    rng = np.random.default_rng(args.seed + 1)
+    sample = rng.choice(exact.size, args.queries, replace=exact.size < args.queries)
+    queries = exact.matrix[sample] + rng.normal(0, args.noise, (args.queries, 512)).astype(np.float32)
+    queries[::10] = rng.standard_normal((queries[::10].shape[0], 512))
+
+    exact_ids, exact_scores, exact_ms = time_search(exact, queries, args.batch_size)
+    exact_accepted = exact_scores >= args.threshold
+    print(f"Gallery: {exact.size} embeddings, {args.queries} probes, batch size {args.batch_size}")
+    print(f"{'backend':<10}{'rerank_k':>9}{'top1 diff':>11}{'max |dscore|':>14}{'decision diff':>15}"
+          f"{'ms/face':>9}{'codes MB':>10}")
+    print(f"{'float32':<10}{'-':>9}{0:>11.2%}{0:>14.5f}{0:>15.2%}{exact_ms:>9.3f}{exact.matrix.nbytes / 2**20:>10.1f}")
+
+    for precision in QuantizedIndex.PRECISIONS:
+        for rerank_k in args.rerank_k:
+            gallery = GalleryIndex(backend=QuantizedIndex(precision, rerank_k=rerank_k), spill_dir=tempfile.gettempdir())
+            gallery.load(exact.matrix, exact.student_ids, exact.names, exact.group_ids)
+            student_ids, scores, ms = time_search(gallery, queries, args.batch_size)
+
+            top1_diff = np.mean([a != b for a, b in zip(student_ids, exact_ids)])
+            score_delta = np.max(np.abs(scores - exact_scores))
+            decision_diff = np.mean((scores >= args.threshold) != exact_accepted)
+            memory = gallery.backend.stats()['memory_bytes'] / 2**20
+            print(f"{precision:<10}{rerank_k:>9}{top1_diff:>11.2%}{score_delta:>14.5f}{decision_diff:>15.2%}"
+                  f"{ms:>9.3f}{memory:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Compare single-pass and tiled face detection on large group photos.
+
+For every image, reports the faces found and the detection time per megapixel
+when the photo is shrunk to MAX_IMAGE_SIZE and detected once (the old upload
+path) and when it is detected in overlapping native-resolution tiles. Each
+tile worker count gets a detector session with threads / workers intra-op
+threads, as FaceService does by default, so every run uses the same budget.
+
+Usage: python scripts/benchmark_tiled_detection.py photo1.jpg [photo2.jpg ...]
+"""
+
+import os
+import sys
+import time
+import argparse
+import cv2
+
+# Add parent directory to path so we can import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.inference_runtime import TunedFaceAnalysis, detector_session, runtime_settings, session_options
+from app.services.tiled_detection import detect_tiled
+
+
+def timed(function, repeat):
+    result = function()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return result, (time.perf_counter() - start) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+', help='Group photos to detect faces in')
+    parser.add_argument('--model-root', default=os.getenv('INSIGHTFACE_MODEL_ROOT', 'models'))
+    parser.add_argument('--detector', default=os.getenv('FACE_DETECTOR_BACKEND', 'retinaface'))
+    parser.add_argument('--max-image-size', type=int, default=1024, help='Single-pass MAX_IMAGE_SIZE')
+    parser.add_argument('--det-size', type=int, default=640)
+    parser.add_argument('--tile-size', type=int, default=640)
+    parser.add_argument('--tile-overlap', type=int, default=96)
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1, help='Thread budget (FACE_CPU_THREADS)')
+    parser.add_argument('--workers', type=int, nargs='+', default=None,
+                        help='Tile worker counts to compare (default: 1 and min(4, threads))')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    settings = runtime_settings({'FACE_CPU_THREADS': args.threads})
+    model = TunedFaceAnalysis(name=args.detector, root=args.model_root, allowed_modules=['detection'],
+                              providers=['CPUExecutionProvider'], sess_options=session_options(settings))
+    model.prepare(ctx_id=0, det_size=(args.det_size, args.det_size))
+    detector = model.det_model
+    det_size = (args.det_size, args.det_size)
+    workers_list = args.workers or [1, min(4, args.threads)]
+    tile_detectors = {
+        workers: detector_session(detector, ['CPUExecutionProvider'],
+                                  session_options({**settings, 'intra_op_threads': max(1, args.threads // workers)}))
+        for workers in dict.fromkeys(workers_list)
+    }
+
+    print(f"{'image':<28}{'mode':<16}{'faces':>7}{'ms':>10}{'ms/MP':>9}")
+    for path in args.images:
+        img = cv2.imread(path)
+        if img is None:
+            print(f"{os.path.basename(path):<28}could not read image")
+            continue
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        h, w = img.shape[:2]
+        megapixels = h * w / 1e6
+        name = f"{os.path.basename(path)[:18]} {w}x{h}"
+
+        scale = min(1.0, args.max_image_size / max(h, w))
+        small = cv2.resize(img, (int(w * scale), int(h * scale))) if scale < 1.0 else img
+        (bboxes, _), ms = timed(lambda: detector.detect(small, input_size=det_size, max_num=0), args.repeat)
+        print(f"{name:<28}{'single pass':<16}{bboxes.shape[0]:>7}{ms:>10.1f}{ms / megapixels:>9.1f}")
+
+        for workers, tile_detector in tile_detectors.items():
+            (bboxes, _, tiles), ms = timed(
+                lambda: detect_tiled(tile_detector, img, det_size, args.tile_size, args.tile_overlap, workers),
+                args.repeat
+            )
+            mode = f"{tiles} tiles x{workers}/{max(1, args.threads // workers)}t"
+            print(f"{'':<28}{mode:<16}{bboxes.shape[0]:>7}{ms:>10.1f}{ms / megapixels:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
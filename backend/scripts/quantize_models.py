@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+"""Quantize the face models to INT8 and compare them with the float models.
+
+Writes an INT8 copy of every model in <model-root>/models/<detector> to
+<model-root>/models/<detector>-int8, which FaceService loads with
+FACE_MODEL_PRECISION=int8. Static quantization (the default) calibrates the
+activation ranges on the images in --images: the float detector runs on every
+image at the detection profile's input size, and the recognizer on the
+aligned crops of the faces it finds, with the exact tensors the app feeds
+them. Dynamic quantization only needs the weights and computes activation
+ranges at run time, but its ConvInteger kernels can be slower than float
+convolutions on CPU; check the report before switching.
+
+Afterwards both packs are run on the evaluation images (--eval-images, or the
+calibration images) with the app's ONNX Runtime session settings. The report
+compares detection and recognition latency and throughput, how many float
+detections the INT8 detector finds again, the cosine similarity between
+float and INT8 embeddings of the same crops, and how often an INT8 embedding
+gets the same top gallery match and accept/reject decision at the match
+threshold. The gallery is the float embeddings of the evaluation faces, or
+the enrolled students with --database. The report is printed and written as
+JSON next to the INT8 models.
+
+Usage: python scripts/quantize_models.py --images calibration/ [--mode static|dynamic] [--report-only]
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from datetime import datetime
+import numpy as np
+
+# Add parent directory to path so we can import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from insightface.app.common import Face
+from insightface.utils import face_align
+from onnxruntime.quantization import (
+    CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, quantize_static
+)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+from app.services.face_embedding import embed_faces, recognizer_batch_limit
+from app.services.gallery_index import GalleryIndex
+from app.services.inference_runtime import (
+    QUANTIZED_PACK_SUFFIX, TunedFaceAnalysis, limit_library_threads, runtime_settings, session_options
+)
+from app.utils.image_io import ImageDecodeError, load_image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+CALIBRATION_METHODS = {
+    'minmax': CalibrationMethod.MinMax,
+    'entropy': CalibrationMethod.Entropy,
+    'percentile': CalibrationMethod.Percentile,
+}
+
+
+class RecordingSession:
+    """InferenceSession wrapper that keeps a copy of every input it runs on"""
+
+    def __init__(self, session):
+        self.session = session
+        self.feeds = []
+
+    def run(self, output_names, input_feed, *args, **kwargs):
+        self.feeds.append({name: np.array(value) for name, value in input_feed.items()})
+        return self.session.run(output_names, input_feed, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def samples(self):
+        """The recorded inputs split into batches of one, so every calibration sample has the same shape"""
+        for feed in self.feeds:
+            for i in range(next(iter(feed.values())).shape[0]):
+                yield {name: value[i:i + 1] for name, value in feed.items()}
+
+
+class RecordedDataReader(CalibrationDataReader):
+    def __init__(self, samples):
+        self.samples = iter(samples)
+
+    def get_next(self):
+        return next(self.samples, None)
+
+
+def load_images(directory, max_size, limit):
+    """RGB images of a directory, decoded and shrunk the way uploads are"""
+    paths = sorted(path for path in glob.glob(os.path.join(directory, '*')) if path.lower().endswith(IMAGE_EXTENSIONS))
+    images = []
+    for path in paths[:limit or None]:
+        with open(path, 'rb') as f:
+            try:
+                images.append(load_image(f.read(), max_size))
+            except ImageDecodeError as e:
+                print(f"Skipping {path}: {str(e)}")
+    return images
+
+
+def detect(detector, img, det_size):
+    bboxes, kpss = detector.detect(img, input_size=det_size, max_num=0)
+    return [Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+            for i in range(bboxes.shape[0])]
+
+
+def load_pack(args, name, sess_options):
+    model = TunedFaceAnalysis(name=name, root=args.model_root, allowed_modules=['detection', 'recognition'],
+                              providers=['CPUExecutionProvider'], sess_options=sess_options)
+    return model.det_model, model.models.get('recognition')
+
+
+def calibration_samples(detector, recognizer, images, det_size, batch_size):
+    """Model file -> recorded inputs of the float models on the calibration images"""
+    recorders = {detector.model_file: RecordingSession(detector.session)}
+    detector.session = recorders[detector.model_file]
+    if recognizer is not None:
+        recorders[recognizer.model_file] = RecordingSession(recognizer.session)
+        recognizer.session = recorders[recognizer.model_file]
+    for img in images:
+        faces = detect(detector, img, det_size)
+        if recognizer is not None and faces:
+            embed_faces(recognizer, img, faces, batch_size)
+    return {model_file: list(recorder.samples()) for model_file, recorder in recorders.items()}
+
+
+def quantize_pack(args, source_dir, target_dir, samples):
+    """Write an INT8 copy of every model in source_dir to target_dir; returns per-file notes"""
+    os.makedirs(target_dir, exist_ok=True)
+    notes = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for model_file in sorted(glob.glob(os.path.join(source_dir, '*.onnx'))):
+            filename = os.path.basename(model_file)
+            target = os.path.join(target_dir, filename)
+            # Shape inference and graph optimization give the quantizer a cleaner graph to work on
+            prepared = os.path.join(tmp, filename)
+            try:
+                quant_pre_process(model_file, prepared)
+            except Exception as e:
+                print(f"Pre-processing {filename} failed ({str(e)}), quantizing it as is")
+                prepared = model_file
+
+            start_time = time.perf_counter()
+            if args.mode == 'dynamic':
+                quantize_dynamic(prepared, target, weight_type=QuantType.QUInt8, per_channel=args.per_channel)
+                note = 'dynamic'
+            elif samples.get(model_file):
+                quantize_static(
+                    prepared, target, RecordedDataReader(samples[model_file]),
+                    quant_format=QuantFormat.QDQ, per_channel=args.per_channel,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                    calibrate_method=CALIBRATION_METHODS[args.calibrate_method]
+                )
+                note = f'static ({len(samples[model_file])} samples, {args.calibrate_method})'
+            else:
+                # Models the app does not run (landmarks, gender/age) have no calibration data
+                shutil.copyfile(model_file, target)
+                note = 'copied (no calibration data)'
+            notes[filename] = {
+                'quantization': note,
+                'float_mb': round(os.path.getsize(model_file) / 2**20, 2),
+                'int8_mb': round(os.path.getsize(target) / 2**20, 2),
+                'seconds': round(time.perf_counter() - start_time, 1)
+            }
+            print(f"{filename}: {note}, {notes[filename]['float_mb']} MB -> {notes[filename]['int8_mb']} MB")
+    return notes
+
+
+def latency_stats(samples_ms, items):
+    samples_ms = np.asarray(samples_ms)
+    return {
+        'mean_ms': round(float(samples_ms.mean()), 2),
+        'p50_ms': round(float(np.percentile(samples_ms, 50)), 2),
+        'p95_ms': round(float(np.percentile(samples_ms, 95)), 2),
+        'per_second': round(items * 1000 / float(samples_ms.sum()), 1) if samples_ms.sum() > 0 else None
+    }
+
+
+def box_iou(a, b):
+    """IoU of every box in a with every box in b"""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def compare_detection(packs, images, det_size, runs):
+    """Latency of each detector and how well the INT8 boxes agree with the float ones"""
+    report = {}
+    boxes = {}
+    for precision, (detector, _) in packs.items():
+        detect(detector, images[0], det_size)
+        timings = []
+        for _ in range(runs):
+            boxes[precision] = []
+            for img in images:
+                start_time = time.perf_counter()
+                faces = detect(detector, img, det_size)
+                timings.append((time.perf_counter() - start_time) * 1000)
+                boxes[precision].append(np.array([face.bbox for face in faces], dtype=np.float32).reshape(-1, 4))
+        report[precision] = latency_stats(timings, len(timings))
+
+    found, float_total, int8_total, ious = 0, 0, 0, []
+    for reference, candidate in zip(boxes['float32'], boxes['int8']):
+        float_total += len(reference)
+        int8_total += len(candidate)
+        if len(reference) and len(candidate):
+            best = box_iou(reference, candidate).max(axis=1)
+            found += int(np.count_nonzero(best >= 0.5))
+            ious.extend(best[best >= 0.5].tolist())
+    report['float_faces'] = float_total
+    report['int8_faces'] = int8_total
+    report['recall_vs_float'] = round(found / float_total, 4) if float_total else None
+    report['mean_iou'] = round(float(np.mean(ious)), 4) if ious else None
+    report['speedup'] = round(report['float32']['mean_ms'] / report['int8']['mean_ms'], 2)
+    return report
+
+
+def compare_recognition(packs, images, det_size, batch_size, runs, gallery_rows, threshold):
+    """Latency of each recognizer on the float detector's crops, and agreement of their embeddings and matches"""
+    detector, recognizer = packs['float32']
+    crops = []
+    for img in images:
+        for face in detect(detector, img, det_size):
+            if face.kps is not None:
+                crops.append(face_align.norm_crop(img, landmark=face.kps, image_size=recognizer.input_size[0]))
+    if not crops:
+        return {'error': 'No faces found in the evaluation images'}
+
+    report = {'faces': len(crops)}
+    embeddings = {}
+    for precision, (_, model) in packs.items():
+        limit = recognizer_batch_limit(model, batch_size)
+        model.get_feat(crops[:limit])
+        timings = []
+        for _ in range(runs):
+            outputs = []
+            for start in range(0, len(crops), limit):
+                start_time = time.perf_counter()
+                outputs.append(model.get_feat(crops[start:start + limit]))
+                timings.append((time.perf_counter() - start_time) * 1000)
+        embeddings[precision] = GalleryIndex.normalize(np.vstack(outputs).astype(np.float32))
+        report[precision] = latency_stats(timings, len(crops) * runs)
+        report[precision]['batch_size'] = limit
+    report['speedup'] = round(report['float32']['mean_ms'] / report['int8']['mean_ms'], 2)
+
+    cosine = np.sum(embeddings['float32'] * embeddings['int8'], axis=1)
+    report['cosine_to_float'] = {
+        'mean': round(float(cosine.mean()), 4),
+        'p5': round(float(np.percentile(cosine, 5)), 4),
+        'min': round(float(cosine.min()), 4)
+    }
+
+    gallery = GalleryIndex(dim=embeddings['float32'].shape[1])
+    if gallery_rows is None:
+        gallery_rows = [(f"face{i}", None, None, embedding) for i, embedding in enumerate(embeddings['float32'])]
+        report['gallery'] = f"{len(gallery_rows)} float embeddings of the evaluation faces"
+    else:
+        report['gallery'] = f"{len(gallery_rows)} enrolled students"
+    gallery.build(gallery_rows)
+    matches = {precision: gallery.search_topk(embeddings[precision], 1) for precision in embeddings}
+    float_ids, _, float_scores = matches['float32']
+    int8_ids, _, int8_scores = matches['int8']
+    float_ids = [ids[0] if ids else None for ids in float_ids]
+    int8_ids = [ids[0] if ids else None for ids in int8_ids]
+    float_scores = np.array([scores[0] if scores else 0.0 for scores in float_scores])
+    int8_scores = np.array([scores[0] if scores else 0.0 for scores in int8_scores])
+    # The same student, or no student, as the float model would record at the threshold
+    float_decision = [student_id if score >= threshold else None for student_id, score in zip(float_ids, float_scores)]
+    int8_decision = [student_id if score >= threshold else None for student_id, score in zip(int8_ids, int8_scores)]
+    report['top1_agreement'] = round(float(np.mean([a == b for a, b in zip(float_ids, int8_ids)])), 4)
+    report['decision_agreement'] = round(float(np.mean([a == b for a, b in zip(float_decision, int8_decision)])), 4)
+    report['max_score_delta'] = round(float(np.max(np.abs(float_scores - int8_scores))), 4)
+    report['threshold'] = threshold
+    return report
+
+
+def database_rows(config_name):
+    from app import create_app, db
+    from app.models.student import Student
+
+    app = create_app(config_name)
+    with app.app_context():
+        rows = db.session.query(Student.student_id, Student.name, Student.group_id, Student.embedding) \
+            .filter(Student.embedding.isnot(None)).all()
+        return [(sid, name, group_id, Student.decode_embedding(data)) for sid, name, group_id, data in rows]
+
+
+def print_report(report):
+    print(f"\n{'':<22}{'float32':>12}{'int8':>12}{'speedup':>9}")
+    for task, unit in (('detection', 'images/s'), ('recognition', 'faces/s')):
+        section = report.get(task) or {}
+        if 'float32' not in section:
+            print(f"{task}: {section.get('error', 'not available')}")
+            continue
+        print(f"{task + ' ms (mean)':<22}{section['float32']['mean_ms']:>12.2f}{section['int8']['mean_ms']:>12.2f}"
+              f"{section['speedup']:>8.2f}x")
+        print(f"{task + ' ms (p95)':<22}{section['float32']['p95_ms']:>12.2f}{section['int8']['p95_ms']:>12.2f}")
+        print(f"{unit:<22}{section['float32']['per_second']:>12.1f}{section['int8']['per_second']:>12.1f}")
+    detection = report.get('detection') or {}
+    if 'recall_vs_float' in detection:
+        print(f"Detection: {detection['int8_faces']} INT8 vs {detection['float_faces']} float faces, "
+              f"recall {detection['recall_vs_float']}, mean IoU {detection['mean_iou']}")
+    recognition = report.get('recognition') or {}
+    if 'cosine_to_float' in recognition:
+        print(f"Recognition: cosine to float mean {recognition['cosine_to_float']['mean']}, "
+              f"min {recognition['cosine_to_float']['min']}; top-1 agreement {recognition['top1_agreement']:.2%}, "
+              f"decision agreement {recognition['decision_agreement']:.2%} at {recognition['threshold']} "
+              f"({recognition['gallery']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model-root', default=os.getenv('INSIGHTFACE_MODEL_ROOT', 'models'))
+    parser.add_argument('--detector', default=os.getenv('FACE_DETECTOR_BACKEND', 'retinaface'))
+    parser.add_argument('--images', required=True, help='Directory of calibration images (class photos and kiosk frames)')
+    parser.add_argument('--eval-images', help='Directory of images for the report, default the calibration images')
+    parser.add_argument('--max-images', type=int, default=200, help='Most images used from each directory, 0 = all')
+    parser.add_argument('--mode', choices=['static', 'dynamic'], default='static')
+    parser.add_argument('--calibrate-method', choices=sorted(CALIBRATION_METHODS), default='minmax')
+    parser.add_argument('--per-channel', action='store_true', help='Quantize weights per output channel')
+    parser.add_argument('--det-size', type=int, default=int(os.getenv('FACE_DET_SIZE_GROUP', 640)),
+                        help='Detector input size to calibrate and measure at')
+    parser.add_argument('--max-image-size', type=int, default=int(os.getenv('MAX_IMAGE_SIZE', 1024)))
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('FACE_RECOGNITION_BATCH_SIZE', 32)))
+    parser.add_argument('--threads', type=int, default=int(os.getenv('FACE_CPU_THREADS', 0)),
+                        help='Inference threads, 0 = all cores like a single worker')
+    parser.add_argument('--runs', type=int, default=3, help='Timed passes over the evaluation images')
+    parser.add_argument('--threshold', type=float, default=float(os.getenv('MATCH_THRESHOLD', 0.60)))
+    parser.add_argument('--database', action='store_true', help='Match against the enrolled students')
+    parser.add_argument('--config', default=os.getenv('FLASK_ENV', 'dev'), help='App config for --database')
+    parser.add_argument('--report-only', action='store_true', help='Compare the existing INT8 models without quantizing')
+    parser.add_argument('--report', help='Report file, default quantization_report.json in the INT8 model directory')
+    args = parser.parse_args()
+
+    source_dir = os.path.join(os.path.expanduser(args.model_root), 'models', args.detector)
+    target_dir = source_dir + QUANTIZED_PACK_SUFFIX
+    if not glob.glob(os.path.join(source_dir, '*.onnx')):
+        sys.exit(f"No models found in {source_dir}")
+
+    runtime = runtime_settings({'FACE_CPU_THREADS': args.threads})
+    limit_library_threads(runtime['thread_budget'])
+    det_size = (-(-args.det_size // 32) * 32,) * 2
+    images = load_images(args.images, args.max_image_size, args.max_images)
+    if not images:
+        sys.exit(f"No images found in {args.images}")
+    eval_images = load_images(args.eval_images, args.max_image_size, args.max_images) if args.eval_images else images
+    print(f"{len(images)} calibration images, {len(eval_images)} evaluation images, detector input {det_size[0]}")
+
+    notes = None
+    if not args.report_only:
+        samples = {}
+        if args.mode == 'static':
+            detector, recognizer = load_pack(args, args.detector, session_options(runtime))
+            samples = calibration_samples(detector, recognizer, images, det_size, args.batch_size)
+        notes = quantize_pack(args, source_dir, target_dir, samples)
+    elif not glob.glob(os.path.join(target_dir, '*.onnx')):
+        sys.exit(f"No INT8 models found in {target_dir}")
+
+    packs = {
+        'float32': load_pack(args, args.detector, session_options(runtime)),
+        'int8': load_pack(args, args.detector + QUANTIZED_PACK_SUFFIX, session_options(runtime)),
+    }
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'source': source_dir,
+        'target': target_dir,
+        'mode': args.mode if notes is not None else None,
+        'per_channel': args.per_channel,
+        'models': notes,
+        'calibration_images': len(images),
+        'evaluation_images': len(eval_images),
+        'det_size': det_size[0],
+        'intra_op_threads': runtime['intra_op_threads'],
+        'detection': compare_detection(packs, eval_images, det_size, args.runs),
+    }
+    if packs['float32'][1] is not None and packs['int8'][1] is not None:
+        gallery_rows = database_rows(args.config) if args.database else None
+        report['recognition'] = compare_recognition(packs, eval_images, det_size, args.batch_size, args.runs,
+                                                    gallery_rows, args.threshold)
+    else:
+        report['recognition'] = {'error': 'No recognition model in the pack'}
+
+    print_report(report)
+    report_path = args.report or os.path.join(target_dir, 'quantization_report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {report_path}")
+
+
+if __name__ == '__main__':
+    main()
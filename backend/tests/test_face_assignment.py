@@ -0,0 +1,44 @@
+import unittest
+import numpy as np
+from app.services.face_assignment import assign_faces
+
+class FaceAssignmentTestCase(unittest.TestCase):
+    def setUp(self):
+        inf = np.inf
+        # Face 0 prefers student 0 but also matches student 1; face 1 only matches student 0
+        self.scores = np.array([
+            [0.90, 0.85, -inf],
+            [0.88, -inf, -inf],
+            [-inf, -inf, 0.70],
+            [0.65, -inf, -inf]
+        ])
+
+    def test_greedy(self):
+        assignment = assign_faces(self.scores, 'greedy')
+        self.assertEqual(list(assignment), [0, -1, 2, -1])
+
+    def test_hungarian(self):
+        # Maximizing the total score moves face 0 to its second choice
+        assignment = assign_faces(self.scores, 'hungarian')
+        self.assertEqual(list(assignment), [1, 0, 2, -1])
+        self.assertEqual(list(assign_faces(self.scores, 'auto')), [1, 0, 2, -1])
+
+    def test_each_student_once(self):
+        rng = np.random.default_rng(0)
+        scores = rng.random((30, 12))
+        scores[scores < 0.5] = -np.inf
+        for method in ('greedy', 'hungarian'):
+            assignment = assign_faces(scores, method)
+            assigned = assignment[assignment >= 0]
+            self.assertEqual(len(assigned), len(set(assigned)))
+            self.assertTrue(np.isfinite(scores[np.flatnonzero(assignment >= 0), assigned]).all())
+
+    def test_no_valid_pairs(self):
+        scores = np.full((3, 2), -np.inf)
+        self.assertEqual(list(assign_faces(scores)), [-1, -1, -1])
+        self.assertEqual(list(assign_faces(np.empty((2, 0)))), [-1, -1])
+        with self.assertRaises(ValueError):
+            assign_faces(self.scores, 'random')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import numpy as np
+from insightface.app.common import Face
+from insightface.utils import face_align
+from app.services.face_embedding import embed_faces, recognizer_batch_limit
+
+class FakeRecognizer:
+    """Embeds a crop as its mean color, recording the size of every batch"""
+    input_size = (112, 112)
+    
+    def __init__(self, batch_dim='None'):
+        self.input_shape = [batch_dim, 3, 112, 112]
+        self.batches = []
+    
+    def get_feat(self, imgs):
+        self.batches.append(len(imgs))
+        return np.stack([img.reshape(-1, 3).mean(axis=0) for img in imgs])
+
+class FaceEmbeddingTestCase(unittest.TestCase):
+    def make_faces(self, count):
+        img = np.zeros((112, 112 * count, 3), dtype=np.uint8)
+        faces = []
+        for i in range(count):
+            img[:, i * 112:(i + 1) * 112] = i
+            faces.append(Face(bbox=np.array([i * 112, 0, (i + 1) * 112, 112]), kps=face_align.arcface_dst + [i * 112, 0]))
+        return img, faces
+    
+    def test_batches_are_chunked(self):
+        img, faces = self.make_faces(5)
+        recognizer = FakeRecognizer()
+        embed_faces(recognizer, img, faces, max_batch=2)
+        self.assertEqual(recognizer.batches, [2, 2, 1])
+        # Each face gets the embedding of its own crop
+        for i, face in enumerate(faces):
+            np.testing.assert_allclose(face.embedding, [i, i, i], atol=1e-3)
+    
+    def test_faces_without_landmarks_are_skipped(self):
+        img, faces = self.make_faces(2)
+        faces[0].kps = None
+        recognizer = FakeRecognizer()
+        embed_faces(recognizer, img, faces)
+        self.assertEqual(recognizer.batches, [1])
+        self.assertIsNone(faces[0].embedding)
+        self.assertIsNotNone(faces[1].embedding)
+    
+    def test_fixed_batch_models(self):
+        self.assertEqual(recognizer_batch_limit(FakeRecognizer(1), 32), 1)
+        self.assertEqual(recognizer_batch_limit(FakeRecognizer('None'), 32), 32)
+        self.assertEqual(recognizer_batch_limit(FakeRecognizer(None), 0), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import cv2
+import numpy as np
+from insightface.app.common import Face
+from insightface.utils import face_align
+from app.services.face_quality import QualityGate, blur_score, estimate_pose
+
+def make_face(x, y, scale=1.0, kps=None):
+    kps = face_align.arcface_dst * scale + [x, y] if kps is None else kps
+    return Face(bbox=np.array([x, y, x + 112 * scale, y + 112 * scale], dtype=np.float32), kps=kps)
+
+class FaceQualityTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.img = rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)
+    
+    def test_pose(self):
+        yaw, pitch = estimate_pose(face_align.arcface_dst)
+        self.assertLess(abs(yaw), 5)
+        self.assertLess(abs(pitch), 5)
+        # Nose next to the right eye: face turned far to one side
+        turned = face_align.arcface_dst.copy()
+        turned[2, 0] = turned[1, 0] - 2
+        self.assertGreater(abs(estimate_pose(turned)[0]), 55)
+    
+    def test_blur(self):
+        bbox = [0, 0, 200, 200]
+        blurred = cv2.GaussianBlur(self.img, (31, 31), 10)
+        self.assertGreater(blur_score(self.img, bbox), 10 * blur_score(blurred, bbox))
+    
+    def test_filter_reports_reasons(self):
+        gate = QualityGate(min_face_size=40, min_eye_distance=10, max_yaw=55, min_blur=10, max_faces=3)
+        turned = face_align.arcface_dst + [300, 0]
+        turned[2, 0] = turned[1, 0] - 2
+        faces = [
+            make_face(0, 0),                   # good
+            make_face(150, 0, scale=0.25),     # smallest of four, over max_faces
+            make_face(300, 0, kps=turned),     # extreme profile
+            make_face(450, 0, scale=0.5),      # good
+        ]
+        accepted, rejected = gate.filter(self.img, faces)
+        self.assertEqual(accepted, [0, 3])
+        self.assertEqual({i: reason for i, (reason, _) in rejected.items()}, {1: "max_faces", 2: "pose"})
+        self.assertEqual(gate.assess(self.img, faces[1])[0], "too_small")
+        
+        img = cv2.GaussianBlur(self.img, (31, 31), 10)
+        accepted, rejected = gate.filter(img, faces[:1])
+        self.assertEqual(rejected[0][0], "blurred")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,19 @@
 import unittest
 import os
+import tempfile
+import pickle
+import warnings
+from unittest.mock import patch
 import cv2
 import numpy as np
+from sqlalchemy.exc import LegacyAPIWarning
 from app import create_app, db
 from app.models.student import Student
+from app.models.group import Group
 from app.services.face_service import FaceService
+from app.services.gallery_index import GalleryIndex
+from app.services.gallery_store import GalleryStore
+from insightface.app.common import Face
 
 class FaceServiceTestCase(unittest.TestCase):
     def setUp(self):
@@ -15,6 +24,8 @@ class FaceServiceTestCase(unittest.TestCase):
         self.client = self.app.test_client()
         self.face_service = FaceService()
         self.face_service.initialize()
+        # The service is a singleton; start every test from an empty gallery
+        self.face_service.gallery = GalleryIndex()
         
     def tearDown(self):
         db.session.remove()
@@ -37,6 +48,125 @@ class FaceServiceTestCase(unittest.TestCase):
         # Check embedding dimensions
         self.assertEqual(embedding.shape[0], 512)
     
+    def test_tile_workers_stay_within_thread_budget(self):
+        runtime = self.face_service.runtime
+        try:
+            self.face_service.runtime = {"thread_budget": 8, "tile_workers": 4, "tile_intra_op_threads": 2}
+            self.assertEqual(self.face_service._tile_workers(), 4)
+            self.face_service.runtime = {"inference_socket": "/tmp/face.sock", "inference_processes": 2}
+            self.assertEqual(self.face_service._tile_workers(), 2)
+        finally:
+            self.face_service.runtime = runtime
+    
+    def test_tile_session_uses_share_of_thread_budget(self):
+        service = self.face_service
+        state = (service.initialized, service.model, service.runtime, service._tile_session)
+        self.app.config['FACE_CPU_THREADS'] = 8
+        try:
+            service.initialized = False
+            if not service.initialize():
+                self.skipTest("Face model not available")
+            # Four tiles with two threads each instead of one tile with eight
+            self.assertEqual(service._tile_workers(), 4)
+            self.assertEqual(service.model.det_model.session.get_session_options().intra_op_num_threads, 8)
+            self.assertEqual(service._tile_detector().session.get_session_options().intra_op_num_threads, 2)
+            
+            # Without tiling profiles no second session is loaded
+            service.initialized = False
+            self.app.config['FACE_DETECTION_PROFILES'] = {'group': {'det_size': 640}}
+            service.initialize()
+            self.assertIs(service._tile_detector(), service.model.det_model)
+        finally:
+            service.initialized, service.model, service.runtime, service._tile_session = state
+    
+    def test_allowed_modules(self):
+        self.assertEqual(FaceService._allowed_modules(), ["detection", "recognition"])
+        self.app.config['FACE_ALLOWED_MODULES'] = 'all'
+        self.assertIsNone(FaceService._allowed_modules())
+        self.app.config['FACE_ALLOWED_MODULES'] = ' detection , landmark_2d_106 '
+        self.assertEqual(FaceService._allowed_modules(), ["detection", "landmark_2d_106"])
+        
+        # Landmark and gender/age models are not loaded by default
+        if self.face_service.initialized:
+            self.assertIn("detection", self.face_service.active_modules())
+            self.assertTrue(set(self.face_service.active_modules()) <= {"detection", "recognition"})
+    
+    def test_warm_up(self):
+        if not self.face_service.initialized:
+            self.skipTest("Face model not available")
+        self.app.config['FACE_WARMUP'] = True
+        self.face_service.warmup = {"ready": False}
+        self.assertFalse(self.face_service.is_ready())
+        self.assertEqual(self.client.get('/api/v1/ready').status_code, 503)
+        
+        self.assertTrue(self.face_service.warm_up())
+        self.assertTrue(self.face_service.is_ready())
+        self.assertEqual(set(self.face_service.warmup["profiles"]), set(self.app.config['FACE_DETECTION_PROFILES']))
+        response = self.client.get('/api/v1/ready')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()["ready"])
+    
+    def test_repeated_image_uses_result_cache(self):
+        if not self.face_service.initialized:
+            self.skipTest("Face model not available")
+        self.face_service.result_cache = None
+        image_data = cv2.imencode('.jpg', np.full((240, 320, 3), 128, dtype=np.uint8))[1].tobytes()
+        
+        first = self.face_service.process_image_for_attendance(image_data, profile='group')
+        self.assertNotIn("cache_hit", first)
+        # A repeat submission is neither decoded nor detected again
+        with patch.object(FaceService, '_load_image', side_effect=AssertionError("decoded again")):
+            second = self.face_service.process_image_for_attendance(image_data, profile='group')
+        self.assertTrue(second["cache_hit"])
+        self.assertEqual(second["recognized"], first["recognized"])
+        self.assertEqual(self.face_service.result_cache.stats()["hits"], 1)
+        
+        # Results computed under other detection or quality settings are not reused
+        self.app.config['FACE_QUALITY_MIN_FACE_SIZE'] = 40
+        self.assertNotIn("cache_hit", self.face_service.process_image_for_attendance(image_data, profile='group'))
+        self.app.config['FACE_DETECTION_PROFILES'] = dict(self.app.config['FACE_DETECTION_PROFILES'],
+                                                          group={'det_size': 320})
+        self.assertNotIn("cache_hit", self.face_service.process_image_for_attendance(image_data, profile='group'))
+        self.assertTrue(self.face_service.process_image_for_attendance(image_data, profile='group')["cache_hit"])
+        
+        # The cache can be turned off
+        self.app.config['FACE_RESULT_CACHE_MB'] = 0
+        self.assertIsNone(self.face_service._cached_results())
+    
+    def test_result_cache_entry(self):
+        faces = [
+            Face(bbox=np.array([0, 0, 50, 60], dtype=np.float32), kps=np.zeros((5, 2), dtype=np.float32),
+                 det_score=np.float32(0.9), embedding=np.ones(512, dtype=np.float32)),
+            Face(bbox=np.array([100, 0, 110, 8], dtype=np.float32), kps=None, det_score=np.float32(0.6))
+        ]
+        thumbnail = np.zeros((64, 64), dtype=np.int16)
+        entry, nbytes = FaceService._cache_entry(faces, {1: ("too_small", {"face_size": 8.0})}, thumbnail)
+        self.assertGreater(nbytes, 512 * 4 + thumbnail.nbytes)
+        
+        restored, rejected, cached_thumbnail = FaceService._faces_from_cache(entry)
+        self.assertEqual(rejected, {1: ("too_small", {"face_size": 8.0})})
+        self.assertIs(cached_thumbnail, thumbnail)
+        np.testing.assert_array_equal(restored[0].embedding, faces[0].embedding)
+        np.testing.assert_array_equal(restored[1].bbox, faces[1].bbox)
+        self.assertIsNone(restored[1].embedding)
+        self.assertAlmostEqual(restored[0].det_score, 0.9, places=5)
+        # Cached arrays are shared between hits and cannot be changed by one of them
+        self.assertFalse(restored[0].embedding.flags.writeable)
+        # The caller's faces are copied, not frozen
+        faces[0].embedding[0] = 2.0
+        self.assertEqual(restored[0].embedding[0], 1.0)
+    
+    def test_detection_profiles(self):
+        self.assertEqual(FaceService._detection_size('live'), (320, 320))
+        self.assertEqual(FaceService._detection_size('group'), (640, 640))
+        self.app.config['FACE_DETECTION_PROFILES'] = {'group': {'det_size': (1000, 700)}}
+        self.assertEqual(FaceService._detection_size('group'), (1024, 704))
+        self.assertEqual(FaceService._detection_size('missing'), (640, 640))
+        
+        if self.face_service.initialized:
+            blank = np.zeros((480, 640, 3), dtype=np.uint8)
+            self.assertEqual(self.face_service._detect_faces(blank, 'group'), [])
+    
     def test_match_face(self):
         # Create a test student with known embedding
         embedding = np.random.rand(512).astype(np.float32)
@@ -46,7 +176,9 @@ class FaceServiceTestCase(unittest.TestCase):
         db.session.commit()
         
         # Test with exact same embedding (should match perfectly)
-        matched_student, score = self.face_service.match_face(embedding)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', LegacyAPIWarning)
+            matched_student, score = self.face_service.match_face(embedding)
         self.assertIsNotNone(matched_student)
         self.assertEqual(matched_student.student_id, "test123")
         self.assertAlmostEqual(score, 1.0, places=5)
@@ -55,6 +187,263 @@ class FaceServiceTestCase(unittest.TestCase):
         different_embedding = np.random.rand(512).astype(np.float32)
         matched_student, score = self.face_service.match_face(different_embedding, threshold=0.99)
         self.assertIsNone(matched_student)
+    
+    def test_match_faces(self):
+        embeddings = np.random.rand(3, 512).astype(np.float32)
+        for i, embedding in enumerate(embeddings):
+            student = Student(student_id=f"batch{i}", name=f"Batch Student {i}")
+            student.set_embedding(embedding)
+            db.session.add(student)
+        db.session.commit()
+        
+        # One result per face, in input order, including an unmatched face
+        stranger = -embeddings[0]
+        matches = self.face_service.match_faces(np.vstack([embeddings[2], stranger, embeddings[0]]))
+        self.assertEqual(len(matches), 3)
+        self.assertEqual(matches[0][:2], ("batch2", "Batch Student 2"))
+        self.assertEqual(matches[1][:2], (None, None))
+        self.assertEqual(matches[2][0], "batch0")
+        self.assertAlmostEqual(matches[2][2], 1.0, places=5)
+    
+    def test_match_faces_group_scope(self):
+        group_a = Group(name="Class A")
+        group_b = Group(name="Class B")
+        db.session.add_all([group_a, group_b])
+        db.session.commit()
+        
+        embedding_a = np.random.rand(512).astype(np.float32)
+        embedding_b = np.random.rand(512).astype(np.float32)
+        for student_id, group, embedding in (("a1", group_a, embedding_a), ("b1", group_b, embedding_b)):
+            student = Student(student_id=student_id, name=student_id, group_id=group.id)
+            student.set_embedding(embedding)
+            db.session.add(student)
+        db.session.commit()
+        
+        matches = self.face_service.match_faces(np.vstack([embedding_a, embedding_b]), threshold=0.99)
+        self.assertEqual([match[0] for match in matches], ["a1", "b1"])
+        
+        # A face from another class is not matched when recognition is scoped
+        matches = self.face_service.match_faces(
+            np.vstack([embedding_a, embedding_b]), threshold=0.99, group_ids=[group_a.id]
+        )
+        self.assertEqual([match[0] for match in matches], ["a1", None])
+    
+    def test_one_student_per_face(self):
+        embedding = np.random.rand(512).astype(np.float32)
+        student = Student(student_id="solo1", name="Solo Student")
+        student.set_embedding(embedding)
+        db.session.add(student)
+        db.session.commit()
+        
+        # Two faces of the same student in a frame: only the closer one is matched
+        close = embedding + 0.01 * np.random.rand(512).astype(np.float32)
+        matches = self.face_service.match_faces(np.vstack([close, embedding]))
+        self.assertEqual([match[0] for match in matches], [None, "solo1"])
+        self.assertGreaterEqual(matches[0][2], 0.99)
+        
+        # Without assignment both faces are matched
+        self.app.config['FACE_ASSIGNMENT'] = 'none'
+        matches = self.face_service.match_faces(np.vstack([close, embedding]))
+        self.assertEqual([match[0] for match in matches], ["solo1", "solo1"])
+    
+    def test_match_margin(self):
+        base = np.random.rand(512).astype(np.float32)
+        twin = base + 0.01 * np.random.rand(512).astype(np.float32)
+        for student_id, embedding in (("twin1", base), ("twin2", twin)):
+            student = Student(student_id=student_id, name=student_id)
+            student.set_embedding(embedding)
+            db.session.add(student)
+        db.session.commit()
+        
+        matches, margin = self.face_service.match_face_topk(base, k=5)
+        self.assertEqual([student_id for student_id, _ in matches], ["twin1", "twin2"])
+        self.assertAlmostEqual(margin, matches[0][1] - matches[1][1], places=6)
+        self.assertLess(margin, 0.01)
+        
+        # Without a margin the best twin is accepted, with one it is ambiguous
+        self.assertEqual(self.face_service.match_faces(base[np.newaxis, :])[0][0], "twin1")
+        student_id, _, score, match_margin = self.face_service.match_faces(base[np.newaxis, :], margin=0.05)[0]
+        self.assertIsNone(student_id)
+        self.assertGreater(score, 0.99)
+        self.assertAlmostEqual(match_margin, margin, places=6)
+    
+    def test_rebuild_gallery(self):
+        for i in range(3):
+            student = Student(student_id=f"gal{i}", name=f"Gallery Student {i}")
+            student.set_embedding(np.random.rand(512).astype(np.float32))
+            db.session.add(student)
+        db.session.add(Student(student_id="noface", name="No Face"))
+        db.session.commit()
+        
+        # Only students with an embedding are loaded into the gallery
+        self.assertEqual(self.face_service.rebuild_gallery(), 3)
+        self.assertEqual(sorted(self.face_service.gallery.student_ids), ["gal0", "gal1", "gal2"])
+        
+        # New enrollments are picked up on refresh
+        student = Student(student_id="gal3", name="Gallery Student 3")
+        student.set_embedding(np.random.rand(512).astype(np.float32))
+        db.session.add(student)
+        db.session.commit()
+        self.assertEqual(self.face_service.refresh_gallery(), 4)
+        
+    def test_gallery_follows_student_writes(self):
+        group = Group(name="Hooks")
+        db.session.add(group)
+        db.session.commit()
+        self.face_service.rebuild_gallery()
+        built_at = self.face_service.gallery.built_at
+        
+        # Enrollment is applied on commit, without a rebuild
+        embedding = np.random.rand(512).astype(np.float32)
+        student = Student(student_id="hook1", name="Hook Student")
+        student.set_embedding(embedding)
+        db.session.add(student)
+        db.session.commit()
+        self.assertEqual(self.face_service.gallery.size, 1)
+        matches = self.face_service.match_faces(embedding[np.newaxis, :])
+        self.assertEqual(matches[0][0], "hook1")
+        self.assertEqual(self.face_service.gallery.built_at, built_at)
+        
+        # Updates move the student between group partitions
+        student.group_id = group.id
+        db.session.commit()
+        matches = self.face_service.match_faces(embedding[np.newaxis, :], group_ids=[group.id])
+        self.assertEqual(matches[0][0], "hook1")
+        
+        # Rolled back writes never reach the gallery
+        other = Student(student_id="hook2", name="Rolled Back")
+        other.set_embedding(np.random.rand(512).astype(np.float32))
+        db.session.add(other)
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(self.face_service.gallery.size, 1)
+        
+        # Deletes remove the student
+        db.session.delete(Student.query.get("hook1"))
+        db.session.commit()
+        self.assertEqual(self.face_service.gallery.size, 0)
+        self.assertEqual(self.face_service.gallery.built_at, built_at)
+    
+    def test_gallery_sees_updates_from_other_workers(self):
+        rng = np.random.default_rng(5)
+        first, second = Group(name="First"), Group(name="Second")
+        db.session.add_all([first, second])
+        db.session.flush()
+        old_embedding, new_embedding = rng.standard_normal((2, 512)).astype(np.float32)
+        student = Student(student_id="moved1", name="Moved Student", group_id=first.id)
+        student.set_embedding(old_embedding)
+        db.session.add(student)
+        db.session.commit()
+        self.face_service.rebuild_gallery()
+        self.assertEqual(self.face_service.match_faces(old_embedding[np.newaxis, :], group_ids=[first.id])[0][0], "moved1")
+        
+        # Another worker re-enrolls the student into another group; this process's hooks never see it
+        db.session.execute(
+            Student.__table__.update().where(Student.__table__.c.student_id == "moved1")
+            .values(group_id=second.id, embedding=Student.encode_embedding(GalleryIndex.normalize(new_embedding)))
+        )
+        db.session.commit()
+        self.assertEqual(self.face_service.match_faces(new_embedding[np.newaxis, :], group_ids=[second.id])[0][0], "moved1")
+        self.assertIsNone(self.face_service.match_faces(new_embedding[np.newaxis, :], group_ids=[first.id])[0][0])
+        self.assertIsNone(self.face_service.match_faces(old_embedding[np.newaxis, :])[0][0])
+    
+    def test_local_writes_do_not_hide_other_workers(self):
+        rng = np.random.default_rng(6)
+        a, b, x = rng.standard_normal((3, 512)).astype(np.float32)
+        student = Student(student_id="a", name="Student A")
+        student.set_embedding(a)
+        db.session.add(student)
+        db.session.commit()
+        self.face_service.rebuild_gallery()
+        
+        # Another worker enrolls x, then this worker enrolls b within the same refresh interval
+        db.session.execute(Student.__table__.insert().values(
+            student_id="x", name="Student X", embedding=Student.encode_embedding(GalleryIndex.normalize(x))
+        ))
+        db.session.commit()
+        student = Student(student_id="b", name="Student B")
+        student.set_embedding(b)
+        db.session.add(student)
+        db.session.commit()
+        
+        self.assertEqual(self.face_service.match_faces(x[np.newaxis, :])[0][0], "x")
+        self.assertEqual(sorted(self.face_service.gallery.student_ids), ["a", "b", "x"])
         
+        # Writes of this process alone keep the gallery without a rebuild
+        built_at = self.face_service.gallery.built_at
+        student = Student(student_id="c", name="Student C")
+        student.set_embedding(rng.standard_normal(512).astype(np.float32))
+        db.session.add(student)
+        db.session.commit()
+        db.session.delete(Student.query.get("a"))
+        db.session.commit()
+        self.assertEqual(self.face_service.refresh_gallery(), 3)
+        self.assertEqual(self.face_service.gallery.built_at, built_at)
+        self.assertEqual(self.face_service._local_writes, {})
+    
+    def test_embedding_storage_format(self):
+        embedding = np.random.rand(512).astype(np.float32)
+        student = Student(student_id="raw1", name="Raw Student")
+        student.set_embedding(embedding)
+        self.assertEqual(Student.embedding_format(student.embedding), "float32-v1")
+        self.assertEqual(len(student.embedding), 8 + 512 * 4)
+        
+        # Decoding is a view of the stored bytes
+        decoded = student.get_embedding()
+        self.assertEqual(decoded.dtype, np.float32)
+        self.assertFalse(decoded.flags.owndata)
+        np.testing.assert_allclose(decoded, embedding / np.linalg.norm(embedding), rtol=1e-6)
+        
+        # Rows pickled by older versions still decode and match
+        legacy = Student(student_id="legacy1", name="Legacy Student", embedding=pickle.dumps(embedding))
+        db.session.add_all([student, legacy])
+        db.session.commit()
+        self.assertEqual(Student.embedding_format(legacy.embedding), "pickle")
+        np.testing.assert_array_equal(legacy.get_embedding(), embedding)
+        self.assertIn(self.face_service.match_faces(embedding[np.newaxis, :])[0][0], ("raw1", "legacy1"))
+        self.assertEqual(len(legacy.to_dict(with_embedding=True)["embedding"]), 512)
+        
+        # Pickles of anything other than numpy arrays are refused
+        with self.assertRaises(pickle.UnpicklingError):
+            Student.decode_embedding(pickle.dumps(os.getcwd))
+    
+    def test_shared_gallery_store(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.app.config['FACE_GALLERY_STORE_PATH'] = os.path.join(tmpdir.name, 'gallery.bin')
+        self.app.config['FACE_GALLERY_PUBLISH_DELAY'] = 0.2
+        
+        for i in range(3):
+            student = Student(student_id=f"shared{i}", name=f"Shared Student {i}")
+            student.set_embedding(np.random.rand(512).astype(np.float32))
+            db.session.add(student)
+        db.session.commit()
+        
+        # A rebuild publishes the gallery and maps it back read-only
+        self.assertEqual(self.face_service.rebuild_gallery(), 3)
+        store = GalleryStore(self.app.config['FACE_GALLERY_STORE_PATH'])
+        data = store.load()
+        self.assertEqual(sorted(data.student_ids), ["shared0", "shared1", "shared2"])
+        self.assertFalse(self.face_service.gallery.matrix.flags.writeable)
+        
+        # A fresh worker maps the published file instead of querying every embedding
+        self.face_service.gallery = GalleryIndex()
+        self.assertEqual(self.face_service.refresh_gallery(), 3)
+        self.assertFalse(self.face_service.gallery.matrix.flags.writeable)
+        
+        # Committed writes are applied locally, then published for other workers
+        embedding = np.random.rand(512).astype(np.float32)
+        student = Student(student_id="shared3", name="Shared Student 3")
+        student.set_embedding(embedding)
+        db.session.add(student)
+        db.session.commit()
+        publish_timer = self.face_service._publish_timer
+        self.assertEqual(self.face_service.match_faces(embedding[np.newaxis, :])[0][0], "shared3")
+        publish_timer.join()
+        data = store.load()
+        self.assertEqual(data.generation, 2)
+        self.assertIn("shared3", data.student_ids)
+        self.assertEqual(self.face_service._unpublished, {})
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
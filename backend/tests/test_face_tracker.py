@@ -0,0 +1,73 @@
+import time
+import unittest
+import numpy as np
+from app.services.face_tracker import FaceTracker, SessionRegistry, bbox_iou
+
+class FaceTrackerTestCase(unittest.TestCase):
+    def test_bbox_iou(self):
+        iou = bbox_iou([[0, 0, 10, 10], [20, 20, 30, 30]], [[5, 0, 15, 10]])
+        np.testing.assert_allclose(iou, [[1 / 3], [0.0]], rtol=1e-6)
+    
+    def test_recognition_only_for_new_and_due_tracks(self):
+        tracker = FaceTracker(verify_every=3, max_missed=1)
+        tracks, needs = tracker.update([[0, 0, 100, 100], [200, 0, 300, 100]])
+        self.assertEqual(needs, [True, True])
+        tracks[0].confirm("s1", "Student 1", 0.8, 0.3)
+        tracks[1].confirm(None, None, 0.2, 0.1)
+        
+        # Slightly moved faces keep their tracks and identities; unknown ones are recognized again
+        moved, needs = tracker.update([[205, 2, 305, 102], [3, 1, 103, 101]])
+        self.assertEqual(needs, [True, False])
+        self.assertIs(moved[0], tracks[1])
+        self.assertEqual(moved[1].student_id, "s1")
+        
+        # An unknown face recognized on a later frame keeps that identity
+        moved[0].confirm("s2", "Student 2", 0.7, 0.2)
+        _, needs = tracker.update([[3, 1, 103, 101], [205, 2, 305, 102], [400, 0, 500, 100]])
+        self.assertEqual(needs, [False, False, True])
+        
+        # Verified tracks are re-checked every 3 frames
+        _, needs = tracker.update([[3, 1, 103, 101], [205, 2, 305, 102]])
+        self.assertEqual(needs, [True, False])
+    
+    def test_unknown_tracks_verify_interval(self):
+        tracker = FaceTracker(verify_every=10, verify_unknown_every=2)
+        tracks, _ = tracker.update([[0, 0, 100, 100]])
+        tracks[0].confirm(None, None, 0.2, 0.1)
+        _, needs = tracker.update([[0, 0, 100, 100]])
+        self.assertEqual(needs, [False])
+        _, needs = tracker.update([[0, 0, 100, 100]])
+        self.assertEqual(needs, [True])
+    
+    def test_lost_tracks_expire(self):
+        tracker = FaceTracker(max_missed=1)
+        tracks, _ = tracker.update([[0, 0, 100, 100]])
+        tracks[0].confirm("s1", "Student 1", 0.8, 0.3)
+        tracker.update([])
+        again, needs = tracker.update([[0, 0, 100, 100]])
+        self.assertEqual(needs, [False])
+        tracker.update([])
+        tracker.update([])
+        self.assertEqual(tracker.tracks, [])
+        again, needs = tracker.update([[0, 0, 100, 100]])
+        self.assertEqual(needs, [True])
+    
+    def test_registry(self):
+        registry = SessionRegistry(ttl=60, max_sessions=2)
+        first = registry.get("cam1", verify_every=5)
+        self.assertIs(registry.get("cam1"), first)
+        self.assertEqual(first.verify_every, 5)
+        registry.get("cam2")
+        registry.get("cam3")
+        self.assertEqual(len(registry), 2)
+        self.assertIsNot(registry.get("cam1"), first)
+        
+        # Sessions idle for longer than the TTL start over
+        registry.ttl = 0.01
+        tracker = registry.get("cam1")
+        time.sleep(0.02)
+        self.assertIsNot(registry.get("cam1"), tracker)
+        self.assertEqual(len(registry), 1)
+
+if __name__ == '__main__':
+    unittest.main()
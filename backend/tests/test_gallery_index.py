@@ -0,0 +1,440 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import numpy as np
+from app.services.gallery_index import GalleryIndex
+from app.services.gallery_store import GalleryStore
+from app.services.ivf_index import IVFIndex
+from app.services.quantized_index import QuantizedIndex
+
+class GalleryIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(42)
+        self.embeddings = self.rng.standard_normal((20, 512)).astype(np.float32)
+        self.gallery = GalleryIndex()
+        # Students s0-s9 are in group 1, s10-s14 in group 2 and the rest have no group
+        self.groups = [1] * 10 + [2] * 5 + [None] * 5
+        self.gallery.build(
+            (f"s{i}", f"Student {i}", self.groups[i], embedding) for i, embedding in enumerate(self.embeddings)
+        )
+
+    def test_build(self):
+        self.assertEqual(self.gallery.size, 20)
+        self.assertTrue(self.gallery.matrix.flags['C_CONTIGUOUS'])
+        self.assertEqual(self.gallery.matrix.dtype, np.float32)
+        norms = np.linalg.norm(self.gallery.matrix, axis=1)
+        np.testing.assert_allclose(norms, 1.0, rtol=1e-5)
+
+    def test_search_matches_loop(self):
+        query = self.embeddings[7] + 0.1 * self.rng.standard_normal(512).astype(np.float32)
+        student_id, name, score = self.gallery.search(query)
+
+        # Same result as scoring every student one at a time
+        normalized = query / np.linalg.norm(query)
+        expected = [np.dot(normalized, e / np.linalg.norm(e)) for e in self.embeddings]
+        self.assertEqual(student_id, "s7")
+        self.assertEqual(name, "Student 7")
+        self.assertAlmostEqual(score, max(expected), places=5)
+
+    def test_search_batch(self):
+        order = [3, 0, 19, 3, 11]
+        queries = self.embeddings[order] + 0.05 * self.rng.standard_normal((5, 512)).astype(np.float32)
+        student_ids, names, scores = self.gallery.search_batch(queries)
+
+        self.assertEqual(list(student_ids), [f"s{i}" for i in order])
+        for query, student_id, score in zip(queries, student_ids, scores):
+            self.assertEqual(self.gallery.search(query)[0], student_id)
+            self.assertAlmostEqual(self.gallery.search(query)[2], float(score), places=5)
+
+    def test_search_topk(self):
+        queries = self.embeddings[[4, 12]] + 0.05 * self.rng.standard_normal((2, 512)).astype(np.float32)
+        student_ids, names, scores = self.gallery.search_topk(queries, k=3)
+
+        normalized = self.gallery.normalize(queries)
+        expected = normalized @ self.gallery.normalize(self.embeddings).T
+        for i in range(2):
+            order = np.argsort(-expected[i])[:3]
+            self.assertEqual(student_ids[i], [f"s{j}" for j in order])
+            self.assertEqual(names[i][0], f"Student {order[0]}")
+            np.testing.assert_allclose(scores[i], expected[i][order], rtol=1e-5)
+        self.assertEqual(student_ids[0][0], self.gallery.search(queries[0])[0])
+
+        # Group scope and k larger than the partition
+        student_ids, _, scores = self.gallery.search_topk(queries, k=10, group_ids=[2])
+        self.assertEqual(sorted(student_ids[1]), [f"s{i}" for i in range(10, 15)])
+        self.assertEqual(student_ids[1][0], "s12")
+        self.assertEqual(scores[1], sorted(scores[1], reverse=True))
+
+        student_ids, _, scores = self.gallery.search_topk(queries, k=2, group_ids=[99])
+        self.assertEqual(student_ids, [[], []])
+
+    def test_search_group_scope(self):
+        queries = self.embeddings[[2, 12, 17]]
+
+        # Only group 1 students can be matched, even for faces of other groups
+        student_ids, _, scores = self.gallery.search_batch(queries, group_ids=[1])
+        self.assertEqual(student_ids[0], "s2")
+        self.assertTrue(all(int(sid[1:]) < 10 for sid in student_ids))
+        self.assertLess(scores[1], 0.5)
+
+        # Several groups are searched together
+        student_ids, _, _ = self.gallery.search_batch(queries, group_ids=[2, 1])
+        self.assertEqual(list(student_ids[:2]), ["s2", "s12"])
+        self.assertNotEqual(student_ids[2], "s17")
+
+        # Unknown groups match nothing
+        student_ids, _, scores = self.gallery.search_batch(queries, group_ids=[99])
+        self.assertEqual(list(student_ids), [None, None, None])
+
+    def test_empty_gallery(self):
+        gallery = GalleryIndex()
+        gallery.build([])
+        self.assertEqual(gallery.search(self.embeddings[0]), (None, None, 0.0))
+        student_ids, _, scores = gallery.search_batch(self.embeddings[:3])
+        self.assertEqual(list(student_ids), [None, None, None])
+        self.assertEqual(list(scores), [0.0, 0.0, 0.0])
+
+    def test_skips_invalid_embeddings(self):
+        gallery = GalleryIndex()
+        gallery.build([
+            ("a", "A", 1, None),
+            ("b", "B", 1, np.ones(128, dtype=np.float32)),
+            ("c", "C", 1, self.embeddings[0])
+        ])
+        self.assertEqual(gallery.size, 1)
+        self.assertEqual(list(gallery.student_ids), ["c"])
+
+    def test_incremental_updates(self):
+        new_embedding = self.rng.standard_normal(512).astype(np.float32)
+        self.assertTrue(self.gallery.upsert("new", "New Student", 2, new_embedding))
+        self.assertEqual(self.gallery.size, 21)
+        self.assertEqual(self.gallery.search(new_embedding)[0], "new")
+        self.assertEqual(self.gallery.search(new_embedding, group_ids=[2])[0], "new")
+
+        # Replacing an embedding and moving the student to another group
+        self.gallery.upsert("s3", "Student 3", 2, new_embedding * -1)
+        self.assertEqual(self.gallery.size, 21)
+        self.assertEqual(self.gallery.search(-new_embedding, group_ids=[2])[0], "s3")
+        self.assertNotEqual(self.gallery.search(self.embeddings[3], group_ids=[1])[0], "s3")
+
+        # Removing students keeps every remaining student findable
+        self.assertTrue(self.gallery.remove("s0"))
+        self.assertTrue(self.gallery.remove("s12"))
+        self.assertFalse(self.gallery.remove("s12"))
+        self.assertEqual(self.gallery.size, 19)
+        for i in range(20):
+            if i in (0, 3, 12):
+                continue
+            self.assertEqual(self.gallery.search(self.embeddings[i])[0], f"s{i}")
+            self.assertEqual(self.gallery.search(self.embeddings[i], group_ids=[self.groups[i]])[0], f"s{i}")
+        self.assertNotEqual(self.gallery.search(self.embeddings[0])[0], "s0")
+
+        # An entry without an embedding is removed
+        self.assertTrue(self.gallery.upsert("new", "New Student", 2, None))
+        self.assertEqual(self.gallery.size, 18)
+
+class IVFIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        # Clustered embeddings so the coarse quantizer has structure to learn
+        self.rng = np.random.default_rng(7)
+        centers = self.rng.standard_normal((40, 512)).astype(np.float32)
+        labels = self.rng.integers(0, 40, 4000)
+        self.embeddings = centers[labels] + 0.8 * self.rng.standard_normal((4000, 512)).astype(np.float32)
+        self.gallery = GalleryIndex(backend=IVFIndex(nlist=32, nprobe=6, min_train_size=1000))
+        self.gallery.build((f"s{i}", f"Student {i}", None, e) for i, e in enumerate(self.embeddings))
+
+    def assert_lists_consistent(self, gallery=None):
+        gallery = gallery if gallery is not None else self.gallery
+        backend = gallery.backend
+        rows = sorted(row for cell in backend.lists for row in cell)
+        self.assertEqual(rows, list(range(gallery.size)))
+        for cell, cell_rows in enumerate(backend.lists):
+            for row in cell_rows:
+                self.assertEqual(backend._row_cells[row], cell)
+
+    def test_recall(self):
+        self.assertTrue(self.gallery.backend.is_trained)
+        self.assertEqual(len(self.gallery.backend.lists), 32)
+        recall = self.gallery.measure_recall(sample_size=200)
+        self.assertGreaterEqual(recall, 0.9)
+        self.assertEqual(self.gallery.stats()["recall"], recall)
+
+    def test_small_gallery_uses_exact_search(self):
+        gallery = GalleryIndex(backend=IVFIndex(min_train_size=1000))
+        gallery.build((f"s{i}", None, None, e) for i, e in enumerate(self.embeddings[:100]))
+        self.assertFalse(gallery.backend.is_trained)
+        self.assertIsNone(gallery.measure_recall())
+        self.assertEqual(gallery.search(self.embeddings[42])[0], "s42")
+
+    def test_incremental_updates(self):
+        for i in range(0, 4000, 7):
+            self.gallery.remove(f"s{i}")
+        for i in range(50):
+            self.gallery.upsert(f"new{i}", None, None, self.rng.standard_normal(512).astype(np.float32))
+        self.gallery.upsert("s1", None, None, self.embeddings[2])
+        self.assert_lists_consistent()
+
+        # s1 now holds the same embedding as s2
+        self.assertIn(self.gallery.search(self.embeddings[2])[0], ("s1", "s2"))
+        for i in (3, 100, 3999):
+            self.assertEqual(self.gallery.search(self.embeddings[i])[0], f"s{i}")
+        self.assertNotEqual(self.gallery.search(self.embeddings[7])[0], "s7")
+
+    def test_retrains_when_gallery_doubles(self):
+        gallery = GalleryIndex(backend=IVFIndex(nlist=8, min_train_size=200))
+        gallery.build((f"s{i}", None, None, e) for i, e in enumerate(self.embeddings[:150]))
+        self.assertFalse(gallery.backend.is_trained)
+        for i in range(150, 400):
+            gallery.upsert(f"s{i}", None, None, self.embeddings[i])
+        self.assertTrue(gallery.wait_for_retrain(timeout=30))
+        self.assertTrue(gallery.backend_ready)
+        self.assertEqual(gallery.backend.trained_size, 400)
+        self.assertEqual(sorted(row for cell in gallery.backend.lists for row in cell), list(range(400)))
+
+    def test_retrains_in_background(self):
+        gallery = GalleryIndex(backend=IVFIndex(nlist=8, min_train_size=200))
+        gallery.build((f"s{i}", None, None, e) for i, e in enumerate(self.embeddings[:200]))
+        self.assertTrue(gallery.backend_ready)
+
+        # Hold training until the test has searched the stale gallery
+        release = threading.Event()
+        train = IVFIndex.train
+        def blocked_train(backend, matrix):
+            release.wait(30)
+            return train(backend, matrix)
+
+        with mock.patch.object(IVFIndex, 'train', blocked_train):
+            for i in range(200, 400):
+                gallery.upsert(f"s{i}", None, None, self.embeddings[i])
+            self.assertFalse(gallery.backend_ready)
+            self.assertTrue(gallery.stats()["retraining"])
+            # Searches do not wait for training and fall back to exact scan
+            self.assertEqual(gallery.search(self.embeddings[350])[0], "s350")
+            self.assertIsNone(gallery.measure_recall())
+            # Writes made while training are covered by the new index
+            gallery.remove("s0")
+            release.set()
+            self.assertTrue(gallery.wait_for_retrain(timeout=30))
+
+        self.assertTrue(gallery.backend_ready)
+        self.assertEqual(gallery.backend.trained_size, 399)
+        self.assert_lists_consistent(gallery)
+        self.assertEqual(gallery.search(self.embeddings[350])[0], "s350")
+
+class QuantizedIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(11)
+        self.embeddings = self.rng.standard_normal((2000, 512)).astype(np.float32)
+        self.queries = self.embeddings[:300] + 0.045 * self.rng.standard_normal((300, 512)).astype(np.float32)
+        self.exact = GalleryIndex()
+        self.exact.build((f"s{i}", None, None, e) for i, e in enumerate(self.embeddings))
+
+    def build(self, precision, rerank_k=10):
+        gallery = GalleryIndex(backend=QuantizedIndex(precision, rerank_k=rerank_k))
+        gallery.build((f"s{i}", None, None, e) for i, e in enumerate(self.embeddings))
+        return gallery
+
+    def test_matches_exact_search(self):
+        exact_ids, _, exact_scores = self.exact.search_batch(self.queries)
+        for precision in QuantizedIndex.PRECISIONS:
+            gallery = self.build(precision)
+            student_ids, _, scores = gallery.search_batch(self.queries)
+            self.assertEqual(student_ids, exact_ids)
+            # Candidates are re-scored in float32, so scores are exact too
+            np.testing.assert_allclose(scores, exact_scores, atol=1e-5)
+            self.assertEqual(gallery.measure_recall(), 1.0)
+
+    def test_compact_codes(self):
+        gallery = self.build('int8')
+        self.assertEqual(gallery.backend.codes.dtype, np.int8)
+        self.assertLess(gallery.backend.stats()["memory_bytes"], gallery.matrix.nbytes / 3)
+        approximate = gallery.backend.scores(gallery.normalize(self.queries[:5]))
+        exact = gallery.normalize(self.queries[:5]) @ gallery.matrix.T
+        self.assertLess(np.abs(approximate - exact).max(), 0.02)
+
+    def test_incremental_updates(self):
+        gallery = self.build('int8', rerank_k=3)
+        for i in range(0, 2000, 5):
+            gallery.remove(f"s{i}")
+        new_embeddings = self.rng.standard_normal((100, 512)).astype(np.float32)
+        for i, embedding in enumerate(new_embeddings):
+            gallery.upsert(f"new{i}", None, None, embedding)
+        gallery.upsert("s1", None, None, new_embeddings[0] * -1)
+
+        # Codes stay aligned with the rows of the float32 matrix
+        backend = gallery.backend
+        decoded = backend.codes[:gallery.size] * backend.scales[:gallery.size, np.newaxis]
+        self.assertLess(np.abs(decoded - gallery.matrix).max(), 0.01)
+        self.assertEqual(gallery.search(new_embeddings[7])[0], "new7")
+        self.assertEqual(gallery.search(-new_embeddings[0])[0], "s1")
+        self.assertEqual(gallery.search(self.embeddings[2])[0], "s2")
+        self.assertNotEqual(gallery.search(self.embeddings[5])[0], "s5")
+
+        # Top-k fetches at least k candidates even when rerank_k is smaller
+        student_ids, _, _ = gallery.search_topk(self.embeddings[2], k=5)
+        self.assertEqual(len(student_ids[0]), 5)
+        self.assertEqual(student_ids[0][0], "s2")
+
+    def test_topk_with_single_candidate(self):
+        # With rerank_k=1 a margin check still needs the runner-up
+        gallery = self.build('int8', rerank_k=1)
+        exact_ids, _, exact_scores = self.exact.search_topk(self.queries[:20], k=2)
+        student_ids, _, scores = gallery.search_topk(self.queries[:20], k=2)
+        self.assertTrue(all(len(ids) == 2 for ids in student_ids))
+        self.assertEqual([ids[0] for ids in student_ids], [ids[0] for ids in exact_ids])
+        np.testing.assert_allclose([s[0] for s in scores], [s[0] for s in exact_scores], atol=1e-5)
+
+    def test_spilled_matrix(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            gallery = GalleryIndex(backend=QuantizedIndex('int8'), spill_dir=spill_dir)
+            gallery.build((f"s{i}", None, i % 4, e) for i, e in enumerate(self.embeddings))
+            # The rows live in an already deleted file rather than in private memory
+            self.assertEqual(os.listdir(spill_dir), [])
+            self.assertTrue(gallery.stats()["spilled"])
+            self.assertFalse(gallery.matrix.flags.owndata)
+            exact_ids, _, exact_scores = self.exact.search_batch(self.queries)
+            student_ids, _, scores = gallery.search_batch(self.queries)
+            self.assertEqual(student_ids, exact_ids)
+            np.testing.assert_allclose(scores, exact_scores, atol=1e-5)
+
+            # Growing past the file's capacity moves the rows to a larger file
+            new_embeddings = self.rng.standard_normal((10, 512)).astype(np.float32)
+            for i, embedding in enumerate(new_embeddings):
+                gallery.upsert(f"new{i}", None, 5, embedding)
+            gallery.remove("s0")
+            self.assertTrue(gallery.stats()["spilled"])
+            self.assertEqual(gallery.search(new_embeddings[4])[0], "new4")
+            self.assertEqual(gallery.search(new_embeddings[4], group_ids=[5])[0], "new4")
+            self.assertEqual(gallery.search(self.embeddings[6], group_ids=[2])[0], "s6")
+            self.assertEqual(gallery._partition_cache, {})
+            self.assertEqual(gallery.measure_recall(), 1.0)
+
+
+class GalleryStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = GalleryStore(os.path.join(self.tmpdir.name, 'gallery.bin'))
+        self.rng = np.random.default_rng(3)
+        self.embeddings = self.rng.standard_normal((30, 512)).astype(np.float32)
+        self.gallery = GalleryIndex()
+        self.gallery.build((f"s{i}", f"Student {i}", i % 3 or None, e) for i, e in enumerate(self.embeddings))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def load_gallery(self, store):
+        data = store.load()
+        gallery = GalleryIndex()
+        gallery.load(data.matrix, data.student_ids, data.names, data.group_ids)
+        return gallery, data
+
+    def test_missing_file(self):
+        self.assertIsNone(self.store.load())
+        self.assertFalse(self.store.has_changed())
+
+    def test_publish_and_load(self):
+        with self.store.lock():
+            self.assertEqual(self.store.publish(self.gallery, [30, None]), 1)
+            self.assertEqual(self.store.publish(self.gallery, [30, None]), 2)
+
+        # A second worker maps the same file
+        other = GalleryStore(self.store.path)
+        self.assertTrue(other.has_changed())
+        gallery, data = self.load_gallery(other)
+        self.assertFalse(other.has_changed())
+        self.assertEqual(data.generation, 2)
+        self.assertEqual(data.signature, [30, None])
+        self.assertIsInstance(data.matrix, np.memmap)
+        self.assertFalse(data.matrix.flags.writeable)
+        np.testing.assert_array_equal(gallery.matrix, self.gallery.matrix)
+        self.assertEqual(gallery.student_ids, self.gallery.student_ids)
+        self.assertEqual(gallery.group_ids, self.gallery.group_ids)
+        self.assertEqual(gallery.search(self.embeddings[5], group_ids=[2])[0], "s5")
+
+        # Publishing a new version is visible to the other worker
+        self.gallery.remove("s0")
+        with self.store.lock():
+            self.store.publish(self.gallery)
+        self.assertTrue(other.has_changed())
+        self.assertEqual(self.load_gallery(other)[0].size, 29)
+
+    def test_changes_copy_mapped_matrix(self):
+        with self.store.lock():
+            self.store.publish(self.gallery)
+        gallery, data = self.load_gallery(self.store)
+
+        new_embedding = self.rng.standard_normal(512).astype(np.float32)
+        gallery.upsert("s4", "Student 4", 1, new_embedding)
+        gallery.upsert("new", "New", None, -new_embedding)
+        gallery.remove("s9")
+        self.assertTrue(gallery.matrix.flags.writeable)
+        self.assertEqual(gallery.search(new_embedding)[0], "s4")
+        self.assertEqual(gallery.search(-new_embedding)[0], "new")
+
+        # The file itself is untouched
+        self.assertEqual(self.load_gallery(self.store)[0].search(self.embeddings[4])[0], "s4")
+        np.testing.assert_array_equal(data.matrix, self.gallery.matrix)
+
+    def test_publishes_trained_backend(self):
+        rng = np.random.default_rng(5)
+        embeddings = rng.standard_normal((600, 512)).astype(np.float32)
+        for backend in (IVFIndex(nlist=8, min_train_size=200), QuantizedIndex('int8', rerank_k=5)):
+            published = GalleryIndex(backend=backend)
+            published.build((f"s{i}", None, None, e) for i, e in enumerate(embeddings))
+            with self.store.lock():
+                self.store.publish(published)
+
+            # Another worker maps the trained state instead of training or encoding again
+            data = self.store.load()
+            gallery = GalleryIndex(backend=type(backend)(**self.backend_config(backend)))
+            with mock.patch.object(IVFIndex, '_train', side_effect=AssertionError("retrained")), \
+                    mock.patch.object(QuantizedIndex, '_encode', side_effect=AssertionError("re-encoded")):
+                gallery.load(data.matrix, data.student_ids, data.names, data.group_ids, data.backend)
+            self.assertTrue(gallery.backend.is_trained)
+            self.assertEqual(gallery.backend.stats(), published.backend.stats())
+            for i in (0, 300, 599):
+                self.assertEqual(gallery.search(embeddings[i])[0], f"s{i}")
+
+            # Local changes work on the mapped (read-only) state
+            self.assertFalse(any(array.flags.writeable for array in data.backend[1].values()))
+            gallery.upsert("new", None, None, -embeddings[0])
+            gallery.remove("s1")
+            self.assertEqual(gallery.search(-embeddings[0])[0], "new")
+            self.assertEqual(gallery.search(embeddings[599])[0], "s599")
+
+    @staticmethod
+    def backend_config(backend):
+        if isinstance(backend, IVFIndex):
+            return {"nlist": backend.nlist, "min_train_size": backend.min_train_size}
+        return {"precision": backend.precision, "rerank_k": backend.rerank_k}
+
+    def test_rebuilds_mismatched_backend(self):
+        gallery = GalleryIndex(backend=IVFIndex(nlist=4, min_train_size=10))
+        gallery.build((f"s{i}", None, None, e) for i, e in enumerate(self.embeddings))
+        with self.store.lock():
+            self.store.publish(gallery)
+
+        # A worker configured with another seed trains its own index
+        data = self.store.load()
+        other = GalleryIndex(backend=IVFIndex(nlist=4, min_train_size=10, seed=1))
+        with mock.patch.object(IVFIndex, '_train', autospec=True, side_effect=IVFIndex._train) as train:
+            other.load(data.matrix, data.student_ids, data.names, data.group_ids, data.backend)
+        self.assertTrue(train.called)
+        self.assertTrue(other.backend_ready)
+        self.assertEqual(other.search(self.embeddings[3])[0], "s3")
+
+        # Files without a backend section still load
+        with self.store.lock():
+            self.store.publish(self.gallery)
+        self.assertIsNone(self.store.load().backend)
+
+    def test_rejects_invalid_file(self):
+        with open(self.store.path, 'wb') as f:
+            f.write(b'not a gallery file' * 10)
+        with self.assertRaises(ValueError):
+            self.store.load()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+import cv2
+import numpy as np
+from app.utils.image_io import ImageDecodeError, image_dimensions, load_image, reduction_factor
+
+class ImageIOTestCase(unittest.TestCase):
+    def setUp(self):
+        gradient = np.linspace(0, 255, 4000, dtype=np.float32)
+        self.bgr = np.dstack([
+            np.tile(gradient, (3000, 1)),
+            np.tile(gradient[:3000, np.newaxis], (1, 4000)),
+            np.full((3000, 4000), 64, dtype=np.float32)
+        ]).astype(np.uint8)
+        self.jpeg = cv2.imencode('.jpg', self.bgr)[1].tobytes()
+    
+    def test_reduction_factor(self):
+        self.assertEqual(reduction_factor(4000, 3000, 1024), 2)
+        self.assertEqual(reduction_factor(4000, 3000, 480), 8)
+        self.assertEqual(reduction_factor(16000, 12000, 100), 8)
+        self.assertEqual(reduction_factor(800, 600, 1024), 1)
+    
+    def test_reduced_decode_matches_full_decode(self):
+        self.assertEqual(image_dimensions(self.jpeg), (4000, 3000))
+        img = load_image(self.jpeg, 1024)
+        self.assertEqual(img.shape, (768, 1024, 3))
+        
+        full = cv2.resize(cv2.imdecode(np.frombuffer(self.jpeg, np.uint8), cv2.IMREAD_COLOR), (1024, 768),
+                          interpolation=cv2.INTER_AREA)
+        np.testing.assert_allclose(img.astype(np.float32), full[:, :, ::-1].astype(np.float32), atol=6)
+    
+    def test_arrays_and_small_images(self):
+        img = load_image(self.bgr[:300, :400], 1024)
+        np.testing.assert_array_equal(img, self.bgr[:300, :400, ::-1])
+    
+    def test_invalid_data(self):
+        self.assertIsNone(image_dimensions(b'not an image'))
+        with self.assertRaises(ImageDecodeError):
+            load_image(b'not an image', 1024)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+import onnxruntime
+from app.services.inference_runtime import available_cores, model_pack, runtime_settings, session_options, thread_budget
+
+class InferenceRuntimeTestCase(unittest.TestCase):
+    def test_thread_budget(self):
+        cores = available_cores()
+        self.assertEqual(thread_budget({'FACE_WORKER_COUNT': 1}), cores)
+        self.assertEqual(thread_budget({'FACE_WORKER_COUNT': cores * 2}), 1)
+        self.assertEqual(thread_budget({'FACE_WORKER_COUNT': 3, 'FACE_CPU_THREADS': 2}), 2)
+    
+    def test_session_options(self):
+        settings = runtime_settings({
+            'FACE_CPU_THREADS': 2,
+            'FACE_ORT_GRAPH_OPTIMIZATION': 'basic',
+            'FACE_ORT_EXECUTION_MODE': 'parallel',
+            'FACE_ORT_CPU_MEM_ARENA': False,
+        })
+        options = session_options(settings)
+        self.assertEqual(options.intra_op_num_threads, 2)
+        self.assertEqual(options.inter_op_num_threads, 1)
+        self.assertEqual(options.graph_optimization_level, onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC)
+        self.assertEqual(options.execution_mode, onnxruntime.ExecutionMode.ORT_PARALLEL)
+        self.assertFalse(options.enable_cpu_mem_arena)
+        
+        # Tiles split the budget between up to four sessions
+        self.assertEqual(settings['tile_workers'], 2)
+        self.assertEqual(settings['tile_intra_op_threads'], 1)
+        settings = runtime_settings({'FACE_CPU_THREADS': 8})
+        self.assertEqual((settings['tile_workers'], settings['tile_intra_op_threads']), (4, 2))
+        settings = runtime_settings({'FACE_CPU_THREADS': 8, 'FACE_ORT_TILE_INTRA_OP_THREADS': 3})
+        self.assertEqual(settings['tile_intra_op_threads'], 3)
+        
+        settings['graph_optimization'] = 'fastest'
+        with self.assertRaises(ValueError):
+            session_options(settings)
+    
+    def test_model_pack(self):
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, 'models', 'retinaface'))
+            self.assertEqual(model_pack(root, 'retinaface'), ('retinaface', 'float32'))
+            # Falls back to the float models until the quantized copy exists
+            self.assertEqual(model_pack(root, 'retinaface', 'int8'), ('retinaface', 'float32'))
+            os.makedirs(os.path.join(root, 'models', 'retinaface-int8'))
+            open(os.path.join(root, 'models', 'retinaface-int8', 'det_500m.onnx'), 'wb').close()
+            self.assertEqual(model_pack(root, 'retinaface', 'int8'), ('retinaface-int8', 'int8'))
+            with self.assertRaises(ValueError):
+                model_pack(root, 'retinaface', 'fp8')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import numpy as np
+from insightface.app.common import Face
+from app import create_app
+from app.services.face_service import FaceService
+from app.services.inference_client import RemoteFaceAnalysis, RemoteRecognizer
+from app.services.inference_protocol import FRAME, InferenceError, recv_message, send_message
+
+class InferenceProtocolTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        left, right = socket.socketpair()
+        with left, right:
+            image = np.arange(2 * 3 * 3, dtype=np.uint8).reshape(2, 3, 3)
+            boxes = np.random.default_rng(0).random((4, 5), dtype=np.float32)
+            no_faces = np.zeros((0, 5), dtype=np.float32)
+            send_message(left, {"op": "detect", "input_size": [320, 320]}, [image, boxes, no_faces])
+            header, arrays = recv_message(right)
+        self.assertEqual(header, {"op": "detect", "input_size": [320, 320]})
+        np.testing.assert_array_equal(arrays[0], image)
+        np.testing.assert_array_equal(arrays[1], boxes)
+        self.assertEqual(arrays[2].shape, (0, 5))
+    
+    def test_object_arrays_are_refused(self):
+        left, right = socket.socketpair()
+        with left, right:
+            header = json.dumps({"op": "embed", "arrays": [{"dtype": "|O", "shape": [1]}]}).encode('utf-8')
+            left.sendall(FRAME.pack(len(header), 8) + header + bytes(8))
+            with self.assertRaises(InferenceError):
+                recv_message(right)
+
+class RemoteRecognizerTestCase(unittest.TestCase):
+    def test_get_embeds_one_face(self):
+        # Stands in for the server: the "embedding" is the first 512 values of each crop
+        class Client:
+            def request(self, op, arrays=()):
+                self.crops = arrays[0]
+                return {}, [arrays[0].reshape(arrays[0].shape[0], -1)[:, :512].astype(np.float32)]
+        
+        client = Client()
+        recognizer = RemoteRecognizer(client, {'input_size': [112, 112], 'input_shape': [None, 3, 112, 112]})
+        img = np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+        kps = np.array([[250, 200], [330, 200], [290, 250], [260, 300], [320, 300]], dtype=np.float32)
+        face = Face(bbox=np.array([200, 150, 380, 350]), kps=kps)
+        embedding = recognizer.get(img, face)
+        self.assertEqual(client.crops.shape, (1, 112, 112, 3))
+        self.assertEqual(embedding.shape, (512,))
+        np.testing.assert_array_equal(face.embedding, embedding)
+
+class InferenceServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.face_service = FaceService()
+        if not self.face_service.initialize() or self.face_service.remote:
+            self.skipTest("Face model not available")
+    
+    def tearDown(self):
+        self.app_context.pop()
+    
+    def test_remote_detection_matches_local(self):
+        socket_path = os.path.join(tempfile.mkdtemp(), 'inference.sock')
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'app.services.inference_server', '--socket', socket_path,
+             '--processes', '1', '--config', 'test'],
+            cwd=os.path.join(os.path.dirname(__file__), '..'), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            deadline = time.time() + 60
+            while not os.path.exists(socket_path) and time.time() < deadline:
+                time.sleep(0.1)
+            remote = RemoteFaceAnalysis(socket_path, timeout=60)
+            self.assertEqual(sorted(remote.models), self.face_service.active_modules())
+            
+            rng = np.random.default_rng(0)
+            img = rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)
+            local_boxes, _ = self.face_service.model.det_model.detect(img, input_size=(640, 640), max_num=0)
+            remote_boxes, _ = remote.det_model.detect(img, input_size=(640, 640), max_num=0)
+            np.testing.assert_allclose(remote_boxes, local_boxes, atol=1e-3)
+        finally:
+            server.terminate()
+            server.wait(10)
+
+if __name__ == '__main__':
+    unittest.main()
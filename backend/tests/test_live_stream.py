@@ -0,0 +1,57 @@
+import json
+import unittest
+import cv2
+import numpy as np
+from app import create_app, db
+from app.api.attendance import live_stream
+from app.services.face_service import FaceService
+
+class FakeWebSocket:
+    """Replays client messages to the stream handler and collects its replies"""
+    
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.sent = []
+    
+    def receive(self, timeout=None):
+        return self.messages.pop(0) if self.messages else None
+    
+    def send(self, data):
+        self.sent.append(json.loads(data))
+
+class LiveStreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('test')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.frame = cv2.imencode('.jpg', np.full((240, 320, 3), 128, dtype=np.uint8))[1].tobytes()
+    
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+    
+    def test_unauthorized(self):
+        ws = FakeWebSocket([json.dumps({"token": "wrong"}), self.frame])
+        with self.app.test_request_context('/api/v1/attendance/live/stream'):
+            live_stream(ws)
+        self.assertEqual(ws.sent, [{"type": "error", "message": "Unauthorized"}])
+    
+    def test_frames_get_results(self):
+        if not FaceService().initialize():
+            self.skipTest("Face model not available")
+        ws = FakeWebSocket([json.dumps({"token": "test_token", "session_id": "kiosk-1"}), self.frame, self.frame, "close"])
+        with self.app.test_request_context('/api/v1/attendance/live/stream'):
+            live_stream(ws)
+        self.assertEqual(ws.sent[0], {"type": "ready", "session_id": "kiosk-1"})
+        self.assertEqual([reply["frame"] for reply in ws.sent[1:]], [1, 2])
+        self.assertEqual(ws.sent[1]["type"], "result")
+        self.assertEqual(ws.sent[1]["recognized"], [])
+        self.assertTrue(ws.sent[1]["attendance_recorded"])
+        # The unchanged second frame reuses the first result without recording attendance again
+        self.assertTrue(ws.sent[2]["skipped"])
+        self.assertFalse(ws.sent[2]["attendance_recorded"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+import unittest
+from app.utils.metrics import Metrics
+
+class MetricsTestCase(unittest.TestCase):
+    def test_counters(self):
+        metrics = Metrics()
+        metrics.increment('live_frames_skipped')
+        metrics.increment('live_frames_skipped', 2)
+        self.assertEqual(metrics.get('live_frames_skipped'), 3)
+        self.assertEqual(metrics.get('live_frames_processed'), 0)
+        self.assertEqual(metrics.snapshot()["counters"], {'live_frames_skipped': 3})
+        metrics.reset()
+        self.assertEqual(metrics.snapshot()["counters"], {})
+    
+    def test_histograms(self):
+        metrics = Metrics()
+        for value in (0.2, 1.5, 3, 400):
+            metrics.observe('queue_wait_ms', value, buckets=(1, 2, 5))
+        histogram = metrics.snapshot()["histograms"]["queue_wait_ms"]
+        self.assertEqual(histogram["buckets"], {"le_1": 1, "le_2": 1, "le_5": 1, "le_inf": 1})
+        self.assertEqual(histogram["count"], 4)
+        self.assertAlmostEqual(histogram["sum"], 404.7)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import threading
+import unittest
+import numpy as np
+from app.services.micro_batcher import MicroBatcher
+
+class MicroBatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+    
+    def double(self, items):
+        self.batches.append(len(items))
+        return np.array(items) * 2
+    
+    def test_concurrent_requests_share_a_batch(self):
+        batcher = MicroBatcher(self.double, max_batch=16, max_wait_ms=200)
+        results = {}
+        start = threading.Barrier(4)
+        
+        def submit(i):
+            start.wait()
+            results[i] = batcher.submit([i * 10, i * 10 + 1])
+        
+        threads = [threading.Thread(target=submit, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        # Every request gets back its own rows
+        for i in range(4):
+            np.testing.assert_array_equal(results[i], [i * 20, i * 20 + 2])
+        self.assertEqual(sum(self.batches), 8)
+        self.assertLess(len(self.batches), 4)
+    
+    def test_large_requests_are_chunked(self):
+        batcher = MicroBatcher(self.double, max_batch=4, max_wait_ms=0)
+        np.testing.assert_array_equal(batcher.submit(list(range(10))), np.arange(10) * 2)
+        self.assertEqual(self.batches, [4, 4, 2])
+    
+    def test_errors_reach_the_caller(self):
+        def fail(items):
+            raise RuntimeError("model failed")
+        batcher = MicroBatcher(fail, max_wait_ms=0)
+        with self.assertRaises(RuntimeError):
+            batcher.submit([1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+import numpy as np
+from app.services.motion_gate import MotionGate
+
+class MotionGateTestCase(unittest.TestCase):
+    def setUp(self):
+        gradient = np.tile(np.linspace(40, 200, 320, dtype=np.uint8), (240, 1))
+        self.frame = np.dstack([gradient] * 3)
+    
+    def test_unchanged_frames_reuse_result(self):
+        gate = MotionGate()
+        thumbnail = gate.thumbnail(self.frame)
+        self.assertTrue(gate.is_changed(thumbnail))
+        self.assertEqual(gate.remember(thumbnail, {"recognized": [{"student_id": "s1"}]}), 0)
+        
+        # Sensor noise does not count as a change
+        noisy = np.clip(self.frame.astype(np.int16) + 3, 0, 255).astype(np.uint8)
+        self.assertFalse(gate.is_changed(gate.thumbnail(noisy)))
+        cached = gate.cached_result()
+        self.assertTrue(cached["skipped"])
+        self.assertEqual(cached["skipped_frames"], 1)
+        
+        # The cached result is a copy
+        cached["recognized"].clear()
+        self.assertEqual(len(gate.cached_result()["recognized"]), 1)
+        
+        # Someone stepping into a corner of the frame is a change
+        moved = self.frame.copy()
+        moved[:80, :60] = 0
+        thumbnail = gate.thumbnail(moved)
+        self.assertTrue(gate.is_changed(thumbnail))
+        self.assertEqual(gate.remember(thumbnail, {"recognized": []}), 2)
+    
+    def test_result_expires(self):
+        gate = MotionGate(max_age=0)
+        thumbnail = gate.thumbnail(self.frame)
+        gate.remember(thumbnail, {"recognized": []})
+        self.assertTrue(gate.is_changed(gate.thumbnail(self.frame)))
+
+if __name__ == '__main__':
+    unittest.main()
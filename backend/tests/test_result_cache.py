@@ -0,0 +1,50 @@
+import unittest
+from app.services.result_cache import ResultCache, content_key
+from app.utils.metrics import metrics
+
+class ResultCacheTestCase(unittest.TestCase):
+    def test_content_key(self):
+        self.assertEqual(content_key(b'frame', 'live'), content_key(bytearray(b'frame'), 'live'))
+        self.assertNotEqual(content_key(b'frame', 'live'), content_key(b'frame!', 'live'))
+        # The same bytes detected with another profile give other faces
+        self.assertNotEqual(content_key(b'frame', 'live'), content_key(b'frame', 'group'))
+    
+    def test_hits_and_misses(self):
+        metrics.reset()
+        cache = ResultCache(max_bytes=1000)
+        self.assertIsNone(cache.get('a'))
+        self.assertTrue(cache.put('a', 'result', 100))
+        self.assertEqual(cache.get('a'), 'result')
+        self.assertEqual(cache.get('a'), 'result')
+        
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"], stats["bytes"]), (2, 1, 1, 100))
+        self.assertEqual(stats["hit_rate"], 0.667)
+        self.assertEqual(metrics.get('result_cache_hits'), 2)
+        self.assertEqual(metrics.get('result_cache_misses'), 1)
+    
+    def test_memory_cap_evicts_least_recently_used(self):
+        metrics.reset()
+        cache = ResultCache(max_bytes=300)
+        for key in 'abc':
+            cache.put(key, key.upper(), 100)
+        # Using 'a' makes 'b' the least recently used entry
+        cache.get('a')
+        cache.put('d', 'D', 100)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([cache.get(key) for key in 'acd'], ['A', 'C', 'D'])
+        self.assertEqual(cache.nbytes, 300)
+        
+        # Replacing an entry frees its old size first
+        cache.put('a', 'AA', 200)
+        self.assertEqual((len(cache), cache.nbytes), (2, 300))
+        self.assertEqual(metrics.get('result_cache_evictions'), 2)
+        
+        # A value larger than the whole cache is not cached
+        self.assertFalse(cache.put('e', 'E', 301))
+        self.assertIsNone(cache.get('e'))
+        cache.clear()
+        self.assertEqual((len(cache), cache.nbytes), (0, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import cv2
+import numpy as np
+from app.services.tiled_detection import tile_origins, merge_detections, detect_tiled
+
+class BrightSquareDetector:
+    """Stand-in detector that reports every fully visible 40x40 bright square in its input"""
+    
+    def detect(self, img, input_size=None, max_num=0):
+        mask = (img[:, :, 0] > 128).astype(np.uint8)
+        _, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        boxes = [[x, y, x + w, y + h, 0.9] for x, y, w, h, _ in stats[1:] if w == 40 and h == 40]
+        bboxes = np.array(boxes, dtype=np.float32).reshape(-1, 5)
+        kpss = np.repeat(bboxes[:, np.newaxis, :2], 5, axis=1)
+        return bboxes, kpss
+
+class TiledDetectionTestCase(unittest.TestCase):
+    def test_tile_origins(self):
+        self.assertEqual(tile_origins(500, 640, 96), [0])
+        self.assertEqual(tile_origins(1000, 640, 96), [0, 360])
+        origins = tile_origins(4000, 640, 96)
+        self.assertEqual(origins[-1], 4000 - 640)
+        self.assertTrue(all(b - a <= 640 - 96 for a, b in zip(origins, origins[1:])))
+    
+    def test_merge_detections(self):
+        bboxes = np.array([
+            [0, 0, 100, 100, 0.9],
+            [5, 5, 105, 105, 0.8],     # same face from a neighbouring tile
+            [0, 0, 100, 40, 0.7],      # partial face cut by a tile seam
+            [300, 300, 350, 350, 0.6]
+        ], dtype=np.float32)
+        kpss = np.arange(4 * 5 * 2, dtype=np.float32).reshape(4, 5, 2)
+        merged, merged_kpss = merge_detections(bboxes, kpss)
+        np.testing.assert_array_equal(merged[:, 4], np.array([0.9, 0.6], dtype=np.float32))
+        np.testing.assert_array_equal(merged_kpss, kpss[[0, 3]])
+        empty, _ = merge_detections(np.empty((0, 5), dtype=np.float32), None)
+        self.assertEqual(empty.shape, (0, 5))
+    
+    def test_detect_tiled(self):
+        img = np.zeros((700, 1300, 3), dtype=np.uint8)
+        # One square inside a tile, one across a vertical seam and one at the far corner
+        for x, y in ((50, 50), (620, 300), (1250, 650)):
+            img[y:y + 40, x:x + 40] = 255
+        for workers in (1, 3):
+            bboxes, kpss, tiles = detect_tiled(BrightSquareDetector(), img, (640, 640), 640, 96, workers)
+            self.assertEqual(tiles, 3 * 2)
+            found = sorted((int(x), int(y)) for x, y in bboxes[:, :2])
+            self.assertEqual(found, [(50, 50), (620, 300), (1250, 650)])
+            np.testing.assert_array_equal(kpss[:, 0, :], bboxes[:, :2])
+
+if __name__ == '__main__':
+    unittest.main()
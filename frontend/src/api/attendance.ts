@@ -7,6 +7,7 @@ export interface RecognizedStudent {
   group_id?: number;
   group_name?: string;
   score: number;
+  track_id?: number;
   action?: 'checkin' | 'checkout';
   timestamp?: string;
   bbox?: number[]; // Bounding box coordinates [x1, y1, x2, y2]
@@ -18,12 +19,26 @@ export interface UnrecognizedFace {
   score: number;
 }
 
+export interface RejectedFace {
+  id: string;
+  bbox: number[]; // Bounding box coordinates [x1, y1, x2, y2]
+  reason: 'max_faces' | 'too_small' | 'eyes_too_close' | 'pose' | 'blurred';
+}
+
 export interface LiveAttendanceResponse {
   recognized: RecognizedStudent[];
   unrecognized_count: number;
   unrecognized_faces: UnrecognizedFace[];
   processing_time_ms: number;
   total_faces?: number;
+  rejected_count?: number;
+  rejected_faces?: RejectedFace[];
+  cache_hit?: boolean; // Same image as an earlier submission; detection and embedding were reused
+  // An unchanged camera frame (session_id) repeats the last processed frame's result: its
+  // recognized entries are stale and have no action, and attendance was not recorded again
+  skipped?: boolean;
+  skipped_frames?: number; // Frames that reused the last result; on a processed frame, those skipped before it
+  attendance_recorded?: boolean; // False for skipped frames
   error?: boolean;
   errorMessage?: string;
 }
@@ -34,6 +49,7 @@ export interface UploadAttendanceResponse {
   unrecognized_faces?: UnrecognizedFace[];
   processing_time_ms?: number;
   total_faces?: number;
+  cache_hit?: boolean;
 }
 
 export interface AttendanceRecord {
@@ -75,10 +91,18 @@ export interface EmbeddingDebugInfo {
 }
 
 // Live attendance capture with improved error handling and timeout
-export const submitLiveAttendance = async (imageBlob: Blob, retryCount = 0): Promise<LiveAttendanceResponse> => {
+// Pass groupIds to only match students of those groups, and the same sessionId
+// for every frame of a camera so the backend can track faces between frames
+export const submitLiveAttendance = async (imageBlob: Blob, retryCount = 0, groupIds?: number[], sessionId?: string): Promise<LiveAttendanceResponse> => {
   try {
     const formData = new FormData();
     formData.append('image', imageBlob, 'capture.jpg');
+    if (groupIds && groupIds.length > 0) {
+      formData.append('group_ids', groupIds.join(','));
+    }
+    if (sessionId) {
+      formData.append('session_id', sessionId);
+    }
 
     const response = await apiClient.post('/attendance/live', formData, {
       headers: {
@@ -110,7 +134,7 @@ export const submitLiveAttendance = async (imageBlob: Blob, retryCount = 0): Pro
       console.log(`Retrying live attendance (attempt ${retryCount + 1})...`);
       // Wait 1 second before retry
       await new Promise(resolve => setTimeout(resolve, 1000));
-      return submitLiveAttendance(imageBlob, retryCount + 1);
+      return submitLiveAttendance(imageBlob, retryCount + 1, groupIds, sessionId);
     }
 
     // Return a fallback response to prevent UI errors
@@ -126,9 +150,13 @@ export const submitLiveAttendance = async (imageBlob: Blob, retryCount = 0): Pro
 };
 
 // Upload group photo for attendance
-export const uploadGroupAttendance = async (image: File): Promise<UploadAttendanceResponse> => {
+// Pass groupIds to only match students of those groups
+export const uploadGroupAttendance = async (image: File, groupIds?: number[]): Promise<UploadAttendanceResponse> => {
   const formData = new FormData();
   formData.append('image', image);
+  if (groupIds && groupIds.length > 0) {
+    formData.append('group_ids', groupIds.join(','));
+  }
 
   const response = await api.post('/attendance/upload', formData, {
     headers: {
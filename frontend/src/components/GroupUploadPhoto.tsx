@@ -58,7 +58,7 @@ const GroupUploadPhoto: React.FC<GroupUploadPhotoProps> = ({ groupId }) => {
     const timer = setInterval(() => setUploadProgress(prev => Math.min(prev + 1, 95)), 300);
 
     try {
-      const response = await uploadGroupAttendance(selectedFile);
+      const response = await uploadGroupAttendance(selectedFile, groupId > 0 ? [groupId] : undefined);
       clearInterval(timer);
       setUploadProgress(100);
       
@@ -79,7 +79,7 @@ const GroupUploadPhoto: React.FC<GroupUploadPhotoProps> = ({ groupId }) => {
     } finally {
       setTimeout(() => setIsUploading(false), 500); // give time for progress bar to finish
     }
-  }, [selectedFile, toast]);
+  }, [selectedFile, groupId, toast]);
 
   return (
     <Card className="shadow-lg rounded-xl">
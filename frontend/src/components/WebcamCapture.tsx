@@ -69,6 +69,8 @@ const WebcamCapture: React.FC<WebcamCaptureProps> = ({ groupId, onFaceRecognized
   const { toast } = useToast();
 
   const frameCount = useRef(0);
+  // Identifies this camera's frames so the backend can track faces between them
+  const cameraSessionId = useRef(`cam-${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 8)}`);
   const lastFpsTime = useRef(Date.now());
 
   const videoConstraints = {
@@ -343,7 +345,7 @@ const WebcamCapture: React.FC<WebcamCaptureProps> = ({ groupId, onFaceRecognized
       setLastCapture(imageSrc);
       const base64Response = await fetch(imageSrc);
       const blob = await base64Response.blob();
-      const response = await submitLiveAttendance(blob);
+      const response = await submitLiveAttendance(blob, 0, groupId > 0 ? [groupId] : undefined, cameraSessionId.current);
 
       if (response.error) {
         const isTimeoutError = response.errorMessage?.includes('timeout') || response.errorMessage?.includes('too many faces');
@@ -392,7 +394,7 @@ const WebcamCapture: React.FC<WebcamCaptureProps> = ({ groupId, onFaceRecognized
       isProcessing.current = false;
       clearTimeout(safetyTimeout);
     }
-  }, [toast, onFaceRecognized, updateTrackedStudents, captureScreenshot, useIpCamera]);
+  }, [groupId, toast, onFaceRecognized, updateTrackedStudents, captureScreenshot, useIpCamera]);
 
   const startAutoCapture = useCallback(() => {
     setIsCapturing(true);